@@ -58,6 +58,8 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',  # ⚠️ doit être en haut
     'django.middleware.security.SecurityMiddleware',
+    # Before anything that reads or changes the response body
+    'shop.compression.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -135,6 +137,11 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
+    # Same output as rest_framework.renderers.JSONRenderer, faster with orjson
+    'DEFAULT_RENDERER_CLASSES': [
+        'shop.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
 
 
@@ -189,3 +196,107 @@ CSRF_TRUSTED_ORIGINS = [
     "http://localhost:3000",
     "http://localhost:5173",
 ]
+
+
+# ===============================
+# CACHE
+# ===============================
+
+# Local memory is per process; with several workers or nodes use a shared
+# backend instead, e.g.
+#   'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+#   'LOCATION': 'redis://127.0.0.1:6379',
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'shop',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    }
+}
+
+
+# ===============================
+# SHOP
+# ===============================
+
+# Cache lifetime of products/facets/ results, per filter combination
+SHOP_FACETS_CACHE_TIMEOUT = 300
+
+# Cache lifetime of the per-category product stats shown by categories/;
+# entries are invalidated when one of the category's products changes
+SHOP_CATEGORY_STATS_CACHE_TIMEOUT = None
+
+# Cache-Control max-age of the public catalog endpoints
+SHOP_CATALOG_MAX_AGE = 60
+
+# Server-side cache of catalog responses, invalidated when products or
+# categories change
+SHOP_RESPONSE_CACHE_ALIAS = 'default'
+SHOP_RESPONSE_CACHE_TIMEOUT = 300
+
+# Serve product/category lists, the cart and orders through
+# shop.fast_serializers (same output, built from values() rows)
+SHOP_FAST_SERIALIZERS = False
+
+# Unpaginated lists with at least this many items are streamed, encoded
+# SHOP_JSON_STREAM_CHUNK_SIZE items at a time (shop.renderers)
+SHOP_JSON_STREAM_THRESHOLD = 1000
+SHOP_JSON_STREAM_CHUNK_SIZE = 500
+
+# Responses smaller than this are sent uncompressed. Levels per encoding
+# ('br' needs the brotli package): per request in CompressionMiddleware,
+# and for the variants stored with cached responses, compressed once.
+SHOP_COMPRESSION_MIN_SIZE = 500
+SHOP_COMPRESSION_LEVELS = {'br': 5, 'gzip': 6}
+SHOP_PRECOMPRESSION_LEVELS = {'br': 9, 'gzip': 9}
+
+# Rows read and encoded per chunk by the streamed exports (shop.exports)
+SHOP_EXPORT_CHUNK_SIZE = 2000
+
+# Resized copies of product images (shop.images), generated on save and by
+# `manage.py generate_image_derivatives`; 'avif' needs Pillow with libavif
+SHOP_IMAGE_WIDTHS = [200, 400, 800]
+SHOP_IMAGE_FORMATS = ['webp', 'jpeg']
+# BlurHash placeholder detail, horizontal x vertical components (1-9 each)
+SHOP_BLURHASH_COMPONENTS = (4, 3)
+
+# /media/resize/<w>x<h>/<path> (shop.resize): largest side served, and the
+# disk cache of resized images, trimmed least recently used first
+SHOP_RESIZE_MAX_SIZE = 2000
+SHOP_RESIZE_CACHE_DIR = BASE_DIR / 'resize_cache'
+SHOP_RESIZE_CACHE_MAX_BYTES = 1024 ** 3
+
+# Product recommendations (shop.recommendations), rebuilt by
+# `manage.py rebuild_recommendations`: neighbours kept per product, and the
+# fewest users (or orders) two products must share to be neighbours
+SHOP_RECOMMENDATIONS_PER_PRODUCT = 10
+SHOP_RECOMMENDATIONS_MIN_SUPPORT = 2
+
+# Trending score (shop.trending): what a like, a cart add and an ordered item
+# count, and how fast that fades. Run `manage.py rebuild_trending` after
+# changing either.
+SHOP_TRENDING_WEIGHTS = {'like': 1, 'cart': 2, 'order': 4}
+SHOP_TRENDING_HALF_LIFE_HOURS = 72
+
+# Similar books (shop.similarity), rebuilt by `manage.py rebuild_similarity`:
+# TF-IDF terms kept per product, and the most products a term may appear in
+# before it is too common to tell them apart
+SHOP_SIMILARITY_TERMS = 20
+SHOP_SIMILARITY_MAX_DF = 1000
+
+# Search box suggestions (shop.suggest), from an in-memory index in each
+# process: matches returned, how often other processes' saves are picked
+# up, and how often the index is rebuilt in the background
+SHOP_SUGGEST_LIMIT = 10
+SHOP_SUGGEST_SYNC_SECONDS = 5
+SHOP_SUGGEST_MAX_AGE = 3600
+
+# "Did you mean" for searches that find nothing (shop.spelling), rebuilt by
+# `manage.py rebuild_spelling`: dictionary size, how often a word must occur
+# to be in it, edits a correction may be away, corrections offered, and
+# whether the list shows the results of the first one
+SHOP_SPELLING_MAX_WORDS = 50000
+SHOP_SPELLING_MIN_COUNT = 2
+SHOP_SPELLING_MAX_DISTANCE = 2
+SHOP_SPELLING_SUGGESTIONS = 3
+SHOP_SPELLING_CORRECT_RESULTS = True
@@ -19,10 +19,17 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from shop.views import resize_image
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/accounts/', include('accounts.urls')),
     path('api/shop/', include('shop.urls')),
+    # Before the DEBUG media files below, which would shadow it
+    path(
+        f'{settings.MEDIA_URL.strip("/")}/resize/<int:width>x<int:height>/<path:path>',
+        resize_image, name='resize-image',
+    ),
 ]
 
 if settings.DEBUG:
@@ -18,6 +18,17 @@ class ProductAdmin(admin.ModelAdmin):
     prepopulated_fields = {'slug': ('name',)}
     search_fields = ['name', 'description']
     list_editable = ['is_featured', 'is_active', 'price', 'stock']
+    # Likes, carts and orders move these with F() updates: writing back the
+    # values the form was loaded with would undo the ones made meanwhile
+    counter_fields = {'likes_count', 'trending_score'}
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            return super().save_model(request, obj, form, change)
+        obj.save(update_fields=[
+            field.name for field in obj._meta.concrete_fields
+            if not field.primary_key and field.name not in self.counter_fields
+        ])
 
 
 class CartItemInline(admin.TabularInline):
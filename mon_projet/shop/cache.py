@@ -0,0 +1,214 @@
+"""
+Server-side caching of catalog responses.
+
+Entries are keyed on the request (path, sorted query string, host, Accept)
+plus the current version of each tag they depend on. Invalidating a tag
+replaces its version, so every entry built from the old one becomes
+unreachable and simply expires. Works with any Django cache backend; use a
+shared one (Redis, Memcached) when running several nodes. Compressed
+variants of each entry are cached next to it.
+"""
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import parse_http_date_safe
+
+from .compression import compress, get_level, get_min_size, is_compressible, negotiate, set_encoding
+
+
+STATS = ('hits', 'misses')
+
+
+def get_cache():
+    return caches[getattr(settings, 'SHOP_RESPONSE_CACHE_ALIAS', 'default')]
+
+
+def tag_key(tag):
+    return f'shop:tag:{tag}'
+
+
+def category_products_tag(category_id):
+    """Invalidated whenever one of the category's products changes"""
+    return f'category:{category_id}:products'
+
+
+def product_tag(slug):
+    """Invalidated whenever the product's likes change"""
+    return f'product:{slug}:likes'
+
+
+def category_likes_tag(slug):
+    """Invalidated whenever the likes of one of the category's products change"""
+    return f'category:{slug}:likes'
+
+
+# Invalidated whenever a product's likes or trending score change, for the
+# pages ordered by them
+RANKING_TAG = 'ranking'
+
+
+def stat_key(name):
+    return f'shop:response-cache:{name}'
+
+
+def get_tag_versions(tags):
+    cache = get_cache()
+    keys = [tag_key(tag) for tag in tags]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # A tag that was never set (or got evicted) starts a fresh version
+            cache.add(key, uuid.uuid4().hex, None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def versioned_key(prefix, value, tags):
+    """Cache key for value that changes whenever one of the tags is invalidated"""
+    raw = '|'.join([value] + get_tag_versions(tags))
+    return f'{prefix}:{hashlib.md5(raw.encode("utf-8")).hexdigest()}'
+
+
+def invalidate_tags(*tags):
+    """Invalidate tagged entries once the current transaction commits"""
+    def invalidate():
+        get_cache().set_many({tag_key(tag): uuid.uuid4().hex for tag in tags}, None)
+    transaction.on_commit(invalidate)
+
+
+def invalidate_counters(product, likes=True):
+    """
+    Invalidate the pages a product's likes_count or trending_score shows
+    in: those ordered by them and, for likes, its own and its category's.
+    Other cached lists keep the old likes_count until they expire, rather
+    than every like emptying the catalog cache.
+    """
+    tags = [RANKING_TAG]
+    if likes:
+        tags += [product_tag(product.slug), category_likes_tag(product.category.slug)]
+    invalidate_tags(*tags)
+
+
+def record(name):
+    cache = get_cache()
+    try:
+        cache.incr(stat_key(name))
+    except ValueError:
+        cache.set(stat_key(name), 1, None)
+
+
+def get_stats():
+    cache = get_cache()
+    values = cache.get_many([stat_key(name) for name in STATS])
+    return {name: values.get(stat_key(name), 0) for name in STATS}
+
+
+def reset_stats():
+    get_cache().delete_many([stat_key(name) for name in STATS])
+
+
+class CachedResponseMixin:
+    """
+    Serve the GET actions listed in cached_actions from the response cache.
+    Only for views whose output does not depend on the user.
+    """
+    cached_actions = ('list', 'retrieve')
+    cache_tags = ()
+
+    def get_cache_tags(self, request, action, kwargs):
+        """The tags the response of action depends on"""
+        return self.cache_tags
+
+    def get_response_cache_key(self, request, tags):
+        query = sorted(request.GET.lists())
+        value = '|'.join([
+            request.path,
+            repr(query),
+            request.get_host(),
+            request.META.get('HTTP_ACCEPT', ''),
+        ])
+        return versioned_key('shop:response', value, tags)
+
+    def dispatch(self, request, *args, **kwargs):
+        # self.action is only set once DRF initializes the request
+        action = self.action_map.get(request.method.lower())
+        if request.method != 'GET' or action not in self.cached_actions:
+            return super().dispatch(request, *args, **kwargs)
+
+        cache = get_cache()
+        key = self.get_response_cache_key(request, self.get_cache_tags(request, action, kwargs))
+        cached = cache.get(key)
+        if cached is not None:
+            record('hits')
+            content, status, headers = cached
+            response = HttpResponse(content, status=status)
+            for name, value in headers:
+                response[name] = value
+            response['X-Cache'] = 'HIT'
+
+            # Revalidate against the validators stored with the entry
+            if response.has_header('ETag') or response.has_header('Last-Modified'):
+                last_modified = response.get('Last-Modified')
+                response = get_conditional_response(
+                    request,
+                    etag=response.get('ETag'),
+                    last_modified=last_modified and parse_http_date_safe(last_modified),
+                    response=response,
+                )
+            if response.status_code == 200:
+                self.encode_response(request, response, key)
+            return response
+
+        record('misses')
+        response = super().dispatch(request, *args, **kwargs)
+        if response.status_code == 200:
+            if response.streaming:
+                response.streaming_content = self.cache_streamed(
+                    key, response.streaming_content, response.status_code, list(response.items())
+                )
+            else:
+                if hasattr(response, 'render'):
+                    response.render()
+                self.cache_response(key, response.content, response.status_code, list(response.items()))
+                self.encode_response(request, response, key)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def cache_response(self, key, content, status, headers):
+        get_cache().set(key, (content, status, headers), getattr(settings, 'SHOP_RESPONSE_CACHE_TIMEOUT', 300))
+
+    def cache_streamed(self, key, chunks, status, headers):
+        """Pass a streamed body through, caching it once fully sent"""
+        content = []
+        for chunk in chunks:
+            content.append(chunk)
+            yield chunk
+        self.cache_response(key, b''.join(content), status, headers)
+
+    def encode_response(self, request, response, key):
+        """
+        Compress the body with the variant cached next to the entry, so each
+        entry is compressed once per encoding (at a higher level than
+        CompressionMiddleware can afford per request).
+        """
+        if not is_compressible(response) or len(response.content) < get_min_size():
+            return
+
+        patch_vary_headers(response, ['Accept-Encoding'])
+        encoding = negotiate(request)
+        if encoding is None:
+            return
+
+        cache = get_cache()
+        variant_key = f'{key}:{encoding}'
+        content = cache.get(variant_key)
+        if content is None:
+            content = compress(response.content, encoding, get_level(encoding, precompressed=True))
+            cache.set(variant_key, content, getattr(settings, 'SHOP_RESPONSE_CACHE_TIMEOUT', 300))
+        response.content = content
+        set_encoding(response, encoding)
@@ -0,0 +1,146 @@
+"""
+Response compression (brotli when the brotli package is installed, gzip).
+
+CompressionMiddleware compresses JSON responses, streamed ones included,
+for clients that accept it. Only JSON: HTML pages (the admin, the browsable
+API) carry CSRF tokens next to text an attacker may inject, which is what
+BREACH guesses through compressed sizes; Django's GZipMiddleware pads them
+for that, this one leaves them alone. CachedResponseMixin uses the same
+helpers to keep compressed variants next to the cached responses, so cache
+hits are served without compressing again.
+"""
+import gzip
+import zlib
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Preferred first
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+COMPRESSIBLE_TYPES = ('application/json',)
+
+ACCEPT_ENCODING_RE = _lazy_re_compile(r'^\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([\d.]+))?\s*$')
+
+
+def get_min_size():
+    return getattr(settings, 'SHOP_COMPRESSION_MIN_SIZE', 500)
+
+
+def get_level(encoding, precompressed=False):
+    if precompressed:
+        levels = getattr(settings, 'SHOP_PRECOMPRESSION_LEVELS', {'br': 9, 'gzip': 9})
+    else:
+        levels = getattr(settings, 'SHOP_COMPRESSION_LEVELS', {'br': 5, 'gzip': 6})
+    return levels[encoding]
+
+
+def negotiate(request):
+    """The best encoding the client accepts, or None"""
+    accepted = {}
+    for part in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        match = ACCEPT_ENCODING_RE.match(part)
+        if not match:
+            continue
+        try:
+            quality = float(match[2]) if match[2] else 1.0
+        except ValueError:
+            continue
+        accepted[match[1].lower()] = quality
+
+    best, best_quality = None, 0
+    for encoding in ENCODINGS:
+        quality = accepted.get(encoding, accepted.get('*', 0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def is_compressible(response):
+    return (
+        not response.has_header('Content-Encoding')
+        and response.get('Content-Type', '').startswith(COMPRESSIBLE_TYPES)
+    )
+
+
+def compress(content, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(content, quality=level)
+    # mtime=0 keeps the output identical for identical content
+    return gzip.compress(content, compresslevel=level, mtime=0)
+
+
+def compress_stream(chunks, encoding, level):
+    """Compress an iterable of chunks, flushing after each one"""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=level)
+        for chunk in chunks:
+            data = compressor.process(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+    else:
+        # wbits 31: gzip container
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+
+
+def set_encoding(response, encoding):
+    """Headers of a response whose body is now encoded"""
+    response['Content-Encoding'] = encoding
+    patch_vary_headers(response, ['Accept-Encoding'])
+    # The compressed body is no longer byte-identical to the one the ETag
+    # was computed for
+    etag = response.get('ETag')
+    if etag and etag.startswith('"'):
+        response['ETag'] = 'W/' + etag
+    if not response.streaming:
+        response['Content-Length'] = str(len(response.content))
+    else:
+        del response['Content-Length']
+
+
+class CompressionMiddleware:
+    """
+    Compress JSON responses of at least SHOP_COMPRESSION_MIN_SIZE bytes (any
+    streamed one) with the best encoding the client accepts.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        if not is_compressible(response):
+            return response
+        if not response.streaming and len(response.content) < get_min_size():
+            return response
+
+        # Even uncompressed, the response depends on Accept-Encoding
+        patch_vary_headers(response, ['Accept-Encoding'])
+        encoding = negotiate(request)
+        if encoding is None:
+            return response
+
+        level = get_level(encoding)
+        if response.streaming:
+            response.streaming_content = compress_stream(response.streaming_content, encoding, level)
+        else:
+            compressed = compress(response.content, encoding, level)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+        set_encoding(response, encoding)
+        return response
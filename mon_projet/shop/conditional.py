@@ -0,0 +1,48 @@
+"""
+Conditional GET support (ETag / Last-Modified).
+
+Views compute a validator from cheap queries (a timestamp aggregate, a row
+count...) and answer 304 Not Modified before any serializer runs when the
+client's copy is still current.
+"""
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+
+class Validators:
+    def __init__(self, request, last_modified, *state):
+        self.request = request
+        self.last_modified = last_modified
+
+        # The ETag must differ between representations of the same resource
+        raw = repr((
+            request.get_full_path(),
+            request.META.get('HTTP_ACCEPT', ''),
+            last_modified,
+            state,
+        ))
+        self.etag = '"%s"' % hashlib.md5(raw.encode('utf-8')).hexdigest()
+
+    @property
+    def timestamp(self):
+        if self.last_modified is None:
+            return None
+        return int(self.last_modified.timestamp())
+
+    def not_modified(self):
+        """A 304 response if the request's validators match, else None"""
+        response = get_conditional_response(
+            self.request, etag=self.etag, last_modified=self.timestamp
+        )
+        if response is not None:
+            return self.apply(response)
+        return None
+
+    def apply(self, response):
+        response['ETag'] = self.etag
+        if self.timestamp is not None:
+            response['Last-Modified'] = http_date(self.timestamp)
+        patch_vary_headers(response, ['Accept'])
+        return response
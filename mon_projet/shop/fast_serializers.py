@@ -0,0 +1,330 @@
+"""
+Fast read-only serialization for hot endpoints.
+
+FastSerializer compiles a DRF ModelSerializer into a list of column
+accessors and converters, reads rows with QuerySet.values() and builds the
+same dicts (so the same JSON bytes) the DRF serializer would, without
+creating model instances or going through each field's get_attribute() /
+to_representation() per object.
+
+- nested serializers become joins in the same values() query
+- many=True relations are loaded with one extra query each
+- properties and method fields have no column; they are computed from other
+  columns as declared in COMPUTED
+
+Opt-in with SHOP_FAST_SERIALIZERS = True.
+"""
+import decimal
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.utils.functional import cached_property
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+
+from .models import Like
+from .serializers import (
+    CartItemSerializer, CartSerializer, CategoryStatsSerializer, OrderItemSerializer,
+    ProductSerializer,
+)
+
+
+def fast_serializers_enabled():
+    return getattr(settings, 'SHOP_FAST_SERIALIZERS', False)
+
+
+def cart_item_subtotal(fast, quantity, price):
+    return quantity * price
+
+
+def cart_total_price(fast, items):
+    return sum(item['quantity'] * item['product__price'] for item in items)
+
+
+def cart_total_items(fast, items):
+    return sum(item['quantity'] for item in items)
+
+
+def order_item_subtotal(fast, quantity, price):
+    if quantity is None or price is None:
+        return 0
+    return quantity * price
+
+
+def is_liked(fast, pk):
+    return pk in fast.liked_product_ids
+
+
+def category_stat(name):
+    def stat(fast, pk):
+        return fast.context.get('category_stats', {}).get(pk, CategoryStatsSerializer.EMPTY_STATS)[name]
+    return stat
+
+
+# serializer class -> {field name: (paths the value is computed from, function)}
+# Paths are relative to the serializer's model; a many=True field name gives
+# the raw rows of that relation.
+COMPUTED = {
+    ProductSerializer: {
+        'is_liked': (['pk'], is_liked),
+    },
+    CartItemSerializer: {
+        'subtotal': (['quantity', 'product__price'], cart_item_subtotal),
+    },
+    CartSerializer: {
+        'total_price': (['items'], cart_total_price),
+        'total_items': (['items'], cart_total_items),
+    },
+    OrderItemSerializer: {
+        'subtotal': (['quantity', 'price'], order_item_subtotal),
+    },
+    CategoryStatsSerializer: {
+        name: (['pk'], category_stat(name))
+        for name in ['product_count', 'in_stock_count', 'min_price', 'max_price']
+    },
+}
+
+# Fields whose to_representation() returns values() output unchanged
+PASSTHROUGH_FIELDS = (
+    serializers.CharField, serializers.SlugField, serializers.EmailField,
+    serializers.URLField, serializers.IntegerField, serializers.BooleanField,
+)
+
+
+def decimal_converter(field):
+    if field.decimal_places is None or field.localize or field.normalize_output:
+        return field.to_representation
+
+    coerce_to_string = getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+    quantum = decimal.Decimal('.1') ** field.decimal_places
+    context = decimal.getcontext().copy()
+    if field.max_digits is not None:
+        context.prec = field.max_digits
+    rounding = field.rounding
+
+    def convert(value):
+        if not isinstance(value, decimal.Decimal):
+            value = decimal.Decimal(str(value).strip())
+        value = value.quantize(quantum, rounding=rounding, context=context)
+        return f'{value:f}' if coerce_to_string else value
+    return convert
+
+
+def datetime_converter(field):
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    if output_format is None:
+        return None
+    if output_format.lower() != ISO_8601:
+        return field.to_representation
+
+    tz = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+
+    def convert(value):
+        if tz is None or value.tzinfo is None:
+            return field.to_representation(value)
+        value = value.astimezone(tz).isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+    return convert
+
+
+def file_converter(field, model_field):
+    use_url = getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL)
+    storage = model_field.storage
+    request = field.context.get('request')
+
+    def convert(name):
+        if not name:
+            return None
+        if not use_url:
+            return name
+        url = storage.url(name)
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+    return convert
+
+
+def get_converter(field, model_field):
+    """Function turning a values() value into field.to_representation()'s output"""
+    if type(field) in PASSTHROUGH_FIELDS:
+        return None
+    if isinstance(field, serializers.DecimalField):
+        return decimal_converter(field)
+    if isinstance(field, serializers.DateTimeField):
+        return datetime_converter(field)
+    if isinstance(field, serializers.FileField):
+        return file_converter(field, model_field)
+    if isinstance(field, serializers.PrimaryKeyRelatedField):
+        # values() already returns the related pk
+        return field.pk_field and field.pk_field.to_representation
+    return field.to_representation
+
+
+def resolve_path(model, parts):
+    """The model field at the end of a source path, or None"""
+    model_field = None
+    for part in parts:
+        if model is None:
+            return None
+        try:
+            model_field = model._meta.pk if part == 'pk' else model._meta.get_field(part)
+        except FieldDoesNotExist:
+            return None
+        model = model_field.related_model if model_field.is_relation else None
+    return model_field
+
+
+class Node:
+    """One compiled serializer, reading its columns under prefix"""
+
+    def __init__(self, fast, serializer, prefix=''):
+        self.fast = fast
+        self.model = serializer.Meta.model
+        self.prefix = prefix
+        self.pk_key = prefix + 'pk'
+        self.paths = [self.pk_key]
+        self.columns = []
+        self.nested = []
+        self.relations = []
+
+        computed = COMPUTED.get(type(serializer), {})
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if name in computed:
+                self.add_computed(name, field, *computed[name])
+            elif isinstance(field, serializers.ListSerializer):
+                self.add_relation(name, field)
+            elif isinstance(field, serializers.BaseSerializer):
+                self.add_nested(name, field)
+            else:
+                self.add_column(name, field, serializer)
+
+    def add_column(self, name, field, serializer):
+        parts = field.source.split('.')
+        model_field = resolve_path(self.model, parts)
+        if field.source == '*' or model_field is None:
+            raise ImproperlyConfigured(
+                f'{type(serializer).__name__}.{name} has no column; declare it in COMPUTED'
+            )
+
+        key = self.prefix + '__'.join(parts)
+        self.paths.append(key)
+        convert = get_converter(field, model_field)
+        if convert is None:
+            self.columns.append((name, lambda row: row[key]))
+        else:
+            def get(row):
+                value = row[key]
+                return None if value is None else convert(value)
+            self.columns.append((name, get))
+
+    def add_computed(self, name, field, paths, function):
+        fast = self.fast
+        relations = {relation_key for relation_key, _, _ in self.relations}
+        keys = []
+        for path in paths:
+            key = self.prefix + path
+            if key not in relations:
+                model_field = resolve_path(self.model, path.split('__'))
+                if model_field is None or model_field.one_to_many or model_field.many_to_many:
+                    raise ImproperlyConfigured(
+                        f'{self.model.__name__}.{name} is computed from {path}, which is '
+                        f'neither a column nor a serialized many=True field'
+                    )
+                if key not in self.paths:
+                    self.paths.append(key)
+            keys.append(key)
+
+        # A method field's value is already its representation
+        convert = None
+        if not isinstance(field, serializers.SerializerMethodField):
+            convert = get_converter(field, None)
+        if convert is None:
+            convert = lambda value: value
+
+        def get(row):
+            value = function(fast, *[row[key] for key in keys])
+            return None if value is None else convert(value)
+        self.columns.append((name, get))
+
+    def add_nested(self, name, field):
+        child = Node(self.fast, field, self.prefix + '__'.join(field.source.split('.')) + '__')
+        self.paths.extend(child.paths)
+        self.nested.append(child)
+
+        def get(row):
+            return None if row[child.pk_key] is None else child.build(row)
+        self.columns.append((name, get))
+
+    def add_relation(self, name, field):
+        relation = self.model._meta.get_field(field.source)
+        child = Node(self.fast, field.child)
+        key = self.prefix + field.source
+        self.relations.append((key, relation, child))
+
+        def get(row):
+            return [child.build(child_row) for child_row in row[key]]
+        self.columns.append((name, get))
+
+    def load_related(self, rows):
+        """Attach the raw rows of many=True relations to each row"""
+        for child in self.nested:
+            child.load_related(rows)
+
+        for key, relation, child in self.relations:
+            pks = {row[self.pk_key] for row in rows}
+            parent_key = relation.field.attname
+            children = defaultdict(list)
+            if pks:
+                child_rows = list(
+                    relation.related_model._default_manager
+                    .filter(**{f'{relation.field.name}__in': pks})
+                    .values(parent_key, *child.paths)
+                )
+                child.load_related(child_rows)
+                for child_row in child_rows:
+                    children[child_row[parent_key]].append(child_row)
+
+            for row in rows:
+                row[key] = children.get(row[self.pk_key], [])
+
+    def build(self, row):
+        return {name: get(row) for name, get in self.columns}
+
+
+class FastSerializer:
+    """
+    Drop-in for serializer_class(queryset, many=True, context=context).data
+    on read-only endpoints.
+    """
+
+    def __init__(self, serializer_class, context=None):
+        self.context = context or {}
+        self.root = Node(self, serializer_class(context=self.context))
+
+    def values(self, queryset, *extra):
+        """The values() queryset to paginate; extra adds columns (e.g. for cursors)"""
+        paths = list(dict.fromkeys(self.root.paths + list(extra)))
+        return queryset.values(*paths)
+
+    def serialize(self, rows):
+        rows = list(rows)
+        self.root.load_related(rows)
+        build = self.root.build
+        return [build(row) for row in rows]
+
+    def data(self, queryset):
+        return self.serialize(self.values(queryset))
+
+    @cached_property
+    def liked_product_ids(self):
+        user = self.context.get('user')
+        if user is None and self.context.get('request') is not None:
+            user = self.context['request'].user
+        if user is None or not user.is_authenticated:
+            return frozenset()
+        return frozenset(Like.objects.filter(user=user).values_list('product_id', flat=True))
@@ -0,0 +1,243 @@
+"""
+Responsive derivatives of product images.
+
+Each uploaded image gets downscaled copies at SHOP_IMAGE_WIDTHS pixels wide
+in each of SHOP_IMAGE_FORMATS (WebP with a JPEG fallback by default; 'avif'
+needs a Pillow built with libavif), stored next to the original:
+
+    products/cover.png -> products/derivatives/cover-200w.webp, ...
+
+(ContentHashStorage then files each one under its own content hash in that
+directory, so identical images share their derivatives too.)
+
+Product.image_derivatives keeps {format: [[width, name], ...]}, narrowest
+first, so serializers build srcset attributes without touching the storage.
+Images are never upscaled: one narrower than a width stops the list at its
+own width.
+
+The same pass fills the placeholder fields clients lay out the grid with
+before any image arrives: the intrinsic size (EXIF rotation applied), a
+BlurHash (https://blurha.sh) of SHOP_BLURHASH_COMPONENTS and the dominant
+colour.
+"""
+import math
+from io import BytesIO
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+from .models import Product
+
+
+# format -> (Pillow format, file extension, save() options)
+FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'avif': ('AVIF', 'avif', {'quality': 60}),
+}
+
+ORIENTATION = 0x0112
+
+# Product fields filled from the image, and their values without one
+IMAGE_FIELDS = {
+    'image_derivatives': {},
+    'image_width': None,
+    'image_height': None,
+    'image_blurhash': '',
+    'image_color': '',
+}
+
+BASE83 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~'
+
+# Side of the thumbnail placeholders are computed on
+PLACEHOLDER_SIZE = 32
+
+
+def get_widths():
+    return sorted(getattr(settings, 'SHOP_IMAGE_WIDTHS', [200, 400, 800]))
+
+
+def get_formats():
+    return getattr(settings, 'SHOP_IMAGE_FORMATS', ['webp', 'jpeg'])
+
+
+def get_blurhash_components():
+    return getattr(settings, 'SHOP_BLURHASH_COMPONENTS', (4, 3))
+
+
+def derivative_name(name, width, format):
+    path = PurePosixPath(name)
+    return str(path.parent / 'derivatives' / f'{path.stem}-{width}w.{FORMATS[format][1]}')
+
+
+def target_widths(original_width):
+    widths = []
+    for width in get_widths():
+        widths.append(min(width, original_width))
+        if width >= original_width:
+            break
+    return widths
+
+
+def has_alpha(image):
+    return image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+
+
+def flatten(image):
+    """RGB copy of image with transparency over white, for formats without alpha"""
+    if image.mode == 'RGB':
+        return image
+    background = Image.new('RGB', image.size, 'white')
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def encode(image, format):
+    pillow_format, _, options = FORMATS[format]
+    if format == 'jpeg':
+        image = flatten(image)
+    buffer = BytesIO()
+    image.save(buffer, pillow_format, **options)
+    return buffer.getvalue()
+
+
+def save(storage, name, content):
+    # ContentHashStorage names the file after content: saving the same
+    # derivative again returns the stored name and writes nothing
+    return storage.save(name, ContentFile(content))
+
+
+def process_image(storage, name):
+    """
+    Write the derivatives of the image stored at name, replacing earlier
+    ones, and return the values of its IMAGE_FIELDS.
+    Raises OSError (or Pillow's DecompressionBombError) for unreadable images.
+    """
+    with storage.open(name, 'rb') as file, Image.open(file) as original:
+        # EXIF orientations 5-8 turn the image a quarter
+        rotated = original.getexif().get(ORIENTATION, 1) > 4
+        width, height = (original.height, original.width) if rotated else original.size
+        widths = target_widths(width)
+        # JPEGs decode straight at 1/2, 1/4 or 1/8 scale when that still
+        # covers the widest derivative
+        largest = (widths[-1], max(1, widths[-1] * height // width))
+        original.draft('RGB', largest[::-1] if rotated else largest)
+        image = ImageOps.exif_transpose(original)
+        image = image.convert('RGBA' if has_alpha(image) else 'RGB')
+
+    return {
+        'image_derivatives': write_derivatives(storage, name, image, widths),
+        'image_width': width,
+        'image_height': height,
+        **get_placeholder(image),
+    }
+
+
+def write_derivatives(storage, name, image, widths):
+    formats = get_formats()
+    derivatives = {format: [] for format in formats}
+    # Widest first, each resized from the previous one: cheaper than going
+    # back to the original every time, and indistinguishable at these ratios
+    for width in reversed(widths):
+        height = max(1, round(image.height * width / image.width))
+        if (width, height) != image.size:
+            image = image.resize((width, height), Image.Resampling.LANCZOS)
+        for format in formats:
+            stored = save(storage, derivative_name(name, width, format), encode(image, format))
+            derivatives[format].insert(0, [width, stored])
+    return derivatives
+
+
+def get_placeholder(image):
+    small = flatten(image)
+    small.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.Resampling.BOX)
+    return {
+        'image_blurhash': blurhash(small, *get_blurhash_components()),
+        'image_color': dominant_color(small),
+    }
+
+
+def dominant_color(image):
+    """#rrggbb of the most common colour once the image is reduced to 5"""
+    quantized = image.quantize(colors=5, method=Image.Quantize.MEDIANCUT)
+    _, index = max(quantized.getcolors())
+    r, g, b = quantized.getpalette()[index * 3:index * 3 + 3]
+    return f'#{r:02x}{g:02x}{b:02x}'
+
+
+def base83(value, length):
+    return ''.join(BASE83[value // 83 ** (length - i) % 83] for i in range(1, length + 1))
+
+
+def srgb_to_linear(value):
+    value /= 255
+    return value / 12.92 if value <= 0.04045 else ((value + 0.055) / 1.055) ** 2.4
+
+
+def linear_to_srgb(value):
+    value = min(1, max(0, value))
+    if value <= 0.0031308:
+        return int(value * 12.92 * 255 + 0.5)
+    return int((1.055 * value ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+SRGB_TO_LINEAR = [srgb_to_linear(value) for value in range(256)]
+
+
+def blurhash(image, x_components=4, y_components=3):
+    """BlurHash of an RGB image, best kept to a few dozen pixels wide"""
+    width, height = image.size
+    pixels = [tuple(SRGB_TO_LINEAR[c] for c in pixel) for pixel in image.getdata()]
+
+    factors = []
+    for j in range(y_components):
+        for i in range(x_components):
+            normalisation = 1 if i == j == 0 else 2
+            cos_x = [math.cos(math.pi * i * x / width) for x in range(width)]
+            r = g = b = 0
+            for y in range(height):
+                cos_y = normalisation * math.cos(math.pi * j * y / height)
+                row = pixels[y * width:(y + 1) * width]
+                for (pr, pg, pb), cx in zip(row, cos_x):
+                    basis = cos_y * cx
+                    r += basis * pr
+                    g += basis * pg
+                    b += basis * pb
+            scale = 1 / (width * height)
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    result = base83(x_components - 1 + (y_components - 1) * 9, 1)
+    if ac:
+        quantised_max = max(0, min(82, math.floor(max(abs(c) for f in ac for c in f) * 166 - 0.5)))
+        maximum = (quantised_max + 1) / 166
+        result += base83(quantised_max, 1)
+    else:
+        maximum = 1
+        result += base83(0, 1)
+
+    r, g, b = (linear_to_srgb(c) for c in dc)
+    result += base83((r << 16) + (g << 8) + b, 4)
+    for f in ac:
+        r, g, b = (
+            max(0, min(18, math.floor(math.copysign(abs(c / maximum) ** 0.5, c) * 9 + 9.5)))
+            for c in f
+        )
+        result += base83(r * 19 * 19 + g * 19 + b, 2)
+    return result
+
+
+def delete_derivatives(storage, derivatives, keep=None):
+    """Delete the files of an image_derivatives value, except those in keep"""
+    kept = {name for entries in (keep or {}).values() for _, name in entries}
+    for entries in derivatives.values():
+        for _, name in entries:
+            if name not in kept:
+                storage.delete(name)
+
+
+def process_product_image(name):
+    """process_image() for a product image name, for process pools"""
+    return process_image(Product._meta.get_field('image').storage, name)
@@ -0,0 +1,72 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from shop.compression import ENCODINGS, compress
+from shop.models import Category, Product
+from shop.renderers import FastJSONRenderer
+from shop.serializers import ProductListSerializer
+
+
+LEVELS = {'gzip': [1, 6, 9], 'br': [1, 5, 9, 11]}
+
+WORDS = ['roman', 'histoire', 'été', 'château', 'mystère', 'cuisine', 'voyage', 'poésie', 'théâtre']
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure the CPU time and bytes saved by each encoding and level on product '
+        'list payloads. Everything runs in a transaction that is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[20, 100, 1000, 10000])
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        sizes = sorted(options['sizes'])
+        with transaction.atomic():
+            self.populate(sizes[-1])
+            products = Product.objects.filter(slug__startswith='bench-compression-').select_related('category')
+            renderer = FastJSONRenderer()
+            for size in sizes:
+                content = renderer.render(ProductListSerializer(products[:size], many=True).data)
+                self.stdout.write(f'--- {size} products, {len(content)} bytes')
+                for encoding in ENCODINGS:
+                    for level in LEVELS[encoding]:
+                        self.report(content, encoding, level, options['repeat'])
+            transaction.set_rollback(True)
+
+    def populate(self, total):
+        categories = [
+            Category.objects.create(name=f'Bench {word}', slug=f'bench-compression-{word}')
+            for word in WORDS
+        ]
+        Product.objects.bulk_create([
+            Product(
+                name=' '.join(random.choices(WORDS, k=3)).capitalize(),
+                slug=f'bench-compression-{i}',
+                price=Decimal(random.randint(300, 5000)) / 100,
+                category=random.choice(categories),
+                image=f'products/{i}.jpg',
+                stock=random.randint(0, 20),
+            )
+            for i in range(total)
+        ], batch_size=5000)
+
+    def report(self, content, encoding, level, repeat):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            compressed = compress(content, encoding, level)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        saved = len(content) - len(compressed)
+        self.stdout.write(
+            f'{encoding:<5} level {level:>2}   {best * 1000:8.2f} ms   {len(compressed):>10} bytes   '
+            f'saved {saved / len(content):6.1%}   {saved / 1024 / best:10.0f} KiB saved per CPU second'
+        )
@@ -0,0 +1,100 @@
+import itertools
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from shop.models import Category, Product
+from shop.search import get_search_backend
+
+
+WORDS = [
+    'roman', 'histoire', 'été', 'hiver', 'château', 'mystère', 'cuisine', 'voyage',
+    'amour', 'guerre', 'forêt', 'océan', 'enfant', 'poésie', 'théâtre', 'science',
+    'mémoire', 'lumière', 'jardin', 'musée', 'écrivain', 'naïf', 'société', 'rêve',
+]
+SYLLABLES = ['la', 'mé', 'ro', 'chà', 'tin', 'vé', 'lu', 'pon', 'dre', 'ou', 'gni', 'sé']
+
+
+def build_vocabulary(size=20000):
+    """Real words followed by pseudo-French ones, used with Zipf-like weights"""
+    vocabulary = list(WORDS)
+    seen = set(vocabulary)
+    while len(vocabulary) < size:
+        word = ''.join(random.choices(SYLLABLES, k=random.randint(2, 5)))
+        if word not in seen:
+            seen.add(word)
+            vocabulary.append(word)
+    cum_weights = list(itertools.accumulate(1 / rank for rank in range(1, size + 1)))
+    return vocabulary, cum_weights
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare full-text search against the icontains lookup on a synthetic catalog. '
+        'Everything runs in a transaction that is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=500000)
+        parser.add_argument('--queries', type=int, default=50)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        self.vocabulary, self.cum_weights = build_vocabulary()
+        with transaction.atomic():
+            self.populate(options['products'], options['batch_size'])
+            queries = [
+                ' '.join(random.sample(self.vocabulary[:2000], random.randint(1, 2)))
+                for _ in range(options['queries'])
+            ]
+
+            base = Product.objects.filter(is_active=True)
+            backend = get_search_backend()
+            self.report('icontains (name)', queries, lambda q: base.filter(name__icontains=q))
+            self.report(type(backend).__name__, queries, lambda q: backend.search(base, q))
+
+            transaction.set_rollback(True)
+
+    def populate(self, total, batch_size):
+        categories = [
+            Category.objects.create(name=f'Bench {word}', slug=f'bench-{i}')
+            for i, word in enumerate(WORDS[:8])
+        ]
+        start = time.perf_counter()
+        for offset in range(0, total, batch_size):
+            Product.objects.bulk_create([
+                Product(
+                    name=self.words(3).capitalize(),
+                    slug=f'bench-product-{i}',
+                    description=self.words(40),
+                    price=Decimal(random.randint(300, 5000)) / 100,
+                    category=random.choice(categories),
+                    stock=random.randint(0, 20),
+                )
+                for i in range(offset, min(offset + batch_size, total))
+            ])
+        self.stdout.write(f'Inserted {total} products in {time.perf_counter() - start:.1f}s')
+
+    def words(self, count):
+        return ' '.join(random.choices(self.vocabulary, cum_weights=self.cum_weights, k=count))
+
+    def report(self, label, queries, build):
+        timings = []
+        for query in queries:
+            start = time.perf_counter()
+            # What a paginated list request does: one page plus the count
+            queryset = build(query)
+            list(queryset[:20])
+            queryset.count()
+            timings.append((time.perf_counter() - start) * 1000)
+
+        timings.sort()
+        p95 = timings[int(len(timings) * 0.95) - 1] if len(timings) > 1 else timings[0]
+        self.stdout.write(
+            f'{label:<24} median {statistics.median(timings):8.2f} ms   '
+            f'p95 {p95:8.2f} ms   max {timings[-1]:8.2f} ms'
+        )
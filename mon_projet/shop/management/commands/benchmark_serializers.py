@@ -0,0 +1,137 @@
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Prefetch
+from rest_framework.renderers import JSONRenderer
+
+from shop.fast_serializers import FastSerializer
+from shop.models import Cart, CartItem, Category, Like, Order, OrderItem, Product
+from shop.serializers import CartSerializer, CategorySerializer, OrderSerializer, ProductSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare DRF serializers with shop.fast_serializers (serialization and JSON '
+        'rendering) on synthetic data, and check both give the same bytes. Everything '
+        'runs in a transaction that is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        sizes = sorted(options['sizes'])
+        self.batch_size = options['batch_size']
+
+        with transaction.atomic():
+            self.populate(sizes[-1])
+            for size in sizes:
+                self.stdout.write(f'--- {size} rows')
+                for label, slow, fast in self.cases(size):
+                    self.compare(label, slow, fast, options['repeat'])
+            transaction.set_rollback(True)
+
+    def populate(self, total):
+        start = time.perf_counter()
+        self.user = User.objects.create_user(username='benchmark-serializers')
+        self.categories = self.bulk(Category, [
+            Category(name=f'Bench {i}', slug=f'bench-serializers-{i}', description='Catégorie')
+            for i in range(total)
+        ])
+        self.products = self.bulk(Product, [
+            Product(
+                name=f'Livre {i}', slug=f'bench-serializers-{i}', description='Un été à Paris',
+                price=Decimal(300 + i % 4700) / 100, category=self.categories[i % 20],
+                image=f'products/{i}.jpg' if i % 2 else '', stock=i % 20,
+            )
+            for i in range(total)
+        ])
+        self.bulk(Like, [Like(user=self.user, product=product) for product in self.products[::3]])
+
+        self.cart = Cart.objects.create(user=self.user)
+        orders = self.bulk(Order, [
+            Order(
+                user=self.user, order_number=f'BENCH{i:010d}', total_price=Decimal('42.50'),
+                payment_method='delivery', full_name='Bench', phone='0600000000',
+                address='1 rue de la Paix', city='Paris', postal_code='75002',
+            )
+            for i in range(total)
+        ])
+        self.bulk(OrderItem, [
+            OrderItem(order=order, product=self.products[(i + j) % total], quantity=j + 1, price=Decimal('12.30'))
+            for i, order in enumerate(orders) for j in range(2)
+        ])
+        self.stdout.write(f'Created {total} rows per model in {time.perf_counter() - start:.1f}s')
+
+    def bulk(self, model, objects):
+        return model.objects.bulk_create(objects, batch_size=self.batch_size)
+
+    def cases(self, size):
+        """(label, DRF path, fast path) for each serializer"""
+        products = Product.objects.filter(slug__startswith='bench-serializers-').order_by('pk')[:size]
+        categories = Category.objects.filter(slug__startswith='bench-serializers-').order_by('pk')[:size]
+        orders = Order.objects.filter(user=self.user).order_by('pk')[:size]
+        context = {'user': self.user}
+
+        # The same cart, holding size items
+        CartItem.objects.filter(cart=self.cart).delete()
+        self.bulk(CartItem, [
+            CartItem(cart=self.cart, product=product, quantity=1 + i % 3)
+            for i, product in enumerate(self.products[:size])
+        ])
+        cart = Cart.objects.filter(pk=self.cart.pk)
+
+        return [
+            (
+                'ProductSerializer',
+                lambda: ProductSerializer(
+                    products.for_listing(self.user).select_related('category'), many=True
+                ).data,
+                lambda: FastSerializer(ProductSerializer, context).data(products),
+            ),
+            (
+                'CategorySerializer',
+                lambda: CategorySerializer(categories, many=True).data,
+                lambda: FastSerializer(CategorySerializer).data(categories),
+            ),
+            (
+                'OrderSerializer',
+                lambda: OrderSerializer(
+                    orders.select_related('user').prefetch_related('items__product'), many=True
+                ).data,
+                lambda: FastSerializer(OrderSerializer).data(orders),
+            ),
+            (
+                'CartSerializer',
+                lambda: CartSerializer(cart.prefetch_related(
+                    Prefetch('items__product', queryset=Product.objects.for_listing(self.user)),
+                ).get()).data,
+                lambda: FastSerializer(CartSerializer, context).data(cart)[0],
+            ),
+        ]
+
+    def compare(self, label, slow, fast, repeat):
+        render = JSONRenderer().render
+        slow_time, slow_bytes = self.time(lambda: render(slow()), repeat)
+        fast_time, fast_bytes = self.time(lambda: render(fast()), repeat)
+        if slow_bytes != fast_bytes:
+            raise CommandError(f'{label}: the fast path output differs from DRF')
+
+        self.stdout.write(
+            f'{label:<20} DRF {slow_time * 1000:10.1f} ms   fast {fast_time * 1000:10.1f} ms   '
+            f'x{slow_time / fast_time:5.1f}   {len(fast_bytes) / 1024:10.0f} KiB'
+        )
+
+    def time(self, function, repeat):
+        best, output = None, None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            output = function()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, output
@@ -0,0 +1,58 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from shop.management.commands.benchmark_search import WORDS, build_vocabulary
+from shop.models import Category, Product, ProductTerm
+from shop.similarity import rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        'Time `rebuild_similarity` on synthetic catalogs of each given size. '
+        'Everything runs in transactions that are rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, nargs='+', default=[100000, 1000000])
+        parser.add_argument('--vocabulary', type=int, default=50000)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        self.vocabulary, self.cum_weights = build_vocabulary(options['vocabulary'])
+        for total in options['products']:
+            with transaction.atomic():
+                self.populate(total)
+                start = time.perf_counter()
+                recommended, stored = rebuild(batch_size=options['batch_size'])
+                elapsed = time.perf_counter() - start
+                self.stdout.write(self.style.SUCCESS(
+                    f'{total} products: rebuilt in {elapsed:.1f}s ({total / elapsed:.0f} products/s), '
+                    f'{ProductTerm.objects.count()} terms, {stored} similar products for {recommended}'
+                ))
+                transaction.set_rollback(True)
+
+    def populate(self, total, batch_size=5000):
+        categories = [
+            Category.objects.create(name=f'Bench {word}', slug=f'bench-{i}')
+            for i, word in enumerate(WORDS[:8])
+        ]
+        start = time.perf_counter()
+        for offset in range(0, total, batch_size):
+            Product.objects.bulk_create([
+                Product(
+                    name=self.words(3).capitalize(),
+                    slug=f'bench-product-{i}',
+                    description=self.words(40),
+                    price=Decimal(random.randint(300, 5000)) / 100,
+                    category=random.choice(categories),
+                )
+                for i in range(offset, min(offset + batch_size, total))
+            ])
+        self.stdout.write(f'Inserted {total} products in {time.perf_counter() - start:.1f}s')
+
+    def words(self, count):
+        return ' '.join(random.choices(self.vocabulary, cum_weights=self.cum_weights, k=count))
@@ -0,0 +1,71 @@
+import random
+import resource
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.management.commands.benchmark_search import build_vocabulary
+from shop.suggest import PrefixIndex, get_limit
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the in-memory suggestion index on synthetic titles: build, memory, '
+        'and the latency of typing queries. Touches no database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--titles', type=int, default=1000000)
+        parser.add_argument('--vocabulary', type=int, default=50000)
+        parser.add_argument('--queries', type=int, default=20000)
+
+    def handle(self, *args, **options):
+        self.vocabulary, self.cum_weights = build_vocabulary(options['vocabulary'])
+        total = options['titles']
+        # Zipf-like likes: most titles have none
+        titles = [
+            (pk, self.words(random.randint(1, 5)).capitalize(), int(random.paretovariate(1.2)) - 1)
+            for pk in range(1, total + 1)
+        ]
+
+        index = PrefixIndex(get_limit())
+        memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.perf_counter()
+        index.load(titles)
+        elapsed = time.perf_counter() - start
+        memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - memory
+        self.stdout.write(
+            f'{total} titles indexed in {elapsed:.1f}s, {len(index.vocabulary)} words, '
+            f'about {memory / 1024:.0f} MB'
+        )
+
+        # Every keystroke of a title's last typed word, after the finished ones
+        queries = []
+        while len(queries) < options['queries']:
+            title_words = random.choice(titles)[1].lower().split()
+            typed = title_words[:random.randint(1, len(title_words))]
+            last = typed.pop()
+            queries.extend(' '.join(typed + [last[:length]]) for length in range(1, len(last) + 1))
+        self.report('search', [lambda query=query: index.search(query) for query in queries])
+
+        new_titles = [(total + i, self.words(3).capitalize(), random.randint(0, 50)) for i in range(1, 1001)]
+        self.report('add', [lambda row=row: index.add(*row) for row in new_titles])
+        self.report('remove', [lambda row=row: index.remove(row[0]) for row in new_titles])
+
+    def words(self, count):
+        return ' '.join(random.choices(self.vocabulary, cum_weights=self.cum_weights, k=count))
+
+    def report(self, label, calls):
+        timings = []
+        for call in calls:
+            start = time.perf_counter()
+            call()
+            timings.append((time.perf_counter() - start) * 1000)
+
+        timings.sort()
+        p99 = timings[int(len(timings) * 0.99) - 1] if len(timings) > 1 else timings[0]
+        self.stdout.write(
+            f'{label:<8} {len(timings):6} calls   median {statistics.median(timings):7.3f} ms   '
+            f'p99 {p99:7.3f} ms   max {timings[-1]:7.3f} ms'
+        )
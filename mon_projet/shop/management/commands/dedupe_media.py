@@ -0,0 +1,131 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from shop.cache import category_products_tag, invalidate_tags
+from shop.models import MediaBlob, Product
+from shop.storage import content_name, is_content_name
+
+
+class Command(BaseCommand):
+    help = (
+        'Move product images saved before shop.storage.ContentHashStorage into its '
+        'content-addressed layout (identical files end up as one), recount the '
+        'MediaBlob references and delete the files no product uses any more. Moved '
+        'images lose their derivatives: run generate_image_derivatives afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true')
+        parser.add_argument(
+            '--delete-orphans', action='store_true',
+            help='Also delete files in the upload directory that no product references',
+        )
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        self.verbosity = options['verbosity']
+        self.storage = Product._meta.get_field('image').storage
+        self.freed = 0
+
+        moved = self.move()
+        self.recount()
+        if options['delete_orphans']:
+            self.delete_orphans()
+
+        action = 'Would free' if self.dry_run else 'Freed'
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(moved)} files moved into {len(set(moved.values()))}; {action} {self.freed} bytes'
+        ))
+
+    def images(self):
+        return Product.objects.exclude(image='').exclude(image__isnull=True)
+
+    def move(self):
+        """Old name -> content-addressed name, for each image moved"""
+        moved = {}
+        names = self.images().order_by().values_list('image', flat=True).distinct()
+        for name in names.iterator():
+            if is_content_name(name):
+                continue
+            try:
+                with self.storage.open(name, 'rb') as file:
+                    new_name = content_name(name, file)
+                    # The first copy of some content takes space again
+                    if new_name not in moved.values() and not self.storage.exists(new_name):
+                        self.freed -= file.size
+                    if not self.dry_run:
+                        self.storage.save(name, file)
+            except FileNotFoundError:
+                self.stderr.write(f'{name}: missing, skipped')
+                continue
+            moved[name] = new_name
+            if self.verbosity > 1:
+                self.stdout.write(f'{name} -> {new_name}')
+            if self.dry_run:
+                self.freed += self.storage.size(name)
+                continue
+
+            products = Product.objects.filter(image=name)
+            derivatives = [
+                entry_name
+                for value in products.values_list('image_derivatives', flat=True)
+                for entries in value.values() for _, entry_name in entries
+            ]
+            category_ids = set(products.values_list('category_id', flat=True))
+            with transaction.atomic():
+                products.update(image=new_name, image_derivatives={}, updated_at=timezone.now())
+                # update() sends no post_save: no cached page may keep the
+                # old file's URL once it is deleted
+                invalidate_tags('product', *map(category_products_tag, category_ids))
+                transaction.on_commit(lambda names=[name, *derivatives]: self.delete(names))
+        return moved
+
+    def recount(self):
+        counts = dict(
+            self.images().order_by().values_list('image').annotate(count=Count('pk')).values_list('image', 'count')
+        )
+        if self.dry_run:
+            stored = dict(MediaBlob.objects.values_list('name', 'ref_count'))
+            drifted = sum(1 for name, count in counts.items() if stored.get(name) != count)
+            self.stdout.write(f'{drifted} reference counts to repair')
+            return
+
+        with transaction.atomic():
+            for blob in MediaBlob.objects.select_for_update():
+                count = counts.pop(blob.name, 0)
+                if count == 0:
+                    blob.delete()
+                    transaction.on_commit(lambda name=blob.name: self.delete([name]))
+                elif count != blob.ref_count:
+                    MediaBlob.objects.filter(pk=blob.pk).update(ref_count=count)
+            MediaBlob.objects.bulk_create([
+                MediaBlob(name=name, ref_count=count) for name, count in counts.items()
+            ])
+
+    def delete_orphans(self):
+        referenced = set(self.images().values_list('image', flat=True))
+        for value in self.images().values_list('image_derivatives', flat=True).iterator():
+            referenced.update(name for entries in value.values() for _, name in entries)
+
+        upload_to = Product._meta.get_field('image').upload_to.strip('/')
+        orphans = [name for name in self.walk(upload_to) if name not in referenced]
+        if self.dry_run:
+            self.freed += sum(self.storage.size(name) for name in orphans)
+        else:
+            self.delete(orphans)
+        self.stdout.write(f'{len(orphans)} orphaned files')
+
+    def walk(self, directory):
+        directories, files = self.storage.listdir(directory)
+        for name in files:
+            yield f'{directory}/{name}'
+        for name in directories:
+            yield from self.walk(f'{directory}/{name}')
+
+    def delete(self, names):
+        for name in names:
+            if self.storage.exists(name):
+                self.freed += self.storage.size(name)
+                self.storage.delete(name)
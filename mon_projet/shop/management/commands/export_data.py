@@ -0,0 +1,53 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from shop.exports import EXPORTS, FORMATS, iter_export, parse_updated_since, to_primitive
+
+
+class Command(BaseCommand):
+    help = (
+        'Write a dump of products, orders or order items as CSV or JSON Lines, to a file '
+        'or stdout. With --updated-since, only the rows updated since then; the start time '
+        'printed at the end is the --updated-since of the next incremental export.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=list(EXPORTS))
+        parser.add_argument('--output-format', choices=list(FORMATS), default='csv')
+        parser.add_argument('--updated-since', help='ISO 8601 datetime')
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('-o', '--output', help='File to write, default stdout')
+        parser.add_argument('--chunk-size', type=int)
+
+    def handle(self, *args, **options):
+        updated_since = None
+        if options['updated_since']:
+            try:
+                updated_since = parse_updated_since(options['updated_since'])
+            except ValueError as e:
+                raise CommandError(e)
+
+        started_at = timezone.now()
+        chunks = iter_export(
+            options['name'], options['output_format'], updated_since, options['gzip'], options['chunk_size'],
+        )
+        if options['output']:
+            with open(options['output'], 'wb') as output:
+                size = self.write(chunks, output)
+        else:
+            size = self.write(chunks, sys.stdout.buffer)
+            sys.stdout.buffer.flush()
+
+        # stderr, so stdout holds the export alone
+        self.stderr.write(
+            f'Exported {size} bytes, started at {to_primitive(started_at)}', style_func=self.style.SUCCESS,
+        )
+
+    def write(self, chunks, output):
+        size = 0
+        for chunk in chunks:
+            output.write(chunk)
+            size += len(chunk)
+        return size
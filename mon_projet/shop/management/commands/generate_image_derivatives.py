@@ -0,0 +1,86 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from shop.cache import invalidate_tags
+from shop.images import IMAGE_FIELDS, process_product_image
+from shop.models import Product
+
+
+def derive(name):
+    """(IMAGE_FIELDS values, error) for one image, in a worker process"""
+    try:
+        return process_product_image(name), None
+    except Exception as e:
+        return None, f'{type(e).__name__}: {e}'
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate the resized WebP/JPEG copies and the placeholder (size, BlurHash, '
+        'dominant colour) of product images that lack them, or of every image with '
+        '--all, in a process pool (shop.images).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Regenerate existing derivatives too')
+        parser.add_argument('--workers', type=int, help='Processes, default one per CPU')
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image='').exclude(image__isnull=True).order_by('pk')
+        if not options['all']:
+            products = products.filter(Q(image_derivatives={}) | Q(image_blurhash=''))
+        rows = products.values_list('pk', 'image')
+
+        done = failed = batches = 0
+        start = time.perf_counter()
+        # Spawned rather than forked: workers must not inherit the open
+        # database connection the rows are read from
+        with ProcessPoolExecutor(
+            options['workers'], mp_context=multiprocessing.get_context('spawn'), initializer=django.setup,
+        ) as pool:
+            for batch in self.batches(rows.iterator(), options['batch_size']):
+                batch_start = time.perf_counter()
+                results = pool.map(derive, [name for _, name in batch])
+                updated = []
+                for (pk, name), (fields, error) in zip(batch, results):
+                    if error:
+                        self.stderr.write(f'Product {pk} ({name}): {error}')
+                        failed += 1
+                    else:
+                        updated.append(Product(pk=pk, updated_at=timezone.now(), **fields))
+                with transaction.atomic():
+                    Product.objects.bulk_update(updated, [*IMAGE_FIELDS, 'updated_at'])
+                done += len(updated)
+                batches += 1
+                if options['verbosity']:
+                    self.stdout.write(
+                        f'Batch {batches}: {len(batch)} images in {time.perf_counter() - batch_start:.1f}s, '
+                        f'{done} done'
+                    )
+
+        # bulk_update() sends no post_save
+        if done:
+            invalidate_tags('product')
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {done} images in {elapsed:.1f}s '
+            f'({done / elapsed if elapsed else 0:.1f} images/s), {failed} failed'
+        ))
+
+    def batches(self, rows, size):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
@@ -0,0 +1,311 @@
+import csv
+import http.client
+import io
+import json
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from pathlib import Path
+from urllib.parse import urlparse
+
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, models, transaction
+from django.utils import timezone
+from PIL import Image, UnidentifiedImageError
+
+from shop.cache import category_products_tag, invalidate_tags
+from shop.images import IMAGE_FIELDS
+from shop.models import Category, MediaBlob, Product
+from shop.signals import release_image
+
+
+REQUIRED_COLUMNS = {'slug', 'name', 'price', 'category'}
+
+# Product fields an input row may set; 'category' holds a category slug
+COLUMNS = ['slug', 'name', 'description', 'price', 'category', 'image', 'stock', 'is_featured', 'is_active']
+
+# Spreadsheet spellings BooleanField.clean() doesn't accept
+BOOLEANS = {
+    'true': True, 'yes': True, 'y': True, 'on': True,
+    'false': False, 'no': False, 'n': False, 'off': False,
+}
+
+IMAGE_EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+
+
+class RowError(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Import products from a CSV or JSON Lines file (or - for stdin), creating new '
+        'slugs and updating existing ones in batches. Only the columns present in the '
+        'input (the CSV header, or the keys of the first JSON object) are imported. Columns: ' + ', '.join(COLUMNS) + ' (category is a category '
+        'slug, image a storage path or, with --fetch-images, an http(s) URL).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Default: from the file extension')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--fetch-images', action='store_true', help='Download image URLs into storage')
+        parser.add_argument('--workers', type=int, default=8, help='Image download threads')
+        parser.add_argument('--image-timeout', type=float, default=10)
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        self.fetch_images = options['fetch_images']
+        self.image_timeout = options['image_timeout']
+        self.categories = dict(Category.objects.values_list('slug', 'pk'))
+        self.touched_categories = set()
+        self.skipped = 0
+        self.new_images = 0
+
+        stream = self.open(options['path'])
+        rows = self.read(stream, options['format'] or self.guess_format(options['path']))
+
+        imported = batches = 0
+        start = time.perf_counter()
+        executor = ThreadPoolExecutor(options['workers']) if self.fetch_images else None
+        try:
+            for batch in self.batches(rows, options['batch_size']):
+                batch_start = time.perf_counter()
+                products = self.build(batch, executor)
+                self.upsert(products)
+                imported += len(products)
+                batches += 1
+                elapsed = time.perf_counter() - batch_start
+                if self.verbosity:
+                    self.stdout.write(
+                        f'Batch {batches}: {len(products)} rows in {elapsed * 1000:.0f} ms '
+                        f'({len(products) / elapsed:.0f} rows/s), {imported} imported'
+                    )
+        finally:
+            if executor is not None:
+                executor.shutdown()
+            if stream is not sys.stdin:
+                stream.close()
+            # bulk_create()/bulk_update() don't send post_save
+            if imported:
+                invalidate_tags('product', *map(category_products_tag, self.touched_categories))
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {imported} products in {batches} batches, {elapsed:.1f}s '
+            f'({imported / elapsed if elapsed else 0:.0f} rows/s), {self.skipped} rows skipped'
+        ))
+        # What the post_save signals would have done, left to the bulk commands
+        if self.new_images:
+            self.stdout.write(
+                f'{self.new_images} new images: run generate_image_derivatives for their resized '
+                f'copies and placeholders'
+            )
+        if imported:
+            self.stdout.write('Run rebuild_similarity and rebuild_spelling to index the imported text')
+
+    def open(self, path):
+        if path == '-':
+            return sys.stdin
+        try:
+            return open(path, newline='', encoding='utf-8')
+        except OSError as e:
+            raise CommandError(e)
+
+    def guess_format(self, path):
+        suffix = Path(path).suffix.lower()
+        if suffix in ('.csv', '.jsonl'):
+            return suffix[1:]
+        raise CommandError('Cannot tell the format from the file name, pass --format')
+
+    def read(self, stream, format):
+        """Yield (line number, row dict), without reading the whole input"""
+        if format == 'csv':
+            reader = csv.DictReader(stream)
+            self.columns = self.check_columns(reader.fieldnames or [])
+            for row in reader:
+                yield reader.line_num, row
+            return
+
+        self.columns = None
+        for line_num, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line, parse_float=Decimal)
+            except ValueError as e:
+                self.warn(line_num, f'invalid JSON: {e}')
+                continue
+            if not isinstance(row, dict):
+                self.warn(line_num, 'not a JSON object')
+                continue
+            # The first object decides which columns are imported
+            if self.columns is None:
+                self.columns = self.check_columns(row)
+            yield line_num, row
+
+    def check_columns(self, names):
+        missing = REQUIRED_COLUMNS.difference(names)
+        if missing:
+            raise CommandError(f'Missing columns: {", ".join(sorted(missing))}')
+        return [name for name in COLUMNS if name in names]
+
+    def batches(self, rows, size):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def warn(self, line_num, message):
+        self.skipped += 1
+        self.stderr.write(f'Line {line_num}: {message}, skipped')
+
+    def build(self, batch, executor):
+        """Unsaved products for the valid rows of batch"""
+        products = {}
+        rows = [row for _, row in batch]
+        if executor is not None:
+            images = executor.map(self.fetch_image, rows)
+        else:
+            images = map(self.get_image, rows)
+
+        for (line_num, row), image in zip(batch, images):
+            try:
+                if isinstance(image, RowError):
+                    raise image
+                product = self.build_product(row, image)
+            except RowError as e:
+                self.warn(line_num, e)
+                continue
+            # A slug appearing twice in a batch can't be upserted in one
+            # statement; the last row wins
+            products[product.slug] = product
+        return list(products.values())
+
+    def build_product(self, row, image):
+        values = {}
+        for name in self.columns:
+            value = row.get(name)
+            if name == 'category':
+                if value not in self.categories:
+                    raise RowError(f'unknown category {value!r}')
+                values['category_id'] = self.categories[value]
+                continue
+            if name == 'image':
+                values['image'] = image or None
+                continue
+            if value in (None, '') and name not in REQUIRED_COLUMNS:
+                # Empty cells take the field default
+                values[name] = Product._meta.get_field(name).get_default()
+                continue
+            field = Product._meta.get_field(name)
+            if isinstance(field, models.BooleanField) and isinstance(value, str):
+                value = BOOLEANS.get(value.strip().lower(), value)
+            try:
+                values[name] = field.clean(value, None)
+            except ValidationError as e:
+                raise RowError(f'{name}: {" ".join(e.messages)}')
+
+        self.touched_categories.add(values['category_id'])
+        return Product(**values)
+
+    def get_image(self, row):
+        """Storage name in the image column, or a RowError"""
+        value = row.get('image')
+        if value is not None and not isinstance(value, str):
+            return RowError(f'image: expected a path or URL, got {value!r}')
+        if value and value.startswith(('http://', 'https://')):
+            return RowError(f'image {value}: URLs need --fetch-images')
+        if value and not Product._meta.get_field('image').storage.exists(value):
+            return RowError(f'image {value}: no such file in storage')
+        return value
+
+    def fetch_image(self, row):
+        """Like get_image(), downloading http(s) URLs into storage"""
+        value = row.get('image')
+        if not isinstance(value, str) or not value.startswith(('http://', 'https://')):
+            return self.get_image(row)
+        try:
+            with urllib.request.urlopen(value, timeout=self.image_timeout) as response:
+                content = response.read()
+            with Image.open(io.BytesIO(content)) as image:
+                image.verify()
+                extension = IMAGE_EXTENSIONS.get(image.format)
+        except UnidentifiedImageError:
+            return RowError(f'image {value}: not an image')
+        except (OSError, ValueError, http.client.HTTPException, Image.DecompressionBombError) as e:
+            # Malformed URLs raise ValueError or http.client.InvalidURL
+            return RowError(f'image {value}: {e}')
+        if extension is None:
+            return RowError(f'image {value}: unsupported format')
+
+        name = row.get('slug') or Path(urlparse(value).path).stem or 'image'
+        storage = Product._meta.get_field('image').storage
+        return storage.save(f'products/{name}.{extension}', ContentFile(content))
+
+    def upsert(self, products):
+        if not products:
+            return
+        fields = [name for name in self.columns if name != 'slug']
+
+        if 'image' in self.columns:
+            fields += list(IMAGE_FIELDS)
+
+        with transaction.atomic():
+            existing = {}
+            images = {}
+            for slug, pk, category_id, *image in Product.objects.filter(
+                slug__in=[product.slug for product in products]
+            ).values_list('slug', 'pk', 'category_id', 'image', *IMAGE_FIELDS):
+                existing[slug] = pk
+                images[slug] = image
+                # Products moving away change their old category's stats too
+                self.touched_categories.add(category_id)
+            if 'image' in self.columns:
+                self.update_images(products, images)
+
+            if connection.features.supports_update_conflicts_with_target:
+                Product.objects.bulk_create(
+                    products, update_conflicts=True, unique_fields=['slug'],
+                    update_fields=fields + ['updated_at'],
+                )
+                return
+
+            now = timezone.now()
+            updated = []
+            for product in products:
+                if product.slug in existing:
+                    product.pk = existing[product.slug]
+                    product.updated_at = now
+                    updated.append(product)
+            Product.objects.bulk_update(updated, fields + ['updated_at'])
+            Product.objects.bulk_create([p for p in products if p.slug not in existing])
+
+    def update_images(self, products, images):
+        """
+        Count the references to new images and release the replaced ones, as
+        the signals do; unchanged images keep their derivatives and
+        placeholder, new ones are left without for generate_image_derivatives.
+        """
+        storage = Product._meta.get_field('image').storage
+        for product in products:
+            name = product.image.name or ''
+            previous, *values = images.get(product.slug, ['', *IMAGE_FIELDS.values()])
+            previous_fields = dict(zip(IMAGE_FIELDS, values))
+            if name == (previous or ''):
+                for field, value in previous_fields.items():
+                    setattr(product, field, value)
+                continue
+            if name:
+                MediaBlob.objects.retain(name)
+                self.new_images += 1
+            if previous:
+                release_image(storage, previous, previous_fields['image_derivatives'])
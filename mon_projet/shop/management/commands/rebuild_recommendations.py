@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.cache import invalidate_tags
+from shop.recommendations import KINDS, rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the "also liked" and "bought together" product recommendations '
+        'from the Like and OrderItem tables (shop.recommendations)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=KINDS, action='append', help='Default: all of them')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Source products per pass')
+        parser.add_argument('--limit', type=int, help='Neighbours kept per product')
+        parser.add_argument('--min-support', type=int, help='Fewest shared users or orders for a pair')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        for kind in options['kind'] or KINDS:
+            start = time.perf_counter()
+            recommended, stored = rebuild(
+                kind, batch_size=options['batch_size'], using=options['database'],
+                limit=options['limit'], min_support=options['min_support'],
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f'{kind}: {stored} recommendations for {recommended} products '
+                f'in {time.perf_counter() - start:.1f}s'
+            ))
+        # The recommendations endpoint is cached with the product tag
+        invalidate_tags('product')
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from shop.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the product full-text search index from the catalog tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        backend = get_search_backend(options['database'])
+        count = backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'{type(backend).__name__}: indexed {count} products'
+        ))
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.cache import invalidate_tags
+from shop.similarity import rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the TF-IDF vectors and "similar books" of every product (shop.similarity); '
+        'run it after bulk imports, and regularly to refresh the term statistics'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Source products per pass')
+        parser.add_argument('--limit', type=int, help='Neighbours kept per product')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        recommended, stored = rebuild(
+            batch_size=options['batch_size'], using=options['database'], limit=options['limit'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'{stored} similar products for {recommended} products in {time.perf_counter() - start:.1f}s'
+        ))
+        # The recommendations endpoint is cached with the product tag
+        invalidate_tags('product')
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.cache import invalidate_tags
+from shop.spelling import rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the "did you mean" dictionary of catalog searches from product names and '
+        'descriptions (shop.spelling); run it after bulk imports, and regularly'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        words, variants = rebuild(using=options['database'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{words} words, {variants} variants in {time.perf_counter() - start:.1f}s'
+        ))
+        # Product lists are cached with the product tag, corrections included
+        invalidate_tags('product')
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from shop.cache import invalidate_tags
+from shop.models import Product
+from shop.trending import compute_scores
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute Product.trending_score from the Like, CartItem and OrderItem tables, '
+        'after changing shop.trending.EPOCH or the SHOP_TRENDING_* settings'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        scores = compute_scores()
+        with transaction.atomic():
+            Product.objects.update(trending_score=0)
+            Product.objects.bulk_update(
+                [Product(pk=pk, trending_score=score) for pk, score in scores.items()],
+                ['trending_score'], batch_size=options['batch_size'],
+            )
+            # bulk_update() sends no post_save
+            invalidate_tags('product')
+        self.stdout.write(self.style.SUCCESS(f'Scored {len(scores)} products'))
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from shop.models import Like, Product
+
+
+class Command(BaseCommand):
+    help = 'Recompute Product.likes_count for products whose counter drifted from the Like table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        counts = (
+            Like.objects.filter(product=OuterRef('pk'))
+            .order_by()
+            .values('product')
+            .annotate(count=Count('pk'))
+            .values('count')
+        )
+        drifted = (
+            Product.objects.annotate(actual=Coalesce(Subquery(counts), 0))
+            .exclude(likes_count=F('actual'))
+            .order_by('pk')
+            .values_list('pk', 'likes_count', 'actual')
+        )
+
+        repaired = 0
+        batch = []
+        for pk, stored, actual in drifted.iterator(chunk_size=options['batch_size']):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'Product {pk}: {stored} -> {actual}')
+            batch.append(Product(pk=pk, likes_count=actual))
+            if len(batch) >= options['batch_size']:
+                repaired += self.save(batch, options['dry_run'])
+                batch = []
+        repaired += self.save(batch, options['dry_run'])
+
+        action = 'Would repair' if options['dry_run'] else 'Repaired'
+        self.stdout.write(self.style.SUCCESS(f'{action} {repaired} product like counters'))
+
+    def save(self, batch, dry_run):
+        if batch and not dry_run:
+            with transaction.atomic():
+                Product.objects.bulk_update(batch, ['likes_count'])
+        return len(batch)
@@ -0,0 +1,24 @@
+from django.db import migrations
+
+from shop.search import get_search_backend
+
+
+def install_search_index(apps, schema_editor):
+    backend = get_search_backend(schema_editor.connection.alias)
+    backend.install()
+    backend.rebuild()
+
+
+def uninstall_search_index(apps, schema_editor):
+    get_search_backend(schema_editor.connection.alias).uninstall()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0002_order_orderitem'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
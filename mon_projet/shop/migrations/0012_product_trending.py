@@ -0,0 +1,65 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:11
+
+from datetime import datetime, timezone
+
+from django.db import migrations, models
+
+
+# shop.trending as it was when this migration was written: changing it later
+# is applied by `manage.py rebuild_trending`, not by rewriting history here
+EPOCH = datetime(2026, 1, 1, tzinfo=timezone.utc)
+HALF_LIFE = 72 * 3600
+WEIGHTS = {'like': 1, 'cart': 2, 'order': 4}
+
+
+def increment(event, quantity=1, when=None):
+    return WEIGHTS[event] * quantity * 2 ** ((when - EPOCH).total_seconds() / HALF_LIFE)
+
+
+def populate_trending_score(apps, schema_editor):
+    Like = apps.get_model('shop', 'Like')
+    CartItem = apps.get_model('shop', 'CartItem')
+    OrderItem = apps.get_model('shop', 'OrderItem')
+    Product = apps.get_model('shop', 'Product')
+    # Same history as shop.trending.compute_scores() at the time
+    history = [
+        ('like', Like.objects.values_list('product_id', 'created_at')),
+        ('cart', CartItem.objects.values_list('product_id', 'added_at', 'quantity')),
+        (
+            'order',
+            OrderItem.objects.exclude(order__status='cancelled')
+            .values_list('product_id', 'order__created_at', 'quantity'),
+        ),
+    ]
+    scores = {}
+    for event, rows in history:
+        for product_id, when, *quantity in rows.order_by().iterator(chunk_size=5000):
+            scores[product_id] = scores.get(product_id, 0) + increment(event, *quantity, when=when)
+    Product.objects.bulk_update(
+        [Product(pk=pk, trending_score=score) for pk, score in scores.items()],
+        ['trending_score'], batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0011_product_recommendation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='trending_score',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_trending_score, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-trending_score', '-id'], name='shop_product_trending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['price', 'id'], name='shop_product_price_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0014_product_updated_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpellingWord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('word', models.CharField(max_length=64, unique=True)),
+                ('spelling', models.CharField(max_length=64)),
+                ('count', models.PositiveIntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SpellingDelete',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('variant', models.CharField(max_length=64)),
+                ('word', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shop.spellingword')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['variant', 'word'], name='shop_spellingdelete_idx')],
+            },
+        ),
+    ]
@@ -1,11 +1,16 @@
 from django.db import models
+from django.db.models import Exists, F, OuterRef, Q, Value
 from django.contrib.auth.models import User
 
+from .search import get_search_backend
+from .storage import ContentHashStorage
+
 class Category(models.Model):
     name = models.CharField(max_length=200)
     slug = models.SlugField(unique=True)
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         verbose_name_plural = "Categories"
@@ -15,24 +20,132 @@ class Category(models.Model):
         return self.name
 
 
+class ProductQuerySet(models.QuerySet):
+    def for_listing(self, user=None):
+        """
+        Join the category and, when a user is given, annotate the per-user
+        is_liked flag for serialization
+        """
+        queryset = self.select_related('category')
+        if user is None:
+            return queryset
+        
+        if user.is_authenticated:
+            is_liked = Exists(Like.objects.filter(user=user, product=OuterRef('pk')))
+        else:
+            is_liked = Value(False, output_field=models.BooleanField())
+        
+        return queryset.annotate(is_liked=is_liked)
+    
+    def search(self, query, rank=True):
+        """Full-text search over name, description and category, best match first"""
+        return get_search_backend(self.db).search(self, query, rank)
+
+
 class Product(models.Model):
     name = models.CharField(max_length=200)
     slug = models.SlugField(unique=True)
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products')
-    image = models.ImageField(upload_to='products/', blank=True, null=True)
+    image = models.ImageField(upload_to='products/', storage=ContentHashStorage(), blank=True, null=True)
+    # Resized WebP/JPEG copies of image and its placeholder, see shop.images
+    image_derivatives = models.JSONField(default=dict, blank=True, editable=False)
+    image_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_blurhash = models.CharField(max_length=100, blank=True, editable=False)
+    image_color = models.CharField(max_length=7, blank=True, editable=False)
     stock = models.IntegerField(default=0)
     is_featured = models.BooleanField(default=False)
     is_active = models.BooleanField(default=True)
+    # Maintained by LikeViewSet.toggle; repair with `manage.py repair_like_counts`
+    likes_count = models.PositiveIntegerField(default=0, editable=False)
+    # Decayed likes, cart adds and orders, scaled so it sorts without
+    # decaying; see shop.trending
+    trending_score = models.FloatField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = ProductQuerySet.as_manager()
+    
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['is_active', '-created_at', '-id'], name='shop_product_keyset_idx'),
+            models.Index(fields=['is_active', '-likes_count'], name='shop_product_likes_idx'),
+            # Whether an image file is still referenced
+            models.Index(fields=['image'], name='shop_product_image_idx'),
+            # Products changed since (shop.suggest syncs, ?updated_since= exports)
+            models.Index(fields=['updated_at'], name='shop_product_updated_idx'),
+            # Partial indexes (skipped on backends without support, where the
+            # keyset index above still serves these filters)
+            models.Index(
+                fields=['-created_at', '-id'], condition=Q(is_active=True),
+                name='shop_product_active_idx',
+            ),
+            models.Index(
+                fields=['category', '-created_at', '-id'], condition=Q(is_active=True),
+                name='shop_product_category_idx',
+            ),
+            models.Index(
+                fields=['-created_at', '-id'], condition=Q(is_active=True, is_featured=True),
+                name='shop_product_featured_idx',
+            ),
+            # ?ordering=trending and ?ordering=price / -price
+            models.Index(
+                fields=['-trending_score', '-id'], condition=Q(is_active=True),
+                name='shop_product_trending_idx',
+            ),
+            models.Index(
+                fields=['price', 'id'], condition=Q(is_active=True),
+                name='shop_product_price_idx',
+            ),
+        ]
     
     def __str__(self):
         return self.name
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Lets the signals tell which category a saved product is leaving
+        instance._loaded_category_id = instance.__dict__.get('category_id')
+        # ...and whether its image changed
+        if 'image' in instance.__dict__:
+            instance._loaded_image = instance.__dict__['image'] or ''
+        # ...and its text (see shop.similarity)
+        if 'name' in instance.__dict__ and 'description' in instance.__dict__:
+            instance._loaded_text = (instance.name, instance.description, instance.__dict__.get('category_id'))
+        return instance
+
+
+class MediaBlobQuerySet(models.QuerySet):
+    def retain(self, name):
+        """Count one more reference to the stored file name"""
+        blob, created = self.get_or_create(name=name, defaults={'ref_count': 1})
+        if not created:
+            self.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+    
+    def release(self, name):
+        """Count one reference less; True when the file is no longer referenced"""
+        self.filter(name=name, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+        deleted, _ = self.filter(name=name, ref_count=0).delete()
+        return bool(deleted)
+
+
+class MediaBlob(models.Model):
+    """
+    A file in ContentHashStorage and the number of products using it.
+    Maintained by the signals; repair with `manage.py dedupe_media`.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    objects = MediaBlobQuerySet.as_manager()
+    
+    def __str__(self):
+        return f"{self.name} ({self.ref_count})"
 
 
 class Cart(models.Model):
@@ -76,6 +189,9 @@ class Like(models.Model):
     
     class Meta:
         unique_together = ('user', 'product')
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='shop_like_keyset_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} likes {self.product.name}"
@@ -117,6 +233,11 @@ class Order(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='shop_order_keyset_idx'),
+            # Back office: orders by status, oldest first
+            models.Index(fields=['status', 'created_at'], name='shop_order_status_idx'),
+        ]
     
     def __str__(self):
         return f"Order {self.order_number} - {self.user.username}"
@@ -138,4 +259,96 @@ class OrderItem(models.Model):
         # Gérer le cas où quantity ou price est None
         if self.quantity is None or self.price is None:
             return 0
-        return self.quantity * self.price
\ No newline at end of file
+        return self.quantity * self.price
+
+class ProductRecommendation(models.Model):
+    """
+    One of a product's nearest neighbours, best first (rank 0). Rebuilt by
+    `manage.py rebuild_recommendations` (see shop.recommendations) and, for
+    similar books, `manage.py rebuild_similarity` (see shop.similarity).
+    """
+    KIND_CHOICES = [
+        ('liked', 'Readers who liked this also liked'),
+        ('bought', 'Frequently bought together'),
+        ('similar', 'Similar books'),
+    ]
+    
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommended_by')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    rank = models.PositiveSmallIntegerField()
+    # Cosine similarity, and the users (orders, terms) the two products share
+    score = models.FloatField()
+    together = models.PositiveIntegerField()
+    
+    class Meta:
+        ordering = ['product', 'kind', 'rank']
+        constraints = [
+            # Also the index the recommendations endpoint reads
+            models.UniqueConstraint(fields=['product', 'kind', 'rank'], name='shop_recommendation_rank_uniq'),
+        ]
+    
+    def __str__(self):
+        return f"{self.product_id} -> {self.recommended_id} ({self.kind} #{self.rank})"
+
+
+class SimilarityTerm(models.Model):
+    """How many products a term appeared in at the last similarity rebuild"""
+    term = models.CharField(max_length=64, unique=True)
+    document_count = models.PositiveIntegerField()
+    
+    def __str__(self):
+        return f"{self.term} ({self.document_count})"
+
+
+class ProductTerm(models.Model):
+    """
+    One term of a product's TF-IDF vector (shop.similarity), the inverted
+    index similar products are found through
+    """
+    # The unique constraint starts with product, no index of its own needed
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+', db_index=False)
+    term = models.CharField(max_length=64)
+    weight = models.FloatField()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'term'], name='shop_productterm_uniq'),
+        ]
+        indexes = [
+            # Covers the postings side of the similarity join
+            models.Index(fields=['term', 'product', 'weight'], name='shop_productterm_term_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.product_id}: {self.term} ({self.weight:.3f})"
+
+
+class SpellingWord(models.Model):
+    """A catalog word misspelled searches are corrected to (shop.spelling)"""
+    # Folded like search terms: lower case, no accents
+    word = models.CharField(max_length=64, unique=True)
+    # Its most common spelling in the catalog, as corrections show it
+    spelling = models.CharField(max_length=64)
+    count = models.PositiveIntegerField()
+    
+    def __str__(self):
+        return f"{self.spelling} ({self.count})"
+
+
+class SpellingDelete(models.Model):
+    """
+    The start of a SpellingWord with some letters deleted: a misspelling
+    sharing such a variant with a word is one of its candidate corrections
+    """
+    variant = models.CharField(max_length=64)
+    # The index below covers lookups; rebuilds empty the whole table
+    word = models.ForeignKey(SpellingWord, on_delete=models.CASCADE, related_name='+', db_index=False)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['variant', 'word'], name='shop_spellingdelete_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.variant} -> {self.word_id}"
@@ -0,0 +1,103 @@
+import base64
+import binascii
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(PageNumberPagination):
+    """
+    Page-number pagination that switches to keyset pagination on
+    (created_at, id) when the request carries ?cursor= (empty for the first
+    page). Keyset pages skip the COUNT(*) and seek through the
+    (..., created_at, id) indexes instead of using OFFSET, so deep pages
+    cost the same as the first one. Either way ?page_size= picks the page
+    size, up to max_page_size.
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    keyset_ordering = ('-created_at', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    keyset = False
+
+    def is_keyset_request(self, request):
+        return self.cursor_query_param in request.query_params
+
+    def supports_keyset(self, queryset):
+        # Other orderings (search relevance, price...) keep page numbers
+        ordering = queryset.query.order_by or queryset.model._meta.ordering
+        return not ordering or ordering[0] == '-created_at'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not (self.is_keyset_request(request) and self.supports_keyset(queryset)):
+            self.keyset = False
+            return super().paginate_queryset(queryset, request, view=view)
+
+        self.keyset = True
+        self.request = request
+        page_size = self.get_page_size(request)
+
+        queryset = queryset.order_by(*self.keyset_ordering)
+        position = self.decode_cursor(request)
+        if position:
+            created_at, pk = position
+            # The redundant created_at__lte lets the database seek the index
+            queryset = queryset.filter(created_at__lte=created_at).filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk)
+            )
+
+        rows = list(queryset[:page_size + 1])
+        self.has_next = len(rows) > page_size
+        self.keyset_page = rows[:page_size]
+        return self.keyset_page
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+
+        last = self.keyset_page[-1]
+        url = remove_query_param(self.request.build_absolute_uri(), self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(last))
+
+    def encode_cursor(self, obj):
+        # Rows are model instances, or values() dicts from FastSerializer
+        if isinstance(obj, dict):
+            value = f"{obj['created_at'].isoformat()}|{obj['pk']}"
+        else:
+            value = f'{obj.created_at.isoformat()}|{obj.pk}'
+        return base64.urlsafe_b64encode(value.encode('ascii')).decode('ascii')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            value = base64.urlsafe_b64decode(encoded.encode('ascii')).decode('ascii')
+            created_at, pk = value.rsplit('|', 1)
+            created_at = parse_datetime(created_at)
+            pk = int(pk)
+        except (TypeError, ValueError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+
+        if created_at is None:
+            raise NotFound(self.invalid_cursor_message)
+        return created_at, pk
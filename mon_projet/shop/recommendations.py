@@ -0,0 +1,174 @@
+"""
+Item-item collaborative filtering for the product detail page.
+
+Two kinds of neighbours, each from its own "baskets":
+- liked: users, from Like ("readers who liked this also liked")
+- bought: orders that weren't cancelled, from OrderItem ("frequently
+  bought together")
+
+For every pair of products, together(a, b) counts the baskets holding both,
+and count(a) the baskets holding a. Neighbours are ranked by cosine
+similarity, which keeps bestsellers from topping every list:
+
+    score(a, b) = together(a, b) / sqrt(count(a) * count(b))
+
+`manage.py rebuild_recommendations` stores each product's best
+SHOP_RECOMMENDATIONS_PER_PRODUCT neighbours in ProductRecommendation, so
+serving them is one lookup on its (product, kind, rank) index.
+
+The co-occurrence matrix is never held whole: the database computes it as
+a self-join aggregated by pair, for one range of source products at a time,
+and the rows are read in order and reduced to each product's top neighbours
+as they stream by. Memory holds one batch of results and one product's
+candidates, however many likes there are. Pairs seen fewer than
+SHOP_RECOMMENDATIONS_MIN_SUPPORT times are dropped by the database before
+they reach Python.
+"""
+import heapq
+import math
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from .models import Like, Order, OrderItem, Product, ProductRecommendation
+
+
+LIKES = Like._meta.db_table
+ORDERS = Order._meta.db_table
+ORDER_ITEMS = OrderItem._meta.db_table
+
+# kind -> (SQL of count(product) per product, SQL of together(a, b) per
+# pair for a in [%s, %s] having at least %s baskets, ordered by a)
+QUERIES = {
+    'liked': (
+        f'SELECT product_id, COUNT(*) FROM {LIKES} GROUP BY product_id',
+        f"""
+        SELECT a.product_id, b.product_id, COUNT(*)
+        FROM {LIKES} a
+        JOIN {LIKES} b ON b.user_id = a.user_id AND b.product_id <> a.product_id
+        WHERE a.product_id BETWEEN %s AND %s
+        GROUP BY a.product_id, b.product_id
+        HAVING COUNT(*) >= %s
+        ORDER BY a.product_id
+        """,
+    ),
+    # An order may list a product twice, hence the DISTINCT
+    'bought': (
+        f"""
+        SELECT i.product_id, COUNT(DISTINCT i.order_id)
+        FROM {ORDER_ITEMS} i
+        JOIN {ORDERS} o ON o.id = i.order_id
+        WHERE o.status <> 'cancelled'
+        GROUP BY i.product_id
+        """,
+        f"""
+        SELECT a.product_id, b.product_id, COUNT(DISTINCT a.order_id)
+        FROM {ORDER_ITEMS} a
+        JOIN {ORDERS} o ON o.id = a.order_id
+        JOIN {ORDER_ITEMS} b ON b.order_id = a.order_id AND b.product_id <> a.product_id
+        WHERE a.product_id BETWEEN %s AND %s AND o.status <> 'cancelled'
+        GROUP BY a.product_id, b.product_id
+        HAVING COUNT(DISTINCT a.order_id) >= %s
+        ORDER BY a.product_id
+        """,
+    ),
+}
+
+KINDS = list(QUERIES)
+
+# Rows fetched from the cursor at a time
+FETCH_SIZE = 10000
+
+
+def get_per_product():
+    return getattr(settings, 'SHOP_RECOMMENDATIONS_PER_PRODUCT', 10)
+
+
+def get_min_support():
+    return getattr(settings, 'SHOP_RECOMMENDATIONS_MIN_SUPPORT', 2)
+
+
+def fetch(cursor, sql, params):
+    cursor.execute(sql, params)
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            return
+        yield from rows
+
+
+def scored(pairs, counts):
+    """(product, neighbour, cosine similarity, together) for each pair row"""
+    for product, neighbour, together in pairs:
+        yield product, neighbour, together / math.sqrt(counts[product] * counts[neighbour]), together
+
+
+def top_neighbours(rows, limit):
+    """
+    (product, [(score, together, -neighbour), ...] best first) for each
+    product in rows of (product, neighbour, score, together) grouped by
+    product
+    """
+    current, candidates = None, []
+    for product, neighbour, score, together in rows:
+        if product != current:
+            if candidates:
+                yield current, heapq.nlargest(limit, candidates)
+            current, candidates = product, []
+        # Ties go to the lower id, for stable ranks between rebuilds
+        candidates.append((score, together, -neighbour))
+    if candidates:
+        yield current, heapq.nlargest(limit, candidates)
+
+
+def save_neighbours(kind, low, high, neighbours, using='default'):
+    """
+    Replace the kind of recommendations of the products with ids in
+    [low, high] by neighbours, as from top_neighbours(). Returns the rows
+    written.
+    """
+    rows = [
+        ProductRecommendation(
+            product_id=product, recommended_id=-neighbour, kind=kind,
+            rank=rank, score=score, together=together,
+        )
+        for product, best in neighbours
+        for rank, (score, together, neighbour) in enumerate(best)
+    ]
+    # Products left without neighbours lose their old ones too
+    with transaction.atomic(using=using):
+        ProductRecommendation.objects.using(using).filter(
+            kind=kind, product__gte=low, product__lte=high,
+        ).delete()
+        ProductRecommendation.objects.using(using).bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def product_ranges(batch_size, using='default'):
+    """(lowest, highest) product ids of each batch of batch_size products"""
+    product_ids = list(Product.objects.using(using).order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(product_ids), batch_size):
+        batch = product_ids[start:start + batch_size]
+        yield batch[0], batch[-1]
+
+
+def rebuild(kind, batch_size=1000, using='default', limit=None, min_support=None):
+    """
+    Recompute the kind of recommendations of every product, batch_size
+    products per transaction. Returns (products with neighbours, rows).
+    """
+    limit = get_per_product() if limit is None else limit
+    min_support = get_min_support() if min_support is None else min_support
+    count_sql, pairs_sql = QUERIES[kind]
+
+    with connections[using].cursor() as cursor:
+        cursor.execute(count_sql)
+        counts = dict(cursor.fetchall())
+
+        recommended = stored = 0
+        for low, high in product_ranges(batch_size, using):
+            pairs = fetch(cursor, pairs_sql, [low, high, min_support])
+            neighbours = list(top_neighbours(scored(pairs, counts), limit))
+            recommended += len(neighbours)
+            stored += save_neighbours(kind, low, high, neighbours, using)
+    return recommended, stored
@@ -0,0 +1,121 @@
+"""
+Faster JSON rendering, with chunked output for large lists.
+
+FastJSONRenderer writes the same bytes as DRF's JSONRenderer in its default
+compact, non-ASCII-escaped mode, but encodes with orjson when it is
+installed. Datetimes and the types orjson doesn't know (Decimal, lazy
+strings...) go through DRF's encoder so they come out identical. Indented
+output, ensure_ascii and whatever orjson refuses (e.g. integers beyond 64
+bits) fall back to JSONRenderer. orjson writes floats outside
+[1e-4, 1e16) without Python's exponent padding (1e16 rather than 1e+16);
+the shop's serializers only emit Decimals as strings, so no response is
+affected.
+
+Views using StreamingResponseMixin send large unpaginated lists as a
+StreamingHttpResponse, encoded a chunk of items at a time.
+"""
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    if orjson is not None:
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+    @property
+    def use_orjson(self):
+        return orjson is not None and self.compact and not self.ensure_ascii
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if not self.use_orjson or self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        return self.encode(data)
+
+    def encode(self, data):
+        """Compact JSON for data, as JSONRenderer would write it"""
+        if not self.use_orjson:
+            return super().render(data)
+        try:
+            content = orjson.dumps(data, default=self.encoder_class().default, option=self.options)
+        except orjson.JSONEncodeError:
+            return super().render(data)
+        # Like JSONRenderer, keep the output a strict JavaScript subset
+        if b'\xe2\x80\xa8' in content or b'\xe2\x80\xa9' in content:
+            content = content.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return content
+
+    def can_stream(self, accepted_media_type, renderer_context=None):
+        return self.compact and self.get_indent(accepted_media_type, renderer_context or {}) is None
+
+    def iter_render(self, data, chunk_size):
+        """The bytes of encode(data), with lists encoded chunk_size items at a time"""
+        if isinstance(data, dict) and all(isinstance(key, str) for key in data):
+            yield b'{'
+            for i, (key, value) in enumerate(data.items()):
+                yield (b',' if i else b'') + self.encode(key) + b':'
+                yield from self.iter_render(value, chunk_size)
+            yield b'}'
+        elif isinstance(data, list) and len(data) > chunk_size:
+            yield b'['
+            for start in range(0, len(data), chunk_size):
+                # Encode the chunk as a list, keep the items between the brackets
+                items = self.encode(data[start:start + chunk_size])[1:-1]
+                yield (b',' if start else b'') + items
+            yield b']'
+        else:
+            yield self.encode(data)
+
+
+def largest_list(data):
+    """Length of the longest list at the top of data or one level down"""
+    if isinstance(data, list):
+        return len(data)
+    if isinstance(data, dict):
+        return max((len(value) for value in data.values() if isinstance(value, list)), default=0)
+    return 0
+
+
+class StreamingResponseMixin:
+    """
+    Stream the JSON of the actions listed in streamed_actions when it holds
+    at least SHOP_JSON_STREAM_THRESHOLD items, instead of rendering it in one
+    piece. Needs FastJSONRenderer to be the accepted renderer.
+    """
+    streamed_actions = ('list',)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if not (
+            isinstance(response, Response)
+            and response.status_code == 200
+            and request.method == 'GET'
+            and getattr(self, 'action', None) in self.streamed_actions
+        ):
+            return response
+
+        renderer = response.accepted_renderer
+        if not (
+            isinstance(renderer, FastJSONRenderer)
+            and renderer.can_stream(response.accepted_media_type, response.renderer_context)
+            and largest_list(response.data) >= getattr(settings, 'SHOP_JSON_STREAM_THRESHOLD', 1000)
+        ):
+            return response
+
+        streaming = StreamingHttpResponse(
+            renderer.iter_render(response.data, getattr(settings, 'SHOP_JSON_STREAM_CHUNK_SIZE', 500)),
+            status=response.status_code,
+            content_type=response.accepted_media_type,
+        )
+        for name, value in response.items():
+            if name.lower() != 'content-type':
+                streaming[name] = value
+        return streaming
@@ -0,0 +1,257 @@
+"""
+On-demand resizing of product images: /media/resize/<w>x<h>/<path>.
+
+The image at <path> (under Product.image's upload directory) is scaled down
+to fit in w x h, aspect ratio kept, never enlarged; 0 leaves a side
+unbounded. Results live in a disk cache under SHOP_RESIZE_CACHE_DIR, named
+after the hash of the source's content and the parameters and sharded on
+the first hex digits (ab/cd/abcd....jpg), so a replaced source never serves
+a stale variant.
+
+- Concurrent requests for a missing variant are coalesced: the first one
+  resizes holding a lock (flock on one of LOCK_STRIPES lock files, across
+  threads and processes), the others wait and read its result.
+- The cache is kept under SHOP_RESIZE_CACHE_MAX_BYTES by deleting the least
+  recently used files; hits refresh a file's mtime at most once per
+  TOUCH_INTERVAL, and each process sweeps after writing a twentieth of the
+  limit.
+- The source hash is remembered per (path, mtime, size) in the response
+  cache, so hits don't read the original.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from io import BytesIO
+from pathlib import Path, PurePosixPath
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+from .cache import get_cache
+from .images import ORIENTATION, flatten, has_alpha
+from .models import Product
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# Bump to invalidate every cached variant after changing how they're made
+VERSION = 1
+
+# Source format -> (output format, extension, content type, save() options)
+OUTPUTS = {
+    'JPEG': ('JPEG', 'jpg', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'PNG': ('PNG', 'png', 'image/png', {'optimize': True}),
+    'WEBP': ('WEBP', 'webp', 'image/webp', {'quality': 80, 'method': 4}),
+}
+DEFAULT_OUTPUT = 'JPEG'
+
+EXTENSIONS = {'jpg': 'JPEG', 'jpeg': 'JPEG', 'png': 'PNG', 'webp': 'WEBP'}
+
+LOCK_STRIPES = 4096
+
+TOUCH_INTERVAL = 3600
+
+_written = 0
+_written_lock = threading.Lock()
+_thread_locks = {}
+
+
+class ResizeError(Exception):
+    """No such product image"""
+
+
+class InvalidSize(ResizeError):
+    pass
+
+
+def get_cache_dir():
+    return Path(getattr(settings, 'SHOP_RESIZE_CACHE_DIR', settings.BASE_DIR / 'resize_cache'))
+
+
+def get_max_bytes():
+    return getattr(settings, 'SHOP_RESIZE_CACHE_MAX_BYTES', 1024 ** 3)
+
+
+def get_max_size():
+    return getattr(settings, 'SHOP_RESIZE_MAX_SIZE', 2000)
+
+
+def get_storage():
+    return Product._meta.get_field('image').storage
+
+
+def check_request(width, height, name):
+    """Raise ResizeError unless the parameters and path are acceptable"""
+    max_size = get_max_size()
+    if not (width or height) or width > max_size or height > max_size:
+        raise InvalidSize(f'Sizes go up to {max_size}, and one of them must be set')
+
+    upload_to = Product._meta.get_field('image').upload_to.strip('/')
+    parts = PurePosixPath(name).parts
+    if not parts or parts[0] != upload_to or '..' in parts or name.startswith('/'):
+        raise ResizeError('Not a product image')
+
+
+def get_source_hash(storage, name):
+    """sha256 of the file at name, read once per version of the file"""
+    try:
+        stamp = f'{storage.get_modified_time(name).timestamp()}:{storage.size(name)}'
+    except (OSError, NotImplementedError):
+        raise ResizeError('Not a product image')
+
+    cache = get_cache()
+    key = f'shop:resize-source:{hashlib.md5(name.encode("utf-8")).hexdigest()}:{stamp}'
+    source_hash = cache.get(key)
+    if source_hash is None:
+        digest = hashlib.sha256()
+        with storage.open(name, 'rb') as file:
+            for chunk in file.chunks():
+                digest.update(chunk)
+        source_hash = digest.hexdigest()
+        cache.set(key, source_hash, None)
+    return source_hash
+
+
+def variant_path(source_hash, width, height, extension):
+    key = hashlib.sha256(f'{source_hash}:{width}x{height}:{VERSION}'.encode('ascii')).hexdigest()
+    return get_cache_dir() / key[:2] / key[2:4] / f'{key}.{extension}'
+
+
+def get_output(name):
+    """OUTPUTS entry for a source: its own format, or JPEG for the others"""
+    extension = PurePosixPath(name).suffix.lower().lstrip('.')
+    return OUTPUTS[EXTENSIONS.get(extension, DEFAULT_OUTPUT)]
+
+
+def resize(storage, name, width, height, output):
+    pillow_format, _, _, options = output
+    try:
+        with storage.open(name, 'rb') as file, Image.open(file) as original:
+            # EXIF orientations 5-8 turn the image a quarter
+            rotated = original.getexif().get(ORIENTATION, 1) > 4
+            size = original.size[::-1] if rotated else original.size
+            box = (width or size[0], height or size[1])
+            # JPEGs decode straight at a reduced scale when it still covers box
+            original.draft('RGB', box[::-1] if rotated else box)
+            image = ImageOps.exif_transpose(original)
+            if image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+                image = image.convert('RGBA' if has_alpha(image) else 'RGB')
+            image.thumbnail(box, Image.Resampling.LANCZOS)
+    except (OSError, Image.DecompressionBombError):
+        raise ResizeError('Not a product image')
+
+    if pillow_format == 'JPEG' and image.mode in ('RGBA', 'LA'):
+        image = flatten(image)
+    buffer = BytesIO()
+    image.save(buffer, pillow_format, **options)
+    return buffer.getvalue()
+
+
+@contextmanager
+def variant_lock(path):
+    """
+    Exclusive lock for a variant, across threads and (with flock) processes.
+    Variants share LOCK_STRIPES locks, so there's a bounded number of lock
+    files to keep.
+    """
+    stripe = int(path.stem[:3], 16) % LOCK_STRIPES
+    lock = _thread_locks.setdefault(stripe, threading.Lock())
+    with lock:
+        if fcntl is None:
+            yield
+            return
+        lock_dir = get_cache_dir() / 'locks'
+        lock_dir.mkdir(parents=True, exist_ok=True)
+        with open(lock_dir / f'{stripe:03x}.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def touch(path):
+    """Mark a cached variant as recently used"""
+    try:
+        if time.time() - path.stat().st_mtime > TOUCH_INTERVAL:
+            os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def write(path, content):
+    # Readers never see a partial file
+    descriptor, temp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    with os.fdopen(descriptor, 'wb') as file:
+        file.write(content)
+    os.replace(temp_path, path)
+
+
+def get_variant(name, width, height):
+    """(path of the cached variant, content type), resizing on a miss"""
+    check_request(width, height, name)
+    storage = get_storage()
+    source_hash = get_source_hash(storage, name)
+    output = get_output(name)
+    path = variant_path(source_hash, width, height, output[1])
+    if touch(path):
+        return path, output[2]
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with variant_lock(path):
+        # Another request may have made it while we waited
+        if not path.exists():
+            content = resize(storage, name, width, height, output)
+            write(path, content)
+            record_write(len(content))
+    return path, output[2]
+
+
+def record_write(size):
+    global _written
+    with _written_lock:
+        _written += size
+        if _written < get_max_bytes() // 20:
+            return
+        _written = 0
+    evict()
+
+
+def evict(max_bytes=None):
+    """Delete least recently used variants until the cache fits in max_bytes"""
+    max_bytes = get_max_bytes() if max_bytes is None else max_bytes
+    files = []
+    total = 0
+    for directory, _, names in os.walk(get_cache_dir()):
+        for name in names:
+            if name.endswith(('.lock', '.tmp')):
+                continue
+            try:
+                stat = os.stat(os.path.join(directory, name))
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, os.path.join(directory, name)))
+            total += stat.st_size
+
+    if total <= max_bytes:
+        return 0
+    deleted = 0
+    # Down to 90%, so the next sweep isn't due right away
+    target = max_bytes * 9 // 10
+    for _, size, path in sorted(files):
+        if total <= target:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        deleted += 1
+    return deleted
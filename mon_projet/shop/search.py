@@ -0,0 +1,331 @@
+"""
+Full-text search backends for the product catalog.
+
+Products are indexed on name, description and category name:
+- SQLite: an FTS5 virtual table (shop_product_fts) kept in sync by triggers
+- PostgreSQL: a tsvector column (shop_product.search_vector) with a GIN index,
+  filled by a trigger using an unaccented French text search configuration
+- anything else: icontains lookups on the same fields
+"""
+import re
+import unicodedata
+
+from django.db import connections
+from django.db.models import Q
+
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Combining diacritical marks, dropped from decomposed text
+ACCENTS = dict.fromkeys(range(0x300, 0x370))
+
+# (alias, database name) -> whether the index exists, so searching doesn't
+# introspect the schema on every request
+_installed = {}
+
+
+def tokenize(query):
+    return TOKEN_RE.findall(query or '')
+
+
+def fold(text):
+    """Lower-cased, without accents: 'Été' -> 'ete'"""
+    return unicodedata.normalize('NFKD', (text or '').lower()).translate(ACCENTS)
+
+
+class IContainsSearchBackend:
+    """Fallback used when the database has no full-text support installed"""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    @property
+    def cache_key(self):
+        return (self.connection.alias, str(self.connection.settings_dict['NAME']))
+
+    def is_installed(self):
+        if self.cache_key not in _installed:
+            _installed[self.cache_key] = self.detect_installed()
+        return _installed[self.cache_key]
+
+    def detect_installed(self):
+        return True
+
+    def install(self):
+        pass
+
+    def uninstall(self):
+        pass
+
+    def rebuild(self):
+        return 0
+
+    def search(self, queryset, query, rank=True):
+        terms = tokenize(query)
+        if not terms:
+            return queryset.none()
+
+        for term in terms:
+            queryset = queryset.filter(
+                Q(name__icontains=term)
+                | Q(description__icontains=term)
+                | Q(category__name__icontains=term)
+            )
+        return queryset
+
+
+class SQLiteSearchBackend(IContainsSearchBackend):
+    table = 'shop_product_fts'
+
+    create_sql = [
+        f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5(
+            name, description, category_name, category_id UNINDEXED,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+        """,
+        # Name matches weigh more than category matches, which weigh more
+        # than description matches.
+        f"INSERT INTO {table}({table}, rank) VALUES ('rank', 'bm25(10.0, 1.0, 3.0, 0.0)')",
+    ]
+
+    # Triggers on shop_category must not mention shop_product: SQLite refuses
+    # to rename a table referenced by another table's trigger, which breaks
+    # the table rebuilds Django's migrations rely on.
+    trigger_sql = [
+        f"""
+        CREATE TRIGGER IF NOT EXISTS shop_product_fts_insert AFTER INSERT ON shop_product BEGIN
+            INSERT INTO {table}(rowid, name, description, category_name, category_id)
+            SELECT new.id, new.name, new.description,
+                   (SELECT name FROM shop_category WHERE id = new.category_id), new.category_id;
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS shop_product_fts_update
+        AFTER UPDATE OF name, description, category_id ON shop_product BEGIN
+            DELETE FROM {table} WHERE rowid = old.id;
+            INSERT INTO {table}(rowid, name, description, category_name, category_id)
+            SELECT new.id, new.name, new.description,
+                   (SELECT name FROM shop_category WHERE id = new.category_id), new.category_id;
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS shop_product_fts_delete AFTER DELETE ON shop_product BEGIN
+            DELETE FROM {table} WHERE rowid = old.id;
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS shop_category_fts_update AFTER UPDATE OF name ON shop_category BEGIN
+            UPDATE {table} SET category_name = new.name WHERE category_id = new.id;
+        END
+        """,
+    ]
+
+    drop_sql = [
+        'DROP TRIGGER IF EXISTS shop_product_fts_insert',
+        'DROP TRIGGER IF EXISTS shop_product_fts_update',
+        'DROP TRIGGER IF EXISTS shop_product_fts_delete',
+        'DROP TRIGGER IF EXISTS shop_category_fts_update',
+        f'DROP TABLE IF EXISTS {table}',
+    ]
+
+    def has_fts5(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute('PRAGMA compile_options')
+            return any('ENABLE_FTS5' in row[0] for row in cursor.fetchall())
+
+    def detect_installed(self):
+        return self.table in self.connection.introspection.table_names()
+
+    def install(self):
+        """Create the index and (re)attach the triggers; safe to call repeatedly"""
+        if not self.has_fts5():
+            return
+
+        with self.connection.cursor() as cursor:
+            if not self.detect_installed():
+                for sql in self.create_sql:
+                    cursor.execute(sql)
+            # Rebuilding shop_product (e.g. SQLite AddField) drops its triggers
+            for sql in self.trigger_sql:
+                cursor.execute(sql)
+        _installed[self.cache_key] = True
+
+    def uninstall(self):
+        with self.connection.cursor() as cursor:
+            for sql in self.drop_sql:
+                cursor.execute(sql)
+        _installed.pop(self.cache_key, None)
+
+    def rebuild(self):
+        self.install()
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+            cursor.execute(f"""
+                INSERT INTO {self.table}(rowid, name, description, category_name, category_id)
+                SELECT p.id, p.name, p.description, c.name, c.id
+                FROM shop_product p JOIN shop_category c ON c.id = p.category_id
+            """)
+            count = cursor.rowcount
+            cursor.execute(f"INSERT INTO {self.table}({self.table}) VALUES ('optimize')")
+        return count
+
+    def build_query(self, terms):
+        # Every term must match; the last one may be an unfinished word
+        quoted = ['"%s"' % term.replace('"', '""') for term in terms]
+        quoted[-1] += '*'
+        return ' '.join(quoted)
+
+    def search(self, queryset, query, rank=True):
+        if not self.is_installed():
+            return super().search(queryset, query, rank)
+
+        terms = tokenize(query)
+        if not terms:
+            return queryset.none()
+
+        # Joining the index (rather than a correlated rank subquery) keeps
+        # it to a single MATCH per query.
+        queryset = queryset.extra(
+            tables=[self.table],
+            where=[f'{self.table}.rowid = shop_product.id', f'{self.table} MATCH %s'],
+            params=[self.build_query(terms)],
+        )
+        if not rank:
+            return queryset
+        return queryset.extra(
+            select={'search_rank': f'-{self.table}.rank'},
+        ).order_by('-search_rank', '-created_at')
+
+
+class PostgreSQLSearchBackend(IContainsSearchBackend):
+    config = 'shop_french'
+
+    install_sql = [
+        'CREATE EXTENSION IF NOT EXISTS unaccent',
+        f"""
+        DO $$ BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = '{config}') THEN
+                CREATE TEXT SEARCH CONFIGURATION {config} (COPY = french);
+                ALTER TEXT SEARCH CONFIGURATION {config}
+                    ALTER MAPPING FOR hword, hword_part, word WITH unaccent, french_stem;
+            END IF;
+        END $$
+        """,
+        'ALTER TABLE shop_product ADD COLUMN IF NOT EXISTS search_vector tsvector',
+        f"""
+        CREATE OR REPLACE FUNCTION shop_product_search_vector() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector :=
+                setweight(to_tsvector('{config}', coalesce(NEW.name, '')), 'A') ||
+                setweight(to_tsvector('{config}', coalesce(
+                    (SELECT name FROM shop_category WHERE id = NEW.category_id), '')), 'B') ||
+                setweight(to_tsvector('{config}', coalesce(NEW.description, '')), 'C');
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        'DROP TRIGGER IF EXISTS shop_product_search_vector_update ON shop_product',
+        """
+        CREATE TRIGGER shop_product_search_vector_update
+        BEFORE INSERT OR UPDATE OF name, description, category_id ON shop_product
+        FOR EACH ROW EXECUTE FUNCTION shop_product_search_vector()
+        """,
+        """
+        CREATE OR REPLACE FUNCTION shop_category_search_vector() RETURNS trigger AS $$
+        BEGIN
+            UPDATE shop_product SET category_id = category_id WHERE category_id = NEW.id;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        'DROP TRIGGER IF EXISTS shop_category_search_vector_update ON shop_category',
+        """
+        CREATE TRIGGER shop_category_search_vector_update
+        AFTER UPDATE OF name ON shop_category
+        FOR EACH ROW EXECUTE FUNCTION shop_category_search_vector()
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS shop_product_search_vector_idx
+        ON shop_product USING GIN (search_vector)
+        """,
+    ]
+
+    drop_sql = [
+        'DROP TRIGGER IF EXISTS shop_category_search_vector_update ON shop_category',
+        'DROP TRIGGER IF EXISTS shop_product_search_vector_update ON shop_product',
+        'DROP FUNCTION IF EXISTS shop_category_search_vector()',
+        'DROP FUNCTION IF EXISTS shop_product_search_vector()',
+        'ALTER TABLE shop_product DROP COLUMN IF EXISTS search_vector',
+        f'DROP TEXT SEARCH CONFIGURATION IF EXISTS {config}',
+    ]
+
+    def detect_installed(self):
+        with self.connection.cursor() as cursor:
+            columns = self.connection.introspection.get_table_description(cursor, 'shop_product')
+        return any(column.name == 'search_vector' for column in columns)
+
+    def install(self):
+        with self.connection.cursor() as cursor:
+            for sql in self.install_sql:
+                cursor.execute(sql)
+        _installed[self.cache_key] = True
+
+    def uninstall(self):
+        with self.connection.cursor() as cursor:
+            for sql in self.drop_sql:
+                cursor.execute(sql)
+        _installed.pop(self.cache_key, None)
+
+    def rebuild(self):
+        self.install()
+        with self.connection.cursor() as cursor:
+            # Touching the indexed columns fires the trigger for every row
+            cursor.execute('UPDATE shop_product SET name = name')
+            return cursor.rowcount
+
+    def build_query(self, terms):
+        terms = [term.replace("'", '') for term in terms]
+        return ' & '.join(f"'{term}':*" for term in terms)
+
+    def search(self, queryset, query, rank=True):
+        if not self.is_installed():
+            return super().search(queryset, query, rank)
+
+        terms = tokenize(query)
+        if not terms:
+            return queryset.none()
+
+        tsquery = self.build_query(terms)
+        queryset = queryset.extra(
+            where=[f"shop_product.search_vector @@ to_tsquery('{self.config}', %s)"],
+            params=[tsquery],
+        )
+        if not rank:
+            return queryset
+        return queryset.extra(
+            select={
+                'search_rank': f"ts_rank_cd(shop_product.search_vector, to_tsquery('{self.config}', %s))",
+            },
+            select_params=[tsquery],
+        ).order_by('-search_rank', '-created_at')
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgreSQLSearchBackend,
+}
+
+
+def get_search_backend(using='default'):
+    connection = connections[using]
+    backend_class = BACKENDS.get(connection.vendor, IContainsSearchBackend)
+    return backend_class(connection)
+
+
+def reinstall_search_triggers(sender, using='default', **kwargs):
+    """post_migrate hook: re-attach triggers dropped by table rebuilds"""
+    _installed.clear()
+    backend = get_search_backend(using)
+    if backend.is_installed():
+        backend.install()
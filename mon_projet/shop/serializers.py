@@ -1,36 +1,148 @@
+from django.core.exceptions import FieldDoesNotExist
 from rest_framework import serializers
 from .models import Category, Product, Cart, CartItem, Like
 from django.contrib.auth.models import User
 from .models import Category, Product, Cart, CartItem, Like, Order, OrderItem
 
-class CategorySerializer(serializers.ModelSerializer):
+
+class DynamicFieldsMixin:
+    """
+    Lets clients keep only some fields with ?fields=a,b or drop some with
+    ?omit=a,b. Applies to the serializer the view instantiates with the
+    request in its context, not to nested serializers.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None:
+            return
+        
+        params = getattr(request, 'query_params', request.GET)
+        requested = params.get('fields')
+        omitted = params.get('omit')
+        if requested:
+            keep = set(name.strip() for name in requested.split(','))
+            for name in set(self.fields) - keep:
+                self.fields.pop(name)
+        if omitted:
+            for name in omitted.split(','):
+                self.fields.pop(name.strip(), None)
+    
+    def get_only_fields(self):
+        """ORM paths the selected fields read, for QuerySet.only()"""
+        model = self.Meta.model
+        paths = []
+        for field in self.fields.values():
+            if field.source == '*' or isinstance(field, serializers.SerializerMethodField):
+                continue
+            
+            parts = field.source.split('.')
+            try:
+                model_field = model._meta.get_field(parts[0])
+            except FieldDoesNotExist:
+                # Annotations and properties are not columns
+                continue
+            if len(parts) > 1 and not model_field.is_relation:
+                continue
+            paths.append('__'.join(parts))
+        return paths
+
+
+class CategorySerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = ['id', 'name', 'slug', 'description', 'created_at']
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class CategoryStatsSerializer(CategorySerializer):
+    """Category with the counts and price range of its active products"""
+    product_count = serializers.IntegerField(read_only=True)
+    in_stock_count = serializers.IntegerField(read_only=True)
+    min_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    max_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    
+    class Meta(CategorySerializer.Meta):
+        fields = CategorySerializer.Meta.fields + [
+            'product_count', 'in_stock_count', 'min_price', 'max_price'
+        ]
+    
+    # A category without active products, or whose stats the context lacks
+    EMPTY_STATS = {'product_count': 0, 'in_stock_count': 0, 'min_price': None, 'max_price': None}
+    
+    # The view puts the cached per-category stats in the context
+    def to_representation(self, instance):
+        stats = self.context.get('category_stats', {}).get(instance.pk, self.EMPTY_STATS)
+        for name, value in stats.items():
+            setattr(instance, name, value)
+        return super().to_representation(instance)
+
+
+class ImageSrcsetField(serializers.Field):
+    """
+    {format: srcset} for a Product.image_derivatives value, e.g.
+    {"webp": "https://.../cover-200w.webp 200w, ...", "jpeg": "..."}, or
+    None when the image has no derivatives
+    """
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+    
+    def to_representation(self, value):
+        if not value:
+            return None
+        storage = Product._meta.get_field('image').storage
+        request = self.context.get('request')
+        srcsets = {}
+        for format, entries in value.items():
+            urls = [(storage.url(name), width) for width, name in entries]
+            if request is not None:
+                urls = [(request.build_absolute_uri(url), width) for url, width in urls]
+            srcsets[format] = ', '.join(f'{url} {width}w' for url, width in urls)
+        return srcsets
+
+
+class CatalogProductSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """Product fields shared by every visitor, safe to cache publicly"""
     category_name = serializers.CharField(source='category.name', read_only=True)
-    is_liked = serializers.SerializerMethodField()
-    likes_count = serializers.SerializerMethodField()
+    image_srcset = ImageSrcsetField(source='image_derivatives')
     
     class Meta:
         model = Product
         fields = [
             'id', 'name', 'slug', 'description', 'price', 
-            'category', 'category_name', 'image', 'stock', 
+            'category', 'category_name', 'image', 'image_srcset', 
+            'image_width', 'image_height', 'image_blurhash', 'image_color', 'stock', 
             'is_featured', 'is_active', 'created_at', 
-            'is_liked', 'likes_count'
+            'likes_count'
+        ]
+
+
+class ProductListSerializer(CatalogProductSerializer):
+    """Lightweight representation for product grids; details come from retrieve"""
+    class Meta(CatalogProductSerializer.Meta):
+        fields = [
+            'id', 'name', 'slug', 'price', 
+            'category', 'category_name', 'image', 'image_srcset', 
+            'image_width', 'image_height', 'image_blurhash', 'image_color', 'stock', 
+            'is_featured', 'likes_count'
         ]
+
+
+class ProductSerializer(CatalogProductSerializer):
+    is_liked = serializers.SerializerMethodField()
     
+    class Meta(CatalogProductSerializer.Meta):
+        fields = CatalogProductSerializer.Meta.fields + ['is_liked']
+    
+    # Querysets built with Product.objects.for_listing() carry is_liked as an
+    # annotation; the per-object query is only a fallback.
     def get_is_liked(self, obj):
+        if hasattr(obj, 'is_liked'):
+            return obj.is_liked
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             return Like.objects.filter(user=request.user, product=obj).exists()
         return False
-    
-    def get_likes_count(self, obj):
-        return obj.likes.count()
 
 
 class CartItemSerializer(serializers.ModelSerializer):
@@ -57,7 +169,7 @@ class CartSerializer(serializers.ModelSerializer):
         fields = ['id', 'items', 'total_price', 'total_items', 'created_at', 'updated_at']
 
 
-class LikeSerializer(serializers.ModelSerializer):
+class LikeSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
     
     class Meta:
@@ -71,11 +183,12 @@ class LikeSerializer(serializers.ModelSerializer):
 class OrderItemSerializer(serializers.ModelSerializer):
     product_name = serializers.CharField(source='product.name', read_only=True)
     product_image = serializers.ImageField(source='product.image', read_only=True)
+    product_image_srcset = ImageSrcsetField(source='product.image_derivatives')
     subtotal = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
     
     class Meta:
         model = OrderItem
-        fields = ['id', 'product', 'product_name', 'product_image', 'quantity', 'price', 'subtotal']
+        fields = ['id', 'product', 'product_name', 'product_image', 'product_image_srcset', 'quantity', 'price', 'subtotal']
 
 
 class OrderSerializer(serializers.ModelSerializer):
@@ -0,0 +1,115 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from PIL import Image
+
+from .cache import category_products_tag, invalidate_tags
+from .images import IMAGE_FIELDS, delete_derivatives, process_image
+from .models import Category, MediaBlob, Product
+from .similarity import update_product
+from .suggest import update_on_commit
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_cache(sender, instance, **kwargs):
+    tags = {'product', category_products_tag(instance.category_id)}
+    # A product moved to another category changes the stats of both
+    previous = getattr(instance, '_loaded_category_id', None)
+    if previous is not None:
+        tags.add(category_products_tag(previous))
+    instance._loaded_category_id = instance.category_id
+    invalidate_tags(*tags)
+
+
+@receiver(post_save, sender=Product)
+def update_image(sender, instance, raw=False, **kwargs):
+    # Deferred and never assigned: unchanged
+    if raw or 'image' not in instance.__dict__:
+        return
+    name = instance.image.name or ''
+    previous = getattr(instance, '_loaded_image', '')
+    if name == previous:
+        return
+
+    storage = instance.image.storage
+    fields = dict(IMAGE_FIELDS, image_derivatives={})
+    if name:
+        MediaBlob.objects.retain(name)
+        try:
+            fields = process_image(storage, name)
+        except (OSError, Image.DecompressionBombError):
+            # Unreadable: clients fall back to the original
+            pass
+    if previous:
+        release_image(storage, previous, instance.image_derivatives, keep=fields['image_derivatives'])
+
+    Product.objects.filter(pk=instance.pk).update(**fields)
+    for field, value in fields.items():
+        setattr(instance, field, value)
+    instance._loaded_image = name
+
+
+@receiver(post_save, sender=Product)
+def update_similar_products(sender, instance, raw=False, **kwargs):
+    # Deferred and never assigned: unchanged
+    if raw or 'name' not in instance.__dict__ or 'description' not in instance.__dict__:
+        return
+    text = (instance.name, instance.description, instance.category_id)
+    if text == getattr(instance, '_loaded_text', None):
+        return
+    update_product(instance)
+    instance._loaded_text = text
+
+
+@receiver(post_save, sender=Product)
+def update_suggestions(sender, instance, raw=False, using='default', **kwargs):
+    # Deferred fields: the next sync reads them
+    if raw or not {'name', 'is_active', 'likes_count'} <= instance.__dict__.keys():
+        return
+    update_on_commit(
+        using, 'update_product', instance.pk, instance.name, instance.is_active, instance.likes_count,
+    )
+
+
+@receiver(post_delete, sender=Product)
+def remove_deleted_suggestion(sender, instance, using='default', **kwargs):
+    update_on_commit(using, 'remove_product', instance.pk)
+
+
+@receiver(post_delete, sender=Product)
+def release_deleted_image(sender, instance, **kwargs):
+    if instance.__dict__.get('image'):
+        derivatives = instance.__dict__.get('image_derivatives') or {}
+        release_image(instance.image.storage, instance.image.name, derivatives)
+
+
+def release_image(storage, name, derivatives, keep=None):
+    """Drop a reference to an image file, deleting it after commit if it was the last"""
+    if not MediaBlob.objects.release(name):
+        return
+
+    def delete():
+        # The counts can drift (bulk imports, raw fixtures): the rows decide
+        if Product.objects.filter(image=name).exists():
+            return
+        storage.delete(name)
+        delete_derivatives(storage, derivatives, keep)
+    transaction.on_commit(delete)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_cache(sender, **kwargs):
+    invalidate_tags('category')
+
+
+@receiver(post_save, sender=Category)
+def update_category_suggestions(sender, instance, raw=False, using='default', **kwargs):
+    if not raw:
+        update_on_commit(using, 'update_category', instance.pk, instance.name)
+
+
+@receiver(post_delete, sender=Category)
+def remove_category_suggestion(sender, instance, using='default', **kwargs):
+    update_on_commit(using, 'remove_category', instance.pk)
@@ -0,0 +1,214 @@
+"""
+"Did you mean" corrections for catalog searches that find nothing.
+
+The dictionary is the SHOP_SPELLING_MAX_WORDS most frequent words of
+product names and descriptions, seen at least SHOP_SPELLING_MIN_COUNT
+times, folded like search terms (lower case, no accents). It is looked up
+SymSpell style, by symmetric deletes: two words within
+SHOP_SPELLING_MAX_DISTANCE edits of each other share a string obtained by
+deleting at most that many letters from each. Deleting from the word's
+first PREFIX_LENGTH letters only is enough to find almost every candidate,
+and keeps the variants per word to a few dozen.
+
+`manage.py rebuild_spelling` stores the words (SpellingWord) and the
+variants of each (SpellingDelete), so the dictionary's size is bounded by
+the word limit and no process holds it in memory. Correcting a query
+generates its unknown words' variants and reads the words sharing one in a
+single indexed lookup; the candidates are then ranked by true edit
+distance (with adjacent transpositions, "rmoan" -> "roman" is one), then
+by frequency.
+"""
+import heapq
+import math
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from .models import Product, SpellingDelete, SpellingWord
+from .search import fold, tokenize
+
+
+# Letters of a word its variants are made from
+PREFIX_LENGTH = 7
+
+# Shorter words are left as typed: too many words are one edit away
+MIN_LENGTH = 3
+
+# Candidate corrections kept per misspelled word
+CANDIDATES = 3
+
+MAX_WORD_LENGTH = SpellingWord._meta.get_field('word').max_length
+
+DELETES = SpellingDelete._meta.db_table
+
+INSERT_DELETES_SQL = f'INSERT INTO {DELETES} (variant, word_id) VALUES (%s, %s)'
+
+CHUNK_SIZE = 2000
+
+
+def get_max_words():
+    return getattr(settings, 'SHOP_SPELLING_MAX_WORDS', 50000)
+
+
+def get_min_count():
+    return getattr(settings, 'SHOP_SPELLING_MIN_COUNT', 2)
+
+
+def get_max_distance():
+    return getattr(settings, 'SHOP_SPELLING_MAX_DISTANCE', 2)
+
+
+def get_suggestion_count():
+    return getattr(settings, 'SHOP_SPELLING_SUGGESTIONS', 3)
+
+
+def is_correctable(word):
+    return len(word) >= MIN_LENGTH and not word.isdigit()
+
+
+def variants(word, distance):
+    """The start of word with up to distance letters deleted, itself included"""
+    found = frontier = {word[:PREFIX_LENGTH]}
+    for _ in range(distance):
+        frontier = {
+            variant[:i] + variant[i + 1:]
+            for variant in frontier if len(variant) > 1
+            for i in range(len(variant))
+        }
+        found = found | frontier
+    return found
+
+
+def edit_distance(a, b, limit):
+    """
+    Optimal string alignment distance: insertions, deletions, substitutions
+    and swaps of adjacent letters. Anything past limit is limit + 1.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    # Common ends cost nothing: only the differing middles go through the table
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < len(a) - start and end < len(b) - start and a[-1 - end] == b[-1 - end]:
+        end += 1
+    a, b = a[start:len(a) - end], b[start:len(b) - end]
+    if not a or not b:
+        return len(a) + len(b)
+
+    previous, current = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous, current = previous, current, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+    return min(current[-1], limit + 1)
+
+
+def count_words(using='default'):
+    """{folded word: (count, most common spelling)} of the catalog"""
+    spellings = Counter()
+    rows = Product.objects.using(using).order_by().values_list('name', 'description')
+    for name, description in rows.iterator(chunk_size=CHUNK_SIZE):
+        spellings.update(tokenize(f'{name} {description}'.lower()))
+
+    words = defaultdict(Counter)
+    for spelling, count in spellings.items():
+        words[fold(spelling)[:MAX_WORD_LENGTH]][spelling[:MAX_WORD_LENGTH]] += count
+    return {
+        word: (sum(counts.values()), counts.most_common(1)[0][0])
+        for word, counts in words.items() if is_correctable(word)
+    }
+
+
+def rebuild(using='default'):
+    """Recompute the dictionary from the catalog. Returns (words, variants)."""
+    counts = count_words(using)
+    min_count = get_min_count()
+    kept = heapq.nlargest(
+        get_max_words(),
+        ((count, word, spelling) for word, (count, spelling) in counts.items() if count >= min_count),
+    )
+    del counts
+
+    distance = get_max_distance()
+    stored = 0
+    with transaction.atomic(using=using):
+        SpellingDelete.objects.using(using).all().delete()
+        SpellingWord.objects.using(using).all().delete()
+        words = SpellingWord.objects.using(using).bulk_create(
+            [SpellingWord(word=word, spelling=spelling, count=count) for count, word, spelling in kept],
+            batch_size=1000,
+        )
+        with connections[using].cursor() as cursor:
+            # executemany() rather than bulk_create(), as for ProductTerm
+            batch = []
+            for word in words:
+                batch.extend((variant, word.pk) for variant in variants(word.word, distance))
+                if len(batch) >= 5000:
+                    cursor.executemany(INSERT_DELETES_SQL, batch)
+                    stored += len(batch)
+                    batch = []
+            cursor.executemany(INSERT_DELETES_SQL, batch)
+            stored += len(batch)
+    return len(words), stored
+
+
+def corrections(query, using='default'):
+    """
+    Up to SHOP_SPELLING_SUGGESTIONS corrected versions of query, best
+    first; empty when every word is known or none has a close enough one
+    """
+    typed = tokenize(query.lower())
+    terms = [fold(term)[:MAX_WORD_LENGTH] for term in typed]
+    correctable = {term for term in terms if is_correctable(term)}
+    if not correctable:
+        return []
+
+    known = dict(SpellingWord.objects.using(using).filter(word__in=correctable).values_list('word', 'spelling'))
+    unknown = correctable - known.keys()
+    if not unknown:
+        return []
+
+    distance = get_max_distance()
+    lookups = set().union(*(variants(term, distance) for term in unknown))
+    candidates = (
+        SpellingWord.objects.using(using).filter(pk__in=SpellingDelete.objects.using(using).filter(
+            variant__in=lookups,
+        ).values('word'))
+        .values_list('word', 'spelling', 'count')
+    )
+    # term -> [(edit distance, -log count, spelling)]
+    found = defaultdict(list)
+    for word, spelling, count in candidates:
+        for term in unknown:
+            edits = edit_distance(term, word, distance)
+            if edits <= distance:
+                found[term].append((edits, -math.log(count), spelling))
+    if not found:
+        return []
+
+    # Per word, its best corrections; known words take their catalog
+    # spelling, and the others stay as typed
+    choices = [
+        heapq.nsmallest(CANDIDATES, found[term]) if term in found else [(0, 0, known.get(term, word))]
+        for term, word in zip(terms, typed)
+    ]
+    # Every word's best correction, then the same with one word's next best
+    best = [options[0] for options in choices]
+    combinations = [best] + [
+        best[:i] + [option] + best[i + 1:] for i, options in enumerate(choices) for option in options[1:]
+    ]
+    combinations.sort(key=lambda combination: (
+        sum(edits for edits, _, _ in combination), sum(rarity for _, rarity, _ in combination),
+    ))
+    return [
+        ' '.join(spelling for _, _, spelling in combination)
+        for combination in combinations[:get_suggestion_count()]
+    ]
@@ -0,0 +1,56 @@
+"""
+Content-addressed file storage for product images.
+
+ContentHashStorage names every file after the sha256 of its content, under
+two levels of shard directories taken from the hash:
+
+    products/photo.jpg -> products/3f/a2/3fa2...e1.jpg
+
+Saving content that is already stored returns the existing name without
+writing anything, so identical uploads share one file, and a name always
+refers to the same bytes (safe to cache forever). MediaBlob counts the
+products referencing each file; the signals delete a file once nothing uses
+it, and `manage.py dedupe_media` moves older files into this layout and
+repairs the counts.
+"""
+import hashlib
+import posixpath
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+
+def content_name(name, content):
+    """Content-addressed name for content uploaded as name"""
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    key = digest.hexdigest()
+    directory, filename = posixpath.split(name)
+    extension = posixpath.splitext(filename)[1].lower()
+    return posixpath.join(directory, key[:2], key[2:4], key + extension)
+
+
+def is_content_name(name):
+    """Whether name already follows the content-addressed layout"""
+    parts = name.split('/')
+    key = posixpath.splitext(parts[-1])[0]
+    return (
+        len(parts) >= 3 and len(key) == 64 and set(key) <= set('0123456789abcdef')
+        and parts[-3] == key[:2] and parts[-2] == key[2:4]
+    )
+
+
+class ContentHashStorage(FileSystemStorage):
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = content_name(name, content)
+        if self.exists(name):
+            return name
+        # Two first uploads of the same content racing each other end up
+        # as two files, the second with a random suffix: wasteful, not wrong
+        return super().save(name, content, max_length)
@@ -0,0 +1,375 @@
+"""
+Search-as-you-type suggestions, for products/suggest/?q=.
+
+Each process keeps a prefix index of the names of active products, and one
+of category names, in memory (PrefixIndex). Names are folded like search
+terms (lower case, no accents) and split into words; each word lists the
+names using it, most liked first. A query matches the names holding all of
+its words, the last one possibly unfinished, so "petit pri" finds
+"Le Petit Prince":
+
+- with finished words, the rarest one's list is walked in order, keeping
+  the names that hold the other words and the prefix, until there are
+  enough; unless fewer names hold a word the prefix begins, which are then
+  all checked;
+- an unfinished word alone merges the lists of the words it begins, found
+  by bisecting the sorted vocabulary. Prefixes beginning more than
+  MANY_WORDS words (all the one- and two-letter ones, say) keep their best
+  names ready instead, computed from their longer prefixes' when indexing.
+
+Either way a query stops at its first SHOP_SUGGEST_LIMIT matches, or after
+MAX_SCAN names: with a million names, most take tens of microseconds and
+the slowest a few milliseconds (see `manage.py benchmark_suggest`).
+
+The index is built on first use. Products and categories saved or deleted
+update it through signals in the process that changed them; other
+processes apply the products saved since (by updated_at) at most every
+SHOP_SUGGEST_SYNC_SECONDS. Likes counts are read when a product is
+indexed, and the whole index is rebuilt in the background every
+SHOP_SUGGEST_MAX_AGE seconds, which also catches bulk updates and deletions
+made by other processes.
+"""
+import heapq
+import itertools
+import operator
+import sys
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from .models import Category, Product
+from .search import fold, tokenize
+
+
+# Prefixes beginning more words than this are too slow to merge on every
+# keystroke: their best ids are kept ready
+MANY_WORDS = 32
+
+# Prefixes beginning more words than this are assumed to hold more names
+# than the rarest finished word of a query
+COUNTED_WORDS = 256
+
+# Most ids a query walks through looking for matches, so that a common word
+# followed by a rare one can't scan half the catalog
+MAX_SCAN = 5000
+
+# Ids checked at a time while walking
+WALK_CHUNK = 500
+
+# Transactions saved before a sync may commit after it: each sync reads
+# this far back again
+SYNC_OVERLAP = timedelta(minutes=1)
+
+CHUNK_SIZE = 5000
+
+
+def get_limit():
+    return getattr(settings, 'SHOP_SUGGEST_LIMIT', 10)
+
+
+def get_sync_seconds():
+    return getattr(settings, 'SHOP_SUGGEST_SYNC_SECONDS', 5)
+
+
+def get_max_age():
+    return getattr(settings, 'SHOP_SUGGEST_MAX_AGE', 3600)
+
+
+def words(text):
+    """Folded words of text, without repeats; one copy of each string per process"""
+    return tuple(dict.fromkeys(sys.intern(word) for word in tokenize(fold(text))))
+
+
+class PrefixIndex:
+    """
+    Ids of names, found by their words' prefixes, heaviest first. search()
+    holds lock while it reads; writers (add, remove) must hold it too, as
+    they change the postings a search walks through.
+    """
+
+    def __init__(self, limit, lock=None):
+        self.limit = limit
+        self.lock = threading.Lock() if lock is None else lock
+        self.weights = {}
+        self.entry_words = {}
+        # word -> ids of the names using it, in sort_key() order
+        self.postings = {}
+        self.vocabulary = []
+        # prefix beginning MANY_WORDS words or more -> its best limit ids
+        self.top = {}
+
+    def __len__(self):
+        return len(self.entry_words)
+
+    def sort_key(self, entry_id):
+        # Removed names sort first, they are no longer read
+        return (-self.weights.get(entry_id, 0), entry_id)
+
+    def load(self, rows):
+        """Fill an empty index from (id, name, weight) rows"""
+        for entry_id, name, weight in rows:
+            self.weights[entry_id] = weight
+            self.entry_words[entry_id] = entry_words = words(name)
+            for word in entry_words:
+                self.postings.setdefault(word, []).append(entry_id)
+        for ids in self.postings.values():
+            ids.sort(key=self.sort_key)
+        self.vocabulary = sorted(self.postings)
+        counts = Counter(word[:length] for word in self.vocabulary for length in range(1, len(word) + 1))
+        # Longest first: a prefix's best ids come from its longer prefixes'
+        self.top = {}
+        for prefix in sorted((prefix for prefix, count in counts.items() if count > MANY_WORDS), key=len, reverse=True):
+            self.top[prefix] = self.best(prefix)
+
+    def add(self, entry_id, name, weight):
+        """Index or re-index a name"""
+        self.remove(entry_id)
+        self.weights[entry_id] = weight
+        self.entry_words[entry_id] = entry_words = words(name)
+        key = self.sort_key(entry_id)
+        for word in entry_words:
+            ids = self.postings.get(word)
+            if ids is None:
+                ids = self.postings[word] = []
+                insort(self.vocabulary, word)
+            ids.insert(self.position(ids, key), entry_id)
+        self.refresh_top(entry_id, entry_words)
+
+    def remove(self, entry_id):
+        entry_words = self.entry_words.pop(entry_id, None)
+        if entry_words is None:
+            return
+        for word in entry_words:
+            ids = self.postings[word]
+            ids.remove(entry_id)
+            if not ids:
+                del self.postings[word]
+                del self.vocabulary[bisect_left(self.vocabulary, word)]
+        del self.weights[entry_id]
+        self.refresh_top(entry_id, entry_words)
+
+    def position(self, ids, key):
+        """Where an id with sort key key goes in ids"""
+        low, high = 0, len(ids)
+        while low < high:
+            middle = (low + high) // 2
+            if self.sort_key(ids[middle]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def refresh_top(self, entry_id, entry_words):
+        """Recompute the ready prefixes entry_id was, or may now be, among the best of"""
+        prefixes = {
+            word[:length] for word in entry_words for length in range(1, len(word) + 1)
+        }.intersection(self.top)
+        for prefix in sorted(prefixes, key=len, reverse=True):
+            best = self.top[prefix]
+            if (
+                entry_id in best or len(best) < self.limit
+                or (entry_id in self.weights and self.sort_key(entry_id) < self.sort_key(best[-1]))
+            ):
+                self.top[prefix] = self.best(prefix)
+
+    def words_beginning(self, prefix):
+        start = bisect_left(self.vocabulary, prefix)
+        end = bisect_left(self.vocabulary, after(prefix), start)
+        return self.vocabulary[start:end]
+
+    def best(self, prefix):
+        """
+        Recompute the best ids for a ready prefix: the merge of its longer
+        ready prefixes' and of the other words it begins
+        """
+        begin = self.words_beginning(prefix)
+        lists = []
+        i = 0
+        while i < len(begin):
+            longer = begin[i][:len(prefix) + 1]
+            if longer != prefix and longer in self.top:
+                lists.append(self.top[longer])
+                i = bisect_left(begin, after(longer), i)
+            else:
+                lists.append(self.postings[begin[i]])
+                i += 1
+        return self.merge(lists, self.limit)
+
+    def merge(self, lists, limit):
+        """The best limit ids of lists of ids in sort_key() order"""
+        found = []
+        for entry_id in heapq.merge(*lists, key=self.sort_key):
+            # A name can hold several words beginning with prefix
+            if entry_id not in found:
+                found.append(entry_id)
+                if len(found) == limit:
+                    break
+        return found
+
+    def search(self, query, limit=None):
+        """Ids of the best names holding every word of query, the last one as a prefix"""
+        with self.lock:
+            return self.find(query, limit)
+
+    def find(self, query, limit=None):
+        """search() without the lock"""
+        limit = self.limit if limit is None else min(limit, self.limit)
+        terms = words(query)
+        if not terms:
+            return []
+        *complete, prefix = terms
+        if not complete:
+            if prefix in self.top:
+                return self.top[prefix][:limit]
+            return self.merge([self.postings.get(word, []) for word in self.words_beginning(prefix)], limit)
+
+        if any(word not in self.postings for word in complete):
+            return []
+
+        complete.sort(key=lambda word: len(self.postings[word]))
+        rarest = self.postings[complete[0]]
+
+        begin = self.words_beginning(prefix)
+        if len(begin) <= COUNTED_WORDS:
+            lists = [self.postings.get(word, []) for word in begin]
+            if sum(map(len, lists)) < min(len(rarest), MAX_SCAN):
+                # Fewer names hold a word beginning with prefix: check them all
+                ids = list(set(itertools.chain.from_iterable(lists)))
+                return heapq.nsmallest(limit, self.holding(ids, complete), key=self.sort_key)
+
+        # Otherwise walk the rarest word's ids, best first, until there are enough
+        def holds_prefix(entry_id):
+            for word in self.entry_words.get(entry_id, ()):
+                if word.startswith(prefix):
+                    return True
+            return False
+        found = []
+        for start in range(0, min(len(rarest), MAX_SCAN), WALK_CHUNK):
+            chunk = self.holding(rarest[start:start + WALK_CHUNK], complete[1:])
+            found.extend(filter(holds_prefix, chunk))
+            if len(found) >= limit:
+                break
+        return found[:limit]
+
+    def holding(self, ids, required):
+        """The ids whose names hold every word of required, in order"""
+        for word in required:
+            # All in C: a few hundred microseconds for MAX_SCAN ids
+            entry_words = map(self.entry_words.get, ids, itertools.repeat(()))
+            ids = list(itertools.compress(ids, map(operator.contains, entry_words, itertools.repeat(word))))
+        return ids
+
+
+class Suggestions:
+    """The product and category indexes of one database, and how fresh they are"""
+
+    def __init__(self, using='default'):
+        self.using = using
+        # One lock for both indexes: searches wait for the write in progress
+        self.lock = threading.Lock()
+        self.products = PrefixIndex(get_limit(), self.lock)
+        self.categories = PrefixIndex(get_limit(), self.lock)
+        self.built_at = self.checked_at = time.monotonic()
+        self.synced_at = timezone.now()
+        self.rebuilding = False
+
+    @classmethod
+    def build(cls, using='default'):
+        suggestions = cls(using)
+        # Products saved while this runs are applied again by the first sync
+        products = (
+            Product.objects.using(using).filter(is_active=True).order_by()
+            .values_list('pk', 'name', 'likes_count')
+        )
+        suggestions.products.load(products.iterator(chunk_size=CHUNK_SIZE))
+        categories = Category.objects.using(using).order_by().annotate(
+            likes=Sum('products__likes_count', filter=Q(products__is_active=True)),
+        ).values_list('pk', 'name', 'likes')
+        suggestions.categories.load((pk, name, likes or 0) for pk, name, likes in categories)
+        return suggestions
+
+    def sync(self):
+        """Apply the products saved since the last sync, by any process"""
+        now = timezone.now()
+        rows = changed_products(self.synced_at - SYNC_OVERLAP, self.using).values_list(
+            'pk', 'name', 'is_active', 'likes_count',
+        )
+        for row in rows:
+            self.update_product(*row)
+        self.synced_at = now
+
+    def update_product(self, pk, name, is_active, likes_count):
+        with self.lock:
+            if is_active:
+                self.products.add(pk, name, likes_count)
+            else:
+                self.products.remove(pk)
+
+    def update_category(self, pk, name):
+        with self.lock:
+            # Keeps its likes until the next rebuild
+            self.categories.add(pk, name, self.categories.weights.get(pk, 0))
+
+    def remove_product(self, pk):
+        with self.lock:
+            self.products.remove(pk)
+
+    def remove_category(self, pk):
+        with self.lock:
+            self.categories.remove(pk)
+
+
+def after(prefix):
+    """The first string after every one beginning with prefix"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def changed_products(since, using='default'):
+    return Product.objects.using(using).filter(updated_at__gte=since).order_by()
+
+
+# database alias -> Suggestions
+_suggestions = {}
+_build_lock = threading.Lock()
+
+
+def get_suggestions(using='default'):
+    """The process's indexes for the database, built on first use and kept fresh"""
+    with _build_lock:
+        suggestions = _suggestions.get(using)
+        if suggestions is None:
+            suggestions = _suggestions[using] = Suggestions.build(using)
+        elif time.monotonic() - suggestions.built_at > get_max_age() and not suggestions.rebuilding:
+            suggestions.rebuilding = True
+            threading.Thread(target=rebuild, args=(using, suggestions), daemon=True).start()
+
+    if time.monotonic() - suggestions.checked_at > get_sync_seconds():
+        suggestions.checked_at = time.monotonic()
+        suggestions.sync()
+    return suggestions
+
+
+def rebuild(using, previous):
+    """Replace previous with a fresh build; runs in its own thread"""
+    try:
+        _suggestions[using] = Suggestions.build(using)
+    finally:
+        previous.rebuilding = False
+        # The thread's own connection
+        connections[using].close()
+
+
+def update_on_commit(using, method, *args):
+    """Call Suggestions.method(*args) once the transaction commits, if the index is built"""
+    def run():
+        suggestions = _suggestions.get(using)
+        if suggestions is not None:
+            getattr(suggestions, method)(*args)
+    transaction.on_commit(run, using=using)
@@ -1,3 +1,1417 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from django.utils.text import slugify
+from PIL import Image
+from rest_framework.test import APIClient
+
+from . import recommendations, resize, search as search_module, suggest
+from .compression import brotli, compress_stream, get_level
+from .images import blurhash, get_placeholder
+from .models import (
+    Cart, CartItem, Category, Like, MediaBlob, Order, OrderItem, Product, ProductRecommendation,
+)
+from .search import SQLiteSearchBackend, get_search_backend
+from .serializers import CategoryStatsSerializer
+from .spelling import corrections, rebuild as rebuild_spelling
+from .suggest import Suggestions, changed_products, get_suggestions
+from .trending import compute_scores, score_now
+
+
+# SQLite prints "SCAN shop_product" for a full table scan and
+# "SCAN shop_product USING INDEX ..." for a walk along an index
+SQLITE_FULL_SCAN_RE = re.compile(r'^SCAN (\w+)$')
+POSTGRESQL_FULL_SCAN_RE = re.compile(r'Seq Scan on (\w+)')
+
+
+def png_file(color, size=(64, 48)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'PNG')
+    return ContentFile(buffer.getvalue(), name='cover.png')
+
+
+class TemporaryMediaMixin:
+    """Product images go to a temporary MEDIA_ROOT"""
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.storage = Product._meta.get_field('image').storage
+
+
+class QueryPlanTests(TestCase):
+    """
+    EXPLAIN every query the API endpoints run and fail if one of them reads
+    a shop table with a full scan instead of an index.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('plans', password='x')
+        cls.categories = [
+            Category.objects.create(name=f'Catégorie {i}', slug=f'category-{i}') for i in range(3)
+        ]
+        cls.products = [
+            Product.objects.create(
+                name=f'Livre {i}', slug=f'book-{i}', description='Un roman',
+                price=Decimal('9.99') + i, category=cls.categories[i % 3],
+                stock=i % 4, is_featured=i % 5 == 0, is_active=i % 7 != 0,
+            )
+            for i in range(30)
+        ]
+        for product in cls.products[1:6]:
+            Like.objects.create(user=cls.user, product=product)
+
+        cart = Cart.objects.create(user=cls.user)
+        CartItem.objects.create(cart=cart, product=cls.products[1], quantity=2)
+        cls.order = Order.objects.create(
+            user=cls.user, order_number='PLAN000001', total_price=Decimal('19.98'),
+            payment_method='delivery', full_name='Plan', phone='0600000000',
+            address='1 rue de la Paix', city='Paris', postal_code='75002',
+        )
+        OrderItem.objects.create(order=cls.order, product=cls.products[1], quantity=2, price=Decimal('9.99'))
+        ProductRecommendation.objects.bulk_create([
+            ProductRecommendation(
+                product=cls.products[1], recommended=product, kind=kind, rank=rank, score=0.5, together=2,
+            )
+            for kind in ('liked', 'bought')
+            for rank, product in enumerate(cls.products[2:6])
+        ])
+        rebuild_spelling()
+
+    def setUp(self):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            self.skipTest(f'No query plan parser for {connection.vendor}')
+        # Cached responses would skip the queries under test
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_queries(self, url):
+        queries = []
+
+        def capture(execute, sql, params, many, context):
+            queries.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(capture):
+            response = self.client.get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200, url)
+        return [(sql, params) for sql, params in queries if sql.lstrip().upper().startswith('SELECT')]
+
+    def explain(self, sql, params):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # Test tables are so small that a sequential scan always wins;
+                # the question is whether an index could be used at all
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute(f'EXPLAIN {sql}', params)
+                return [row[0] for row in cursor.fetchall()]
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[3] for row in cursor.fetchall()]
+
+    def full_scans(self, plan):
+        pattern = SQLITE_FULL_SCAN_RE if connection.vendor == 'sqlite' else POSTGRESQL_FULL_SCAN_RE
+        return [match[1] for match in map(pattern.search, plan) if match]
+
+    def assertUsesIndexes(self, url, allowed_scans=()):
+        for sql, params in self.get_queries(url):
+            plan = self.explain(sql, params)
+            scans = [table for table in self.full_scans(plan) if table not in allowed_scans]
+            self.assertFalse(scans, f'{url}\n{sql}\n' + '\n'.join(plan))
+
+    def next_link(self, url):
+        return self.client.get(url).json()['next']
+
+    def test_product_endpoints(self):
+        urls = [
+            '/api/shop/products/',
+            '/api/shop/products/?page=2',
+            '/api/shop/products/?cursor=',
+            self.next_link('/api/shop/products/?cursor=&page_size=5'),
+            '/api/shop/products/?category=category-1',
+            '/api/shop/products/?category=category-1&cursor=',
+            '/api/shop/products/?featured=1',
+            '/api/shop/products/?search=livre',
+            # Finds nothing, then searches for the correction
+            '/api/shop/products/?search=lvire%20romn',
+            '/api/shop/products/?ordering=trending',
+            '/api/shop/products/?ordering=popular',
+            '/api/shop/products/?ordering=price',
+            '/api/shop/products/?ordering=-price',
+            '/api/shop/products/?category=category-1&ordering=price',
+            '/api/shop/products/book-1/',
+            '/api/shop/products/featured/',
+            '/api/shop/products/featured/?fallback=trending',
+            '/api/shop/products/by_category/?slug=category-1',
+            '/api/shop/products/facets/',
+            '/api/shop/products/book-1/recommendations/',
+            '/api/shop/products/suggest/?q=liv',
+            '/api/shop/products/suggest/?q=livre%201',
+        ]
+        # The suggestion index reads every product, once per process
+        get_suggestions()
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertUsesIndexes(url)
+
+    def test_category_endpoints(self):
+        # The category list is meant to read every category
+        self.assertUsesIndexes('/api/shop/categories/', allowed_scans=['shop_category'])
+        self.assertUsesIndexes('/api/shop/categories/category-1/')
+
+    def test_cart_endpoints(self):
+        self.assertUsesIndexes('/api/shop/cart/')
+
+    def test_like_endpoints(self):
+        for url in ['/api/shop/likes/', '/api/shop/likes/?cursor=', '/api/shop/likes/ids/']:
+            with self.subTest(url=url):
+                self.assertUsesIndexes(url)
+
+    def test_order_endpoints(self):
+        for url in ['/api/shop/orders/', '/api/shop/orders/?cursor=', f'/api/shop/orders/{self.order.pk}/']:
+            with self.subTest(url=url):
+                self.assertUsesIndexes(url)
+
+    def test_orders_by_status(self):
+        queryset = Order.objects.filter(status='pending').order_by('created_at')
+        sql, params = queryset.query.sql_with_params()
+        plan = self.explain(sql, params)
+        self.assertFalse(self.full_scans(plan), '\n'.join(plan))
+
+    def test_suggestion_sync(self):
+        sql, params = changed_products(timezone.now()).query.sql_with_params()
+        plan = self.explain(sql, params)
+        self.assertFalse(self.full_scans(plan), '\n'.join(plan))
+
+
+class CategoryListQueryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def create_categories(self, count):
+        for i in range(Category.objects.count(), count):
+            category = Category.objects.create(name=f'Catégorie {i}', slug=f'category-{i}')
+            for j in range(3):
+                Product.objects.create(
+                    name=f'Livre {i}-{j}', slug=f'book-{i}-{j}', price=Decimal('5.00') + j,
+                    category=category, stock=j,
+                )
+
+    def test_queries_do_not_grow_with_categories(self):
+        for count in (1, 10):
+            with self.subTest(categories=count):
+                self.create_categories(count)
+                cache.clear()
+                # Categories, their stats, the page count and the page
+                with self.assertNumQueries(4):
+                    response = self.client.get('/api/shop/categories/')
+                results = response.json()['results']
+                self.assertEqual(len(results), count)
+                self.assertEqual({(category['product_count'], category['in_stock_count']) for category in results}, {(3, 2)})
+
+
+class SerializerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('serializers', password='x')
+        cls.category = Category.objects.create(name='Romans', slug='romans', description='Des romans')
+        Category.objects.create(name='Poésie', slug='poesie')
+        products = [
+            Product.objects.create(
+                name=f'Livre {i}', slug=f'book-{i}', description='Un roman', price=Decimal('9.99') + i,
+                category=cls.category, stock=i % 3, is_featured=i % 2 == 0, is_active=i != 3,
+            )
+            for i in range(6)
+        ]
+        Like.objects.create(user=cls.user, product=products[1])
+        cart = Cart.objects.create(user=cls.user)
+        CartItem.objects.create(cart=cart, product=products[2], quantity=2)
+        order = Order.objects.create(
+            user=cls.user, order_number='FAST000001', total_price=Decimal('11.99'),
+            payment_method='delivery', full_name='Fast', phone='0600000000',
+            address='1 rue de la Paix', city='Paris', postal_code='75002',
+        )
+        OrderItem.objects.create(order=order, product=products[2], quantity=1, price=Decimal('11.99'))
+
+    def get_content(self, url, fast):
+        cache.clear()
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with override_settings(SHOP_FAST_SERIALIZERS=fast):
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return b''.join(response.streaming_content) if response.streaming else response.content
+
+    def test_fast_serializers_match_drf(self):
+        urls = [
+            '/api/shop/products/',
+            '/api/shop/products/?cursor=',
+            '/api/shop/products/?fields=id,name,price',
+            '/api/shop/products/?omit=description',
+            '/api/shop/products/featured/',
+            '/api/shop/products/by_category/?slug=romans',
+            '/api/shop/categories/',
+            '/api/shop/cart/',
+            '/api/shop/orders/',
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.get_content(url, fast=True), self.get_content(url, fast=False))
+
+    def test_category_stats_without_context(self):
+        data = CategoryStatsSerializer(self.category).data
+        self.assertEqual((data['product_count'], data['min_price']), (0, None))
+
+
+class PaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Romans', slug='romans')
+        Product.objects.bulk_create([
+            Product(name=f'Livre {i}', slug=f'book-{i}', price=Decimal('9.99'), category=category)
+            for i in range(12)
+        ])
+
+    def test_keyset_pages(self):
+        client = APIClient()
+        url, slugs = '/api/shop/products/?cursor=&page_size=5', []
+        while url:
+            page = client.get(url).json()
+            self.assertLessEqual(len(page['results']), 5)
+            slugs.extend(product['slug'] for product in page['results'])
+            url = page['next']
+        self.assertCountEqual(slugs, [f'book-{i}' for i in range(12)])
+
+    def test_page_size(self):
+        client = APIClient()
+        self.assertEqual(len(client.get('/api/shop/products/?page_size=5').json()['results']), 5)
+        self.assertEqual(len(client.get('/api/shop/products/?page_size=1000').json()['results']), 12)
+
+
+class FacetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        romans = Category.objects.create(name='Romans', slug='romans')
+        cuisine = Category.objects.create(name='Cuisine', slug='cuisine')
+        for slug, price, stock, category, is_active in [
+            ('a', '5.00', 2, romans, True),
+            ('b', '15.00', 0, romans, True),
+            ('c', '60.00', 1, romans, True),
+            ('d', '25.00', 3, cuisine, True),
+            ('e', '8.00', 3, cuisine, False),
+        ]:
+            Product.objects.create(
+                name=slug, slug=slug, description='Un livre', price=Decimal(price), stock=stock,
+                category=category, is_active=is_active,
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def facets(self, **params):
+        return self.client.get('/api/shop/products/facets/', params).json()
+
+    def test_counts(self):
+        data = self.facets()
+        self.assertEqual((data['count'], data['in_stock']), (4, 3))
+        self.assertEqual([(row['slug'], row['count']) for row in data['categories']], [('cuisine', 1), ('romans', 3)])
+        self.assertEqual(
+            [(row['min'], row['max'], row['count']) for row in data['price_ranges']],
+            [(0, 10, 1), (10, 20, 1), (20, 50, 1), (50, 100, 1), (100, None, 0)],
+        )
+
+        data = self.facets(category='romans')
+        self.assertEqual((data['count'], data['in_stock']), (3, 2))
+        # The other categories keep their counts
+        self.assertEqual([(row['slug'], row['count']) for row in data['categories']], [('cuisine', 1), ('romans', 3)])
+
+    def test_product_change_invalidates(self):
+        self.assertEqual(self.facets()['price_ranges'][4]['count'], 0)
+        product = Product.objects.get(slug='c')
+        product.price = Decimal('120.00')
+        product.stock = 0
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        data = self.facets()
+        self.assertEqual(data['in_stock'], 2)
+        self.assertEqual([row['count'] for row in data['price_ranges']], [1, 1, 1, 0, 1])
+
+        category = Category.objects.get(slug='romans')
+        category.name = 'Aventures'
+        with self.captureOnCommitCallbacks(execute=True):
+            category.save()
+        self.assertEqual(
+            [(row['name'], row['count']) for row in self.facets()['categories']], [('Aventures', 3), ('Cuisine', 1)],
+        )
+
+
+class CatalogHeaderTests(TestCase):
+    URLS = [
+        '/api/shop/products/', '/api/shop/products/petit-prince/', '/api/shop/products/featured/',
+        '/api/shop/categories/', '/api/shop/categories/romans/',
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('headers', password='x')
+        category = Category.objects.create(name='Romans', slug='romans')
+        cls.product = Product.objects.create(
+            name='Le Petit Prince', slug='petit-prince', price=Decimal('8.50'), category=category,
+            stock=5, is_featured=True,
+        )
+        Like.objects.create(user=cls.user, product=cls.product)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_catalog_is_public(self):
+        for url in self.URLS:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                cache_control = response['Cache-Control'].replace(' ', '').split(',')
+                self.assertIn('public', cache_control)
+                self.assertIn('max-age=60', cache_control)
+                vary = response['Vary'].replace(' ', '').split(',')
+                self.assertIn('Accept', vary)
+                self.assertNotIn('Cookie', vary)
+
+    def test_catalog_has_no_user_data(self):
+        anonymous = {url: self.client.get(url).content for url in self.URLS}
+        cache.clear()
+        # A session that would authenticate likes/ requests
+        self.client.force_login(self.user)
+        for url in self.URLS:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.content, anonymous[url])
+                self.assertNotIn(b'is_liked', response.content)
+                self.assertNotIn('Cookie', response.get('Vary', ''))
+
+    def test_liked_ids_are_private(self):
+        client = APIClient()
+        self.assertIn(client.get('/api/shop/likes/ids/').status_code, (401, 403))
+        client.force_authenticate(self.user)
+        response = client.get('/api/shop/likes/ids/')
+        self.assertEqual(response.json(), {'product_ids': [self.product.pk]})
+        cache_control = response['Cache-Control'].replace(' ', '').split(',')
+        self.assertIn('private', cache_control)
+        self.assertIn('no-cache', cache_control)
+        self.assertNotIn('public', cache_control)
+
+
+class ConditionalRequestTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create_user(f'conditional-{i}', password='x') for i in range(2)]
+        cls.category = Category.objects.create(name='Romans', slug='romans')
+        cls.product = Product.objects.create(
+            name='Le Petit Prince', slug='petit-prince', price=Decimal('8.50'), category=cls.category, stock=5,
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def assertChanged(self, url, response):
+        """The new state is served whichever validator the client sends"""
+        for headers in [
+            {'HTTP_IF_NONE_MATCH': response['ETag']},
+            {'HTTP_IF_MODIFIED_SINCE': response.get('Last-Modified', 'Fri, 01 Jan 2100 00:00:00 GMT')},
+        ]:
+            self.assertEqual(self.client.get(url, **headers).status_code, 200)
+
+    def test_category_stats(self):
+        for url in ['/api/shop/categories/', '/api/shop/categories/romans/']:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertFalse(response.has_header('Last-Modified'))
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+                with self.captureOnCommitCallbacks(execute=True):
+                    Product.objects.create(
+                        name=url, slug=slugify(url), price=Decimal('3.00'), category=self.category,
+                    )
+                self.assertChanged(url, response)
+
+    def test_deleted_order(self):
+        orders = [
+            Order.objects.create(
+                user=self.users[0], order_number=f'CMD-{i}', total_price=Decimal('8.50'),
+                payment_method='delivery', full_name='Client', phone='0600000000',
+                address='1 rue de la Paix', city='Paris', postal_code='75002',
+            )
+            for i in range(2)
+        ]
+        response = self.client.get('/api/shop/orders/')
+        self.assertFalse(response.has_header('Last-Modified'))
+        orders[0].delete()
+        self.assertChanged('/api/shop/orders/', response)
+
+    def test_cart_etag_per_user(self):
+        etags = []
+        for user in self.users:
+            self.client.force_authenticate(user)
+            self.client.get('/api/shop/cart/')
+        # Both carts updated at the same moment
+        Cart.objects.update(updated_at=timezone.now().replace(microsecond=0))
+        for user in self.users:
+            self.client.force_authenticate(user)
+            etags.append(self.client.get('/api/shop/cart/')['ETag'])
+        self.assertNotEqual(etags[0], etags[1])
+        self.client.force_authenticate(self.users[0])
+        self.assertEqual(self.client.get('/api/shop/cart/', HTTP_IF_NONE_MATCH=etags[1]).status_code, 200)
+
+
+class CatalogCacheTests(TestCase):
+    """Cached catalog responses follow the writes that change them"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('cache', password='x')
+        cls.category = Category.objects.create(name='Romans', slug='romans')
+        cls.product = Product.objects.create(
+            name='Le Petit Prince', slug='petit-prince', price=Decimal('8.50'), category=cls.category, stock=5,
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def toggle_like(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/shop/likes/toggle/', {'product_id': self.product.pk}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_like_invalidates_product(self):
+        url = f'/api/shop/products/{self.product.slug}/'
+        first = self.client.get(url)
+        self.assertEqual(first['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+
+        self.toggle_like()
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['likes_count'], 1)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+
+    def test_like_invalidates_lists(self):
+        urls = ['/api/shop/products/?ordering=popular', f'/api/shop/products/?category={self.category.slug}']
+        for url in urls:
+            self.client.get(url)
+        self.toggle_like()
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response['X-Cache'], 'MISS')
+                self.assertEqual(response.json()['results'][0]['likes_count'], 1)
+
+    def test_like_keeps_other_lists(self):
+        self.client.get('/api/shop/products/?ordering=price')
+        self.toggle_like()
+        self.assertEqual(self.client.get('/api/shop/products/?ordering=price')['X-Cache'], 'HIT')
+
+    def test_cart_add_keeps_other_orderings(self):
+        self.client.get('/api/shop/products/?ordering=price')
+        self.client.get('/api/shop/products/?ordering=trending')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/shop/cart/add_item/', {'product_id': self.product.pk}, format='json')
+        self.assertEqual(self.client.get('/api/shop/products/?ordering=price')['X-Cache'], 'HIT')
+        self.assertEqual(self.client.get('/api/shop/products/?ordering=trending')['X-Cache'], 'MISS')
+
+    def test_order_keeps_concurrent_likes(self):
+        self.client.post('/api/shop/cart/add_item/', {'product_id': self.product.pk, 'quantity': 2}, format='json')
+        liked = []
+
+        def like_meanwhile(execute, sql, params, many, context):
+            result = execute(sql, params, many, context)
+            # Another request likes the product while the order is written
+            if not liked and sql.startswith('INSERT') and 'shop_orderitem' in sql:
+                liked.append(True)
+                Product.objects.filter(pk=self.product.pk).update(likes_count=F('likes_count') + 1)
+            return result
+
+        with connection.execute_wrapper(like_meanwhile):
+            response = self.client.post('/api/shop/orders/create_order/', {
+                'payment_method': 'delivery', 'full_name': 'Cache', 'phone': '0600000000',
+                'address': '1 rue de la Paix', 'city': 'Paris', 'postal_code': '75002',
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.likes_count), (3, 1))
+
+        response = self.client.post(f"/api/shop/orders/{response.json()['order']['id']}/cancel_order/")
+        self.assertEqual(response.status_code, 200)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.likes_count), (5, 1))
+
+
+class ProductAdminTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', password='x')
+        category = Category.objects.create(name='Romans', slug='romans')
+        cls.product = Product.objects.create(
+            name='Le Petit Prince', slug='petit-prince', description='Un conte', price=Decimal('8.50'),
+            category=category, stock=5,
+        )
+
+    def test_save_keeps_counters(self):
+        self.client.force_login(self.admin)
+        url = f'/admin/shop/product/{self.product.pk}/change/'
+        form = self.client.get(url).context['adminform'].form
+        data = {name: form[name].value() for name in form.fields}
+        data.update(name='Le Petit Prince (poche)', image='')
+        # Likes land while the page is open
+        Product.objects.filter(pk=self.product.pk).update(likes_count=3, trending_score=12.5)
+
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual(
+            (product.name, product.likes_count, product.trending_score), ('Le Petit Prince (poche)', 3, 12.5),
+        )
+
+
+class TrendingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('trending', password='x')
+        category = Category.objects.create(name='Romans', slug='romans')
+        cls.products = [
+            Product.objects.create(
+                name=name, slug=slugify(name), price=Decimal('8.50'), category=category, stock=10,
+            )
+            for name in ['Le Petit Prince', 'Le Rouge et le Noir']
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post(self, url, data=None, method='post'):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)(f'/api/shop/{url}', data, format='json')
+        self.assertIn(response.status_code, (200, 201), response.content)
+        return response
+
+    def trending(self):
+        response = self.client.get('/api/shop/products/?ordering=trending')
+        return [product['slug'] for product in response.json()['results']]
+
+    def test_like_moves_product_up(self):
+        first, second = self.products
+        self.assertEqual(self.trending(), [second.slug, first.slug])
+        self.post('likes/toggle/', {'product_id': first.pk})
+        self.assertEqual(self.trending(), [first.slug, second.slug])
+        self.post('likes/toggle/', {'product_id': first.pk})
+        self.assertEqual(self.trending(), [second.slug, first.slug])
+
+    def test_scores_match_rebuild(self):
+        first, second = self.products
+        self.post('likes/toggle/', {'product_id': second.pk})
+        self.post('cart/add_item/', {'product_id': first.pk, 'quantity': 2})
+        item = self.post('cart/add_item/', {'product_id': second.pk, 'quantity': 3}).json()['items'][-1]
+        self.post('cart/add_item/', {'product_id': first.pk, 'quantity': 1})
+        self.post('cart/update_item/', {'item_id': item['id'], 'quantity': 1}, method='patch')
+        self.post('orders/create_order/', {
+            'payment_method': 'delivery', 'full_name': 'Trending', 'phone': '0600000000',
+            'address': '1 rue de la Paix', 'city': 'Paris', 'postal_code': '75002',
+        })
+        self.post('cart/add_item/', {'product_id': second.pk, 'quantity': 4})
+        self.post('cart/clear/', method='delete')
+
+        rebuilt = compute_scores()
+        now = timezone.now()
+        for product in self.products:
+            product.refresh_from_db()
+            with self.subTest(product=product.slug):
+                self.assertAlmostEqual(score_now(product.trending_score, now), score_now(rebuilt[product.pk], now))
+
+
+class RecommendationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Romans', slug='romans')
+        cls.products = {
+            slug: Product.objects.create(name=slug, slug=slug, price=Decimal('5.00'), category=category)
+            for slug in 'abcd'
+        }
+        users = [User.objects.create_user(f'reader-{i}', password='x') for i in range(4)]
+        # a: 3 readers, b: 3, c: 2, d: 2; a+b and a+c twice, every other pair once
+        for user, slugs in zip(users, ['abc', 'ab', 'acd', 'bd']):
+            for slug in slugs:
+                Like.objects.create(user=user, product=cls.products[slug])
+        # a+b in two orders; a+c only in cancelled ones
+        for i, (status, slugs) in enumerate([
+            ('pending', 'ab'), ('delivered', 'abb'), ('cancelled', 'ac'), ('cancelled', 'ac'),
+        ]):
+            order = Order.objects.create(
+                user=users[0], order_number=f'CMD-{i}', total_price=Decimal('10.00'), status=status,
+                payment_method='delivery', full_name='Lecteur', phone='0600000000',
+                address='1 rue de la Paix', city='Paris', postal_code='75002',
+            )
+            for slug in slugs:
+                OrderItem.objects.create(order=order, product=cls.products[slug], quantity=1, price=Decimal('5.00'))
+
+    def neighbours(self, kind):
+        recommendations = ProductRecommendation.objects.filter(kind=kind).order_by('product__slug', 'rank')
+        result = {}
+        for product, recommended, score, together in recommendations.values_list(
+            'product__slug', 'recommended__slug', 'score', 'together',
+        ):
+            result.setdefault(product, []).append((recommended, round(score, 3), together))
+        return result
+
+    def test_cosine_ranks(self):
+        recommendations.rebuild('liked', min_support=1)
+        # a+c and a+b both have two readers; c has fewer readers, so it ranks first
+        self.assertEqual(self.neighbours('liked')['a'], [('c', 0.816, 2), ('b', 0.667, 2), ('d', 0.408, 1)])
+
+    def test_min_support(self):
+        recommendations.rebuild('liked', min_support=2)
+        self.assertEqual(self.neighbours('liked'), {
+            'a': [('c', 0.816, 2), ('b', 0.667, 2)], 'b': [('a', 0.667, 2)], 'c': [('a', 0.816, 2)],
+        })
+        # A rebuild drops the pairs that fell under the threshold
+        recommendations.rebuild('liked', min_support=3)
+        self.assertEqual(self.neighbours('liked'), {})
+
+    def test_cancelled_orders_are_ignored(self):
+        recommendations.rebuild('bought', min_support=1)
+        # An order listing b twice counts once
+        self.assertEqual(self.neighbours('bought'), {'a': [('b', 1.0, 2)], 'b': [('a', 1.0, 2)]})
+
+    def test_endpoint(self):
+        call_command('rebuild_recommendations', stdout=io.StringIO())
+        client = APIClient()
+        data = client.get('/api/shop/products/a/recommendations/').json()
+        self.assertEqual(
+            {kind: [product['slug'] for product in data[kind]] for kind in ('liked', 'bought')},
+            {'liked': ['c', 'b'], 'bought': ['b']},
+        )
+        self.assertEqual(data['liked'][0]['id'], self.products['c'].pk)
+        data = client.get('/api/shop/products/d/recommendations/').json()
+        self.assertEqual((data['liked'], data['bought']), ([], []))
+        self.assertEqual(client.get('/api/shop/products/nope/recommendations/').status_code, 404)
+
+
+class SimilarityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        romans = Category.objects.create(name='Romans', slug='romans')
+        cuisine = Category.objects.create(name='Cuisine', slug='cuisine')
+        for slug, name, description, category in [
+            ('petit-prince', 'Le Petit Prince', "Un aviateur perdu dans le désert rencontre un prince venu d'une planète.", romans),
+            ('terre-hommes', 'Terre des hommes', "Souvenirs d'un aviateur de l'Aéropostale, du désert au ciel.", romans),
+            ('vol-nuit', 'Vol de nuit', "Un aviateur affronte l'orage au-dessus de la cordillère.", romans),
+            ('tajines', 'Tajines et couscous', 'Recettes de cuisine marocaine : épices, semoule et légumes.', cuisine),
+            ('patisserie', 'Pâtisserie facile', 'Recettes de gâteaux, tartes et épices douces.', cuisine),
+        ]:
+            Product.objects.create(name=name, slug=slug, description=description, category=category, price=Decimal('5.00'))
+
+    def neighbours(self, slug):
+        return list(
+            ProductRecommendation.objects.filter(product__slug=slug, kind='similar')
+            .order_by('rank').values_list('recommended__slug', flat=True)
+        )
+
+    def test_rebuild(self):
+        call_command('rebuild_similarity', stdout=io.StringIO())
+        self.assertEqual(self.neighbours('petit-prince')[:2], ['terre-hommes', 'vol-nuit'])
+        self.assertEqual(self.neighbours('tajines'), ['patisserie'])
+        self.assertNotIn('tajines', self.neighbours('vol-nuit'))
+        data = APIClient().get('/api/shop/products/petit-prince/recommendations/').json()
+        self.assertEqual([product['slug'] for product in data['similar']][:2], ['terre-hommes', 'vol-nuit'])
+
+    def test_title_change(self):
+        call_command('rebuild_similarity', stdout=io.StringIO())
+        product = Product.objects.get(slug='patisserie')
+        product.name = 'Le désert du petit prince'
+        product.description = "Un aviateur dans le désert, et la planète d'un prince."
+        product.save()
+        # Its own list, and the list of the book it now resembles
+        self.assertEqual(self.neighbours('patisserie')[0], 'petit-prince')
+        self.assertEqual(self.neighbours('petit-prince')[0], 'patisserie')
+        # Saving other fields leaves the index alone
+        product = Product.objects.get(slug='petit-prince')
+        with self.assertNumQueries(1):
+            product.save(update_fields=['stock'])
+
+
+class CompressionTests(TestCase):
+    URL = '/api/shop/products/book-1/'
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Romans', slug='romans')
+        Product.objects.bulk_create([
+            Product(name=f'Livre {i}', slug=f'book-{i}', description='Un roman ' * 100, price=i, category=category)
+            for i in range(10)
+        ])
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.plain = self.client.get(self.URL)
+
+    def assertCompressed(self, encoding, decompress):
+        # A miss, then a hit served from the cached variant
+        cache.clear()
+        for cached in ('MISS', 'HIT'):
+            response = self.client.get(self.URL, HTTP_ACCEPT_ENCODING=f'{encoding}, identity')
+            with self.subTest(encoding=encoding, cached=cached):
+                self.assertEqual(response['X-Cache'], cached)
+                self.assertEqual(response['Content-Encoding'], encoding)
+                self.assertEqual(decompress(response.content), self.plain.content)
+                self.assertEqual(response['Content-Length'], str(len(response.content)))
+                self.assertIn('Accept-Encoding', response['Vary'])
+                self.assertEqual(response['ETag'], 'W/' + self.plain['ETag'])
+
+                not_modified = self.client.get(
+                    self.URL, HTTP_ACCEPT_ENCODING=encoding, HTTP_IF_NONE_MATCH=response['ETag'],
+                )
+                self.assertEqual(not_modified.status_code, 304)
+
+    def test_gzip(self):
+        self.assertCompressed('gzip', gzip.decompress)
+
+    @skipIf(brotli is None, 'brotli is not installed')
+    def test_brotli(self):
+        self.assertCompressed('br', brotli.decompress)
+
+    def test_identity(self):
+        response = self.client.get(self.URL, HTTP_ACCEPT_ENCODING='gzip;q=0, identity')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.content, self.plain.content)
+
+    def test_html_is_not_compressed(self):
+        # No BREACH oracle on pages carrying CSRF tokens
+        response = self.client.get(self.URL, {'format': 'api'}, HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertTrue(response['Content-Type'].startswith('text/html'))
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_stream(self):
+        chunks = [f'{i},'.encode() * 100 for i in range(20)]
+        encodings = {'gzip': gzip.decompress, **({'br': brotli.decompress} if brotli else {})}
+        for encoding, decompress in encodings.items():
+            with self.subTest(encoding=encoding):
+                compressed = b''.join(compress_stream(iter(chunks), encoding, get_level(encoding)))
+                self.assertEqual(decompress(compressed), b''.join(chunks))
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        romans = Category.objects.create(name='Romans', slug='romans')
+        for slug, name, description in [
+            ('etranger', "L'Étranger", 'Meursault, un été à Alger.'),
+            ('petit-prince', 'Le Petit Prince', "Un aviateur rencontre un enfant venu d'une planète."),
+            # Newer, and only its description mentions a prince
+            ('citadelle', 'Citadelle', 'Les pensées du prince berbère sur son royaume.'),
+        ]:
+            Product.objects.create(name=name, slug=slug, description=description, category=romans, price=Decimal('5.00'))
+
+    def search(self, query):
+        response = self.client.get('/api/shop/products/', {'search': query})
+        return [product['slug'] for product in response.json()['results']]
+
+    def test_accents_are_ignored(self):
+        for query in ('etranger', 'ÉTRANGER', 'ete alger', 'Été'):
+            with self.subTest(query=query):
+                self.assertEqual(self.search(query), ['etranger'])
+
+    def test_name_matches_rank_first(self):
+        self.assertEqual(self.search('prince'), ['petit-prince', 'citadelle'])
+        # The last word may be unfinished
+        self.assertEqual(self.search('aviat'), ['petit-prince'])
+
+    def test_icontains_fallback(self):
+        backend = get_search_backend()
+        self.assertIsInstance(backend, SQLiteSearchBackend)
+        # Inside words: the full-text index matches word prefixes only
+        self.assertFalse(Product.objects.search('tranger').exists())
+        with mock.patch.dict(search_module._installed, {backend.cache_key: False}):
+            self.assertEqual(
+                list(Product.objects.search('tranger').values_list('slug', flat=True)), ['etranger'],
+            )
+            self.assertEqual(
+                set(Product.objects.search('PRINCE').values_list('slug', flat=True)), {'petit-prince', 'citadelle'},
+            )
+            self.assertFalse(Product.objects.search('prince alger').exists())
+            self.assertFalse(Product.objects.search('  ').exists())
+
+
+class SpellingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Romans', slug='romans')
+        for name, description in [
+            ('Le Petit Prince', 'Le prince et la rose'),
+            ('Le Rouge et le Noir', 'Un roman de Stendhal, un roman rouge'),
+            ('Le Petit Chose', 'Un roman'),
+        ]:
+            Product.objects.create(
+                name=name, slug=slugify(name), description=description, price=Decimal('8.50'), category=category,
+            )
+        rebuild_spelling()
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def search(self, query):
+        return self.client.get('/api/shop/products/', {'search': query}).json()
+
+    def test_corrections(self):
+        self.assertEqual(corrections('pettit prnice')[0], 'petit prince')
+        self.assertEqual(corrections('rmoan rouge')[0], 'roman rouge')
+        self.assertEqual(corrections('petit prince'), [])
+        self.assertEqual(corrections('xqzwv'), [])
+
+    def test_corrected_search(self):
+        data = self.search('pettit')
+        self.assertEqual(data['suggestions'][0], 'petit')
+        self.assertEqual(data['corrected_search'], 'petit')
+        self.assertCountEqual(
+            [product['slug'] for product in data['results']], ['le-petit-prince', 'le-petit-chose'],
+        )
+
+    @override_settings(SHOP_SPELLING_CORRECT_RESULTS=False)
+    def test_suggestions_only(self):
+        data = self.search('pettit')
+        self.assertEqual((data['results'], data['suggestions'][0]), ([], 'petit'))
+        self.assertNotIn('corrected_search', data)
+
+    def test_found_or_unknown(self):
+        for query in ('petit', 'xqzwv'):
+            with self.subTest(query=query):
+                data = self.search(query)
+                self.assertNotIn('suggestions', data)
+                self.assertNotIn('corrected_search', data)
+
+
+class ImportCatalogTests(TemporaryMediaMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Romans', slug='romans')
+        Product.objects.create(
+            name='Ancien titre', slug='petit-prince', price=Decimal('5.00'), category=cls.category, stock=1,
+        )
+
+    def import_catalog(self, suffix, content, **options):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, encoding='utf-8', delete=False) as file:
+            file.write(content)
+        self.addCleanup(os.remove, file.name)
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('import_catalog', file.name, stdout=stdout, stderr=stderr, **options)
+        self.output = stdout.getvalue()
+        return stderr.getvalue()
+
+    def test_upsert(self):
+        errors = self.import_catalog('.csv', (
+            'slug,name,price,category,stock,is_featured\n'
+            'petit-prince,Le Petit Prince,8.50,romans,4,yes\n'
+            'rouge-noir,Le Rouge et le Noir,12,romans,,no\n'
+        ))
+        self.assertEqual(errors, '')
+        products = Product.objects.order_by('slug')
+        self.assertEqual(
+            list(products.values_list('slug', 'name', 'price', 'stock', 'is_featured')),
+            [
+                ('petit-prince', 'Le Petit Prince', Decimal('8.50'), 4, True),
+                ('rouge-noir', 'Le Rouge et le Noir', Decimal('12.00'), 0, False),
+            ],
+        )
+
+    def test_invalid_rows_are_skipped(self):
+        errors = self.import_catalog('.jsonl', '\n'.join([
+            '{"slug": "bon", "name": "Bon", "price": "3", "category": "romans"}',
+            '{"slug": "prix", "name": "Prix", "price": "gratuit", "category": "romans"}',
+            '{"slug": "rayon", "name": "Rayon", "price": "3", "category": "poesie"}',
+            '{"slug": "image", "name": "Image", "price": "3", "category": "romans", "image": 42}',
+            '{"slug": "url", "name": "Url", "price": "3", "category": "romans", "image": "https://x.test/a.jpg"}',
+            'pas du JSON',
+            '["slug"]',
+        ]))
+        self.assertCountEqual(
+            [line.split(':')[0] for line in errors.splitlines()],
+            ['Line 2', 'Line 3', 'Line 4', 'Line 5', 'Line 6', 'Line 7'],
+        )
+        self.assertEqual(
+            set(Product.objects.values_list('slug', flat=True)), {'petit-prince', 'bon'},
+        )
+
+    def test_images(self):
+        storage = self.storage
+        old, new = (storage.save('products/cover.png', png_file(color)) for color in ('red', 'blue'))
+        product = Product.objects.get(slug='petit-prince')
+        product.image = old
+        product.save()
+        self.assertTrue(product.image_derivatives)
+
+        rows = (
+            'slug,name,price,category,image\n'
+            f'petit-prince,Le Petit Prince,8.50,romans,{new}\n'
+            f'rouge-noir,Le Rouge et le Noir,12,romans,{new}\n'
+            'manque,Manque,3,romans,products/missing.png\n'
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            errors = self.import_catalog('.csv', rows)
+        self.assertIn('products/missing.png: no such file', errors)
+        self.assertIn('2 new images: run generate_image_derivatives', self.output)
+        self.assertEqual(dict(MediaBlob.objects.values_list('name', 'ref_count')), {new: 2})
+        self.assertFalse(storage.exists(old))
+        product.refresh_from_db()
+        self.assertEqual((product.image.name, product.image_derivatives), (new, {}))
+
+        # Unchanged images keep their placeholder and references
+        Product.objects.filter(image=new).update(image_blurhash='LEHV6nWB2yk8')
+        self.import_catalog('.csv', rows)
+        self.assertNotIn('new images', self.output)
+        self.assertEqual(dict(MediaBlob.objects.values_list('name', 'ref_count')), {new: 2})
+        self.assertEqual(Product.objects.get(slug='rouge-noir').image_blurhash, 'LEHV6nWB2yk8')
+
+    def test_malformed_image_urls_are_skipped(self):
+        urls = ['http://exa mple.com/a.jpg', 'http://h:abc/x', 'http://[::1/x']
+        errors = self.import_catalog('.jsonl', '\n'.join(
+            json.dumps({'slug': f'url-{i}', 'name': 'Url', 'price': '3', 'category': 'romans', 'image': url})
+            for i, url in enumerate(urls)
+        ), fetch_images=True)
+        self.assertEqual(len(errors.splitlines()), len(urls))
+        self.assertFalse(Product.objects.filter(slug__startswith='url-').exists())
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('export', password='x', is_staff=True)
+        cls.user = User.objects.create_user('customer', password='x')
+        category = Category.objects.create(name='Romans', slug='romans')
+        cls.since = timezone.now() - timedelta(hours=1)
+        # Updated long before, just before (within the overlap) and after since
+        for slug, age in [('ancien', 120), ('limite', 30), ('nouveau', -60)]:
+            product = Product.objects.create(
+                name=slug.title(), slug=slug, description='Un roman, "cité"',
+                price=Decimal('8.50'), category=category, stock=2,
+            )
+            Product.objects.filter(pk=product.pk).update(
+                updated_at=cls.since - timedelta(seconds=age),
+            )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def export(self, name='products', **params):
+        response = self.client.get(f'/api/shop/exports/{name}/', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header('X-Export-Started-At'))
+        return b''.join(response.streaming_content)
+
+    def test_staff_only(self):
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get('/api/shop/exports/products/').status_code, 403)
+        self.assertEqual(self.client.get('/api/shop/exports/').status_code, 403)
+
+    def test_csv(self):
+        rows = list(csv.DictReader(io.StringIO(self.export(output='csv').decode('utf-8'))))
+        self.assertEqual(
+            [(row['id'], row['slug'], row['description'], row['price'], row['category']) for row in rows],
+            [
+                (str(pk), slug, 'Un roman, "cité"', '8.50', 'romans')
+                for pk, slug in Product.objects.order_by('pk').values_list('pk', 'slug')
+            ],
+        )
+
+    def test_jsonl(self):
+        rows = [json.loads(line) for line in self.export(output='jsonl').splitlines()]
+        self.assertEqual(
+            [(row['id'], row['slug'], row['price'], row['stock'], row['image']) for row in rows],
+            [
+                (pk, slug, '8.50', 2, '')
+                for pk, slug in Product.objects.order_by('pk').values_list('pk', 'slug')
+            ],
+        )
+
+    def test_updated_since(self):
+        rows = self.export(output='jsonl', updated_since=self.since.isoformat()).splitlines()
+        # 'limite' is older than since but within OVERLAP
+        self.assertEqual([json.loads(row)['slug'] for row in rows], ['limite', 'nouveau'])
+        response = self.client.get('/api/shop/exports/products/', {'updated_since': 'hier'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_gzip(self):
+        for output in ('csv', 'jsonl'):
+            with self.subTest(output=output):
+                self.assertEqual(
+                    gzip.decompress(self.export(output=output, gzip='1')), self.export(output=output),
+                )
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'products.jsonl.gz')
+            call_command(
+                'export_data', 'products', output_format='jsonl', gzip=True,
+                updated_since=self.since.isoformat(), output=path, stderr=io.StringIO(),
+            )
+            with open(path, 'rb') as file:
+                written = gzip.decompress(file.read())
+        self.assertEqual(written, self.export(output='jsonl', updated_since=self.since.isoformat()))
+
+
+class ImageDerivativeTests(TemporaryMediaMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Romans', slug='romans')
+
+    def create_product(self, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Product.objects.create(
+                name='Livre', slug='livre', price=Decimal('5.00'), category=self.category, image=image,
+            )
+
+    def test_derivatives(self):
+        product = self.create_product(png_file('red', size=(300, 150)))
+        product.refresh_from_db()
+        self.assertEqual((product.image_width, product.image_height), (300, 150))
+        # Never upscaled: 300 stands in for 400 and 800
+        self.assertEqual(list(product.image_derivatives), ['webp', 'jpeg'])
+        for format, pillow_format in [('webp', 'WEBP'), ('jpeg', 'JPEG')]:
+            entries = product.image_derivatives[format]
+            self.assertEqual([width for width, _ in entries], [200, 300])
+            for width, name in entries:
+                with self.subTest(format=format, width=width), self.storage.open(name, 'rb') as file:
+                    with Image.open(file) as image:
+                        self.assertEqual((image.format, image.size), (pillow_format, (width, width // 2)))
+
+        data = APIClient().get(f'/api/shop/products/{product.slug}/').json()
+        self.assertEqual((data['image_width'], data['image_height']), (300, 150))
+        self.assertEqual(data['image_srcset'], {
+            format: ', '.join(f'http://testserver{self.storage.url(name)} {width}w' for width, name in entries)
+            for format, entries in product.image_derivatives.items()
+        })
+
+    def test_exif_rotation(self):
+        buffer = io.BytesIO()
+        exif = Image.Exif()
+        # Orientation 6: shown turned a quarter clockwise
+        exif[0x0112] = 6
+        Image.new('RGB', (300, 150), 'blue').save(buffer, 'JPEG', exif=exif)
+        product = self.create_product(ContentFile(buffer.getvalue(), name='cover.jpg'))
+        self.assertEqual((product.image_width, product.image_height), (150, 300))
+        self.assertEqual([width for width, _ in product.image_derivatives['jpeg']], [150])
+
+
+class PlaceholderTests(SimpleTestCase):
+    def test_blurhash(self):
+        # Hashes from the reference encoder (github.com/woltapp/blurhash)
+        quarter_red = Image.new('RGB', (40, 40), 'blue')
+        quarter_red.paste((255, 0, 0), (0, 0, 20, 20))
+        for image, expected in [
+            (Image.new('RGB', (32, 32), 'black'), 'L00000fQfQfQfQfQfQfQfQfQfQfQ'),
+            (Image.new('RGB', (32, 24), (255, 0, 0)), 'LDTI:j]9fQ]9|co1fQo1fQfQfQfQ'),
+            (quarter_red, 'LsFwRn|Un~Jr|U;un~N|n~n~jsa}'),
+        ]:
+            with self.subTest(expected=expected):
+                self.assertEqual(blurhash(image, 4, 3), expected)
+
+    def test_placeholder(self):
+        image = Image.new('RGBA', (300, 150), (0, 0, 255, 255))
+        image.paste((255, 0, 0, 255), (0, 0, 100, 50))
+        placeholder = get_placeholder(image)
+        self.assertEqual(placeholder['image_color'], '#0000ff')
+        # 4 x 3 components: 6 characters and 2 per AC component
+        self.assertRegex(placeholder['image_blurhash'], r'^L.{27}$')
+
+
+class MediaStorageTests(TemporaryMediaMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Romans', slug='romans')
+
+    def create_product(self, slug, color):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Product.objects.create(
+                name=slug, slug=slug, price=Decimal('5.00'), category=self.category, image=png_file(color),
+            )
+
+    def stored_files(self):
+        names = []
+        for directory, _, files in os.walk(self.storage.location):
+            names += [os.path.relpath(os.path.join(directory, name), self.storage.location) for name in files]
+        return sorted(name.replace(os.sep, '/') for name in names)
+
+    def derivative_names(self, product):
+        return [name for entries in product.image_derivatives.values() for _, name in entries]
+
+    def test_retain_release(self):
+        MediaBlob.objects.retain('products/a.png')
+        MediaBlob.objects.retain('products/a.png')
+        self.assertFalse(MediaBlob.objects.release('products/a.png'))
+        self.assertTrue(MediaBlob.objects.release('products/a.png'))
+        self.assertFalse(MediaBlob.objects.filter(name='products/a.png').exists())
+        self.assertFalse(MediaBlob.objects.release('products/a.png'))
+
+    def test_identical_uploads_share_one_file(self):
+        first = self.create_product('premier', 'red')
+        files = self.stored_files()
+        second = self.create_product('second', 'red')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(self.stored_files(), files)
+        self.assertEqual(first.image_derivatives, second.image_derivatives)
+        self.assertEqual(MediaBlob.objects.get(name=first.image.name).ref_count, 2)
+
+    def test_replaced_image_is_released(self):
+        product = self.create_product('livre', 'red')
+        old, old_derivatives = product.image.name, self.derivative_names(product)
+        with self.captureOnCommitCallbacks(execute=True):
+            product.image = png_file('blue')
+            product.save()
+        self.assertNotEqual(product.image.name, old)
+        self.assertEqual(dict(MediaBlob.objects.values_list('name', 'ref_count')), {product.image.name: 1})
+        self.assertEqual(
+            self.stored_files(), sorted([product.image.name, *self.derivative_names(product)]),
+        )
+        for name in [old, *old_derivatives]:
+            self.assertFalse(self.storage.exists(name))
+
+    def test_file_deleted_with_last_reference(self):
+        first = self.create_product('premier', 'red')
+        second = self.create_product('second', 'red')
+        name = first.image.name
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(self.storage.exists(name))
+        self.assertEqual(MediaBlob.objects.get(name=name).ref_count, 1)
+
+        # A count that drifted low doesn't delete a file a product still uses
+        third = Product.objects.create(name='trois', slug='trois', price=Decimal('5.00'), category=self.category)
+        Product.objects.filter(pk=third.pk).update(image=name, image_derivatives=second.image_derivatives)
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertTrue(self.storage.exists(name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            MediaBlob.objects.retain(name)
+            Product.objects.get(pk=third.pk).delete()
+        self.assertEqual(self.stored_files(), [])
+        self.assertFalse(MediaBlob.objects.exists())
+
+    def test_dedupe_media(self):
+        # Files saved before content-addressed names, one of them twice
+        names = [
+            FileSystemStorage.save(self.storage, f'products/{name}.png', png_file(color))
+            for name, color in [('un', 'red'), ('copie', 'red'), ('autre', 'blue')]
+        ]
+        for i, name in enumerate(names):
+            product = Product.objects.create(
+                name=f'p{i}', slug=f'p{i}', price=Decimal('5.00'), category=self.category,
+            )
+            Product.objects.filter(pk=product.pk).update(image=name)
+        MediaBlob.objects.create(name='products/orphan.png', ref_count=3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('dedupe_media', stdout=io.StringIO())
+        images = list(Product.objects.order_by('slug').values_list('image', flat=True))
+        self.assertEqual(images[0], images[1])
+        self.assertNotEqual(images[0], images[2])
+        self.assertEqual(self.stored_files(), sorted(set(images)))
+        self.assertEqual(
+            dict(MediaBlob.objects.values_list('name', 'ref_count')), {images[0]: 2, images[2]: 1},
+        )
+
+
+class ResizeTests(TemporaryMediaMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        cache_settings = override_settings(SHOP_RESIZE_CACHE_DIR=cache_dir)
+        cache_settings.enable()
+        self.addCleanup(cache_settings.disable)
+        self.name = self.storage.save('products/cover.png', png_file('red', size=(400, 300)))
+
+    def url(self, size, name):
+        return f'/media/resize/{size}/{name}'
+
+    def test_resize(self):
+        response = self.client.get(self.url('100x100', self.name))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        with Image.open(io.BytesIO(b''.join(response.streaming_content))) as image:
+            self.assertEqual(image.size, (100, 75))
+        self.assertRegex(response['ETag'], r'^"[0-9a-f]{64}"$')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+
+        not_modified = self.client.get(self.url('100x100', self.name), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+
+    def test_second_request_is_cached(self):
+        with mock.patch('shop.resize.resize', wraps=resize.resize) as resize_mock:
+            first = self.client.get(self.url('0x50', self.name))
+            second = self.client.get(self.url('0x50', self.name))
+        self.assertEqual(resize_mock.call_count, 1)
+        self.assertEqual(first['ETag'], second['ETag'])
+        self.assertEqual(b''.join(first.streaming_content), b''.join(second.streaming_content))
+
+    def test_rejected_paths(self):
+        for name in ['products/../../settings.py', '../products/cover.png', '/etc/passwd', 'other/cover.png']:
+            with self.subTest(name=name):
+                with self.assertRaises(resize.ResizeError):
+                    resize.get_variant(name, 100, 100)
+        self.assertEqual(self.client.get(self.url('100x100', 'products/../../db.sqlite3')).status_code, 404)
+        self.assertEqual(self.client.get(self.url('100x100', 'products/missing.png')).status_code, 404)
+        self.assertEqual(self.client.get(self.url('0x0', self.name)).status_code, 400)
+        self.assertEqual(self.client.get(self.url('5000x10', self.name)).status_code, 400)
+
+    def test_eviction(self):
+        paths = [resize.get_variant(self.name, width, 0)[0] for width in (50, 60, 70)]
+        # The first one is the least recently used
+        now = time.time()
+        for age, path in zip((300, 200, 100), paths):
+            os.utime(path, (now - age, now - age))
+        sizes = [path.stat().st_size for path in paths]
+
+        self.assertEqual(resize.evict(sum(sizes)), 0)
+        self.assertEqual(resize.evict(sum(sizes) - 1), 1)
+        self.assertEqual([path.exists() for path in paths], [False, True, True])
+        # A deleted variant is made again
+        self.assertEqual(resize.get_variant(self.name, 50, 0)[0], paths[0])
+        self.assertTrue(paths[0].exists())
+
+
+class SuggestTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Poésie', slug='poesie')
+        for name, likes_count, is_active in [
+            ('Le Petit Prince', 3, True), ('Petits poèmes', 8, True), ('Petit secret', 20, False),
+        ]:
+            Product.objects.create(
+                name=name, slug=slugify(name), price=Decimal('8.50'), category=cls.category,
+                likes_count=likes_count, is_active=is_active,
+            )
+
+    def setUp(self):
+        # The index is built once per process, from another test's rows
+        suggest._suggestions.clear()
+        self.addCleanup(suggest._suggestions.clear)
+        self.client = APIClient()
+
+    def suggest(self, query):
+        data = self.client.get('/api/shop/products/suggest/', {'q': query}).json()
+        return [product['name'] for product in data['products']], [category['name'] for category in data['categories']]
+
+    def test_suggest(self):
+        self.assertEqual(self.suggest('pet'), (['Petits poèmes', 'Le Petit Prince'], []))
+        self.assertEqual(self.suggest('petit pr'), (['Le Petit Prince'], []))
+        self.assertEqual(self.suggest('POE'), (['Petits poèmes'], ['Poésie']))
+        self.assertEqual(self.suggest(''), ([], []))
+
+    def test_saved_products_are_indexed(self):
+        self.suggest('pet')
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(
+                name='Petite histoire', slug='petite-histoire', price=Decimal('5'), category=self.category,
+                likes_count=5,
+            )
+        self.assertEqual(self.suggest('pet')[0], ['Petits poèmes', 'Petite histoire', 'Le Petit Prince'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.delete()
+        self.assertEqual(self.suggest('pet')[0], ['Petits poèmes', 'Le Petit Prince'])
+
+
+class SuggestionIndexTests(SimpleTestCase):
+    WORDS = ['livre', 'lire', 'roman', 'rouge', 'petit', 'prince', 'poème', 'page']
+
+    def name(self):
+        return ' '.join(random.sample(self.WORDS, 3))
+
+    def test_search(self):
+        index = Suggestions().products
+        index.load([(1, 'Le Petit Prince', 3), (2, 'Petits poèmes', 8), (3, 'Le Rouge et le Noir', 5)])
+        self.assertEqual(index.search('pet'), [2, 1])
+        self.assertEqual(index.search('petit pri'), [1])
+        self.assertEqual(index.search('poeme'), [2])
+        self.assertEqual(index.search('noir x'), [])
+
+        index.add(1, 'Le Petit Prince', 10)
+        self.assertEqual(index.search('pet'), [1, 2])
+        index.remove(2)
+        self.assertEqual(index.search('pet'), [1])
+
+    def test_search_while_writing(self):
+        suggestions = Suggestions()
+        suggestions.products.load([(pk, self.name(), random.randint(0, 9)) for pk in range(2000)])
+        queries = ['l', 'li', 'livre r', 'roman p', 'p', 'petit prin']
+        errors = []
+        done = threading.Event()
+
+        def read():
+            try:
+                for _ in range(3000):
+                    suggestions.products.search(random.choice(queries))
+            except Exception as error:
+                errors.append(error)
+
+        def write():
+            while not done.is_set():
+                pk = random.randint(0, 2500)
+                if random.random() < 0.5:
+                    suggestions.update_product(pk, self.name(), True, random.randint(0, 9))
+                else:
+                    suggestions.remove_product(pk)
+
+        # Switch threads as often as possible, to interleave them mid-search
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        writers = [threading.Thread(target=write) for _ in range(2)]
+        try:
+            for thread in readers + writers:
+                thread.start()
+            for thread in readers:
+                thread.join()
+        finally:
+            done.set()
+            for thread in writers:
+                thread.join()
+            sys.setswitchinterval(interval)
+        self.assertEqual(errors, [])
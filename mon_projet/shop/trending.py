@@ -0,0 +1,108 @@
+"""
+Time-decayed trending score of products.
+
+Likes, cart adds and ordered quantities each count SHOP_TRENDING_WEIGHTS,
+halving every SHOP_TRENDING_HALF_LIFE_HOURS. Rather than decaying every
+score as time passes, each event is added already scaled by how far it
+happened after EPOCH:
+
+    Product.trending_score = sum(weight * 2 ** (hours since EPOCH / half-life))
+
+Every score decays by the same factor at any moment, so ordering by the
+stored column is ordering by the decayed scores: events update one row with
+an F() increment, and the column can be indexed. score_now() gives the
+decayed value when the number itself is needed.
+
+The scale doubles every half-life, which floats hold for a few hundred
+half-lives (about eight years at 72 hours). Moving EPOCH forward, or
+changing the half-life or weights, needs `manage.py rebuild_trending`,
+which recomputes the scores from the Like, CartItem and OrderItem tables.
+Carts only keep the items still in them, so items leaving a cart (removed,
+or ordered at checkout) take their cart add back, and a cart item counts
+from when it was added whatever its later quantity changes: the rebuild
+then gives the scores events left.
+"""
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .cache import invalidate_counters
+from .models import CartItem, Like, OrderItem, Product
+
+
+EPOCH = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def get_half_life():
+    """In seconds"""
+    return getattr(settings, 'SHOP_TRENDING_HALF_LIFE_HOURS', 72) * 3600
+
+
+def get_weights():
+    return {'like': 1, 'cart': 2, 'order': 4, **getattr(settings, 'SHOP_TRENDING_WEIGHTS', {})}
+
+
+def scale(when):
+    return 2 ** ((when - EPOCH).total_seconds() / get_half_life())
+
+
+def increment(event, quantity=1, when=None):
+    """What an event adds to trending_score; negate it to take the event back"""
+    return get_weights()[event] * quantity * scale(when or timezone.now())
+
+
+def score_now(trending_score, now=None):
+    """The decayed value of a stored trending_score"""
+    return trending_score / scale(now or timezone.now())
+
+
+def record(product, event, quantity=1, when=None):
+    Product.objects.filter(pk=product.pk).update(
+        trending_score=F('trending_score') + increment(event, quantity, when)
+    )
+    # update() sends no post_save
+    invalidate_counters(product, likes=False)
+
+
+def forget(product, event, quantity=1, when=None):
+    """Take back an event recorded at when"""
+    Product.objects.filter(pk=product.pk).update(
+        # Never below zero, whatever the rounding
+        trending_score=Greatest(F('trending_score') - increment(event, quantity, when), 0.0)
+    )
+    invalidate_counters(product, likes=False)
+
+
+def record_cart_change(product, added_at, previous, quantity):
+    """
+    Score a cart item going from previous to quantity (0 once it leaves the
+    cart), counted when it was added as compute_scores() counts it
+    """
+    if quantity > previous:
+        record(product, 'cart', quantity - previous, added_at)
+    elif quantity < previous:
+        forget(product, 'cart', previous - quantity, added_at)
+
+
+def compute_scores():
+    """
+    {product id: trending_score} recomputed from the stored history, where
+    carts only remember the items still in them
+    """
+    history = [
+        ('like', Like.objects.values_list('product_id', 'created_at')),
+        ('cart', CartItem.objects.values_list('product_id', 'added_at', 'quantity')),
+        (
+            'order',
+            OrderItem.objects.exclude(order__status='cancelled')
+            .values_list('product_id', 'order__created_at', 'quantity'),
+        ),
+    ]
+    scores = {}
+    for event, rows in history:
+        for product_id, when, *quantity in rows.order_by().iterator(chunk_size=5000):
+            scores[product_id] = scores.get(product_id, 0) + increment(event, *quantity, when=when)
+    return scores
@@ -1,7 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import CategoryViewSet, ProductViewSet, CartViewSet, LikeViewSet
-from .views import CategoryViewSet, ProductViewSet, CartViewSet, LikeViewSet, OrderViewSet
+from .views import CategoryViewSet, ProductViewSet, CartViewSet, LikeViewSet, OrderViewSet, ExportViewSet
 
 router = DefaultRouter()
 router.register(r'categories', CategoryViewSet, basename='category')
@@ -9,6 +9,7 @@ router.register(r'products', ProductViewSet, basename='product')
 router.register(r'cart', CartViewSet, basename='cart')
 router.register(r'likes', LikeViewSet, basename='like')
 router.register(r'orders', OrderViewSet, basename='order') 
+router.register(r'exports', ExportViewSet, basename='export')
 
 urlpatterns = [
     path('', include(router.urls)),
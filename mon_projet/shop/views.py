@@ -1,54 +1,392 @@
 from django.shortcuts import render, get_object_or_404
+from django.http import FileResponse, Http404, HttpResponseBadRequest, StreamingHttpResponse
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, Prefetch, Q, prefetch_related_objects
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
+from rest_framework.utils.urls import replace_query_param
 import random
 import string
 
-from .models import Category, Product, Cart, CartItem, Like, Order, OrderItem
+from .cache import (
+    RANKING_TAG, CachedResponseMixin, category_likes_tag, category_products_tag, get_cache, get_tag_versions,
+    invalidate_counters, invalidate_tags, product_tag, versioned_key,
+)
+from .conditional import Validators
+from .exports import EXPORTS, FORMATS, get_filename, iter_export, parse_updated_since, to_primitive
+from .fast_serializers import FastSerializer, fast_serializers_enabled
+from .models import Category, Product, Cart, CartItem, Like, Order, OrderItem, ProductRecommendation
+from .pagination import KeysetPagination
+from .renderers import StreamingResponseMixin
+from .resize import InvalidSize, ResizeError, get_variant
+from .spelling import corrections
+from .suggest import get_suggestions
+from .trending import forget, increment, record, record_cart_change
 from .serializers import (
-    CategorySerializer, ProductSerializer, 
+    CategorySerializer, CategoryStatsSerializer, CatalogProductSerializer, ProductListSerializer,
     CartSerializer, CartItemSerializer, LikeSerializer,
     OrderSerializer, CreateOrderSerializer
 )
 
 
-class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
+class PublicCatalogMixin:
+    """
+    Catalog responses are identical for every visitor, so they skip
+    authentication (which would add Vary: Cookie through the session) and
+    are marked publicly cacheable. Per-user state such as liked products
+    comes from likes/ids/.
+    """
+    authentication_classes = []
+    
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if request.method in ('GET', 'HEAD') and response.status_code == 200:
+            patch_cache_control(
+                response, public=True,
+                max_age=getattr(settings, 'SHOP_CATALOG_MAX_AGE', 60),
+            )
+            patch_vary_headers(response, ['Accept'])
+        return response
+
+
+class FastListMixin:
+    """
+    With SHOP_FAST_SERIALIZERS on, list() reads values() rows and builds the
+    same output through FastSerializer instead of the DRF serializer.
+    """
+    def get_fast_serializer(self):
+        return FastSerializer(self.get_serializer_class(), context=self.get_serializer_context())
+    
+    def list(self, request, *args, **kwargs):
+        if not fast_serializers_enabled():
+            return super().list(request, *args, **kwargs)
+        
+        fast = self.get_fast_serializer()
+        # created_at is needed for keyset cursors
+        rows = fast.values(self.filter_queryset(self.get_queryset()), 'created_at')
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(fast.serialize(page))
+        return Response(fast.serialize(rows))
+
+
+class CategoryViewSet(CachedResponseMixin, PublicCatalogMixin, FastListMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Category.objects.all()
-    serializer_class = CategorySerializer
+    serializer_class = CategoryStatsSerializer
     permission_classes = [AllowAny]
     lookup_field = 'slug'
+    cache_tags = ['category', 'product']
+    
+    category_stats = {}
+    
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['category_stats'] = self.category_stats
+        return context
+    
+    def list(self, request, *args, **kwargs):
+        categories = list(Category.objects.values_list('pk', 'updated_at'))
+        self.category_stats = self.get_category_stats([pk for pk, _ in categories])
+        # No Last-Modified: product changes move the stats, not updated_at,
+        # so only the ETag tells the lists apart
+        validators = Validators(
+            request,
+            None,
+            max((updated_at for _, updated_at in categories), default=None),
+            len(categories),
+            sorted(self.category_stats.items()),
+        )
+        return validators.not_modified() or validators.apply(
+            super().list(request, *args, **kwargs)
+        )
+    
+    def retrieve(self, request, *args, **kwargs):
+        state = Category.objects.filter(slug=kwargs['slug']).values_list('pk', 'updated_at').first()
+        if state is None:
+            return super().retrieve(request, *args, **kwargs)
+        
+        pk, updated_at = state
+        self.category_stats = self.get_category_stats([pk])
+        # As in list(), the stats only show in the ETag
+        validators = Validators(request, None, updated_at, self.category_stats[pk])
+        return validators.not_modified() or validators.apply(
+            super().retrieve(request, *args, **kwargs)
+        )
+    
+    def get_category_stats(self, category_ids):
+        """
+        Active product count, in-stock count and price range per category.
+        Each category's entry stays cached until one of its products changes;
+        missing entries are computed together in one grouped query.
+        """
+        cache = get_cache()
+        versions = get_tag_versions([category_products_tag(pk) for pk in category_ids])
+        keys = {
+            pk: f'shop:category-stats:{pk}:{version}'
+            for pk, version in zip(category_ids, versions)
+        }
+        cached = cache.get_many(keys.values())
+        stats = {pk: cached[key] for pk, key in keys.items() if key in cached}
+        
+        missing = [pk for pk in category_ids if pk not in stats]
+        if missing:
+            computed = {pk: dict(CategoryStatsSerializer.EMPTY_STATS) for pk in missing}
+            rows = (
+                Product.objects.filter(is_active=True, category__in=missing)
+                .order_by()
+                .values('category')
+                .annotate(
+                    product_count=Count('pk'),
+                    in_stock_count=Count('pk', filter=Q(stock__gt=0)),
+                    min_price=Min('price'),
+                    max_price=Max('price'),
+                )
+            )
+            for row in rows:
+                computed[row.pop('category')] = row
+            cache.set_many(
+                {keys[pk]: value for pk, value in computed.items()},
+                getattr(settings, 'SHOP_CATEGORY_STATS_CACHE_TIMEOUT', None),
+            )
+            stats.update(computed)
+        return stats
 
 
-class ProductViewSet(viewsets.ReadOnlyModelViewSet):
+class ProductViewSet(CachedResponseMixin, PublicCatalogMixin, FastListMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Product.objects.filter(is_active=True)
-    serializer_class = ProductSerializer
+    serializer_class = CatalogProductSerializer
     permission_classes = [AllowAny]
+    pagination_class = KeysetPagination
     lookup_field = 'slug'
+    cached_actions = ['list', 'retrieve', 'featured', 'by_category', 'recommendations']
+    cache_tags = ['product', 'category']
+    
+    # Upper bounds of the price facet buckets; the last bucket is open-ended
+    price_buckets = [10, 20, 50, 100]
+    
+    # ?ordering= values, each served by an index; without one (or with an
+    # unknown one) lists stay newest first, or best match first for ?search=
+    orderings = {
+        'trending': ['-trending_score', '-id'],
+        'popular': ['-likes_count', '-id'],
+        'price': ['price', 'id'],
+        '-price': ['-price', '-id'],
+    }
+    
+    def get_cache_tags(self, request, action, kwargs):
+        # Likes only invalidate the pages they show in, see invalidate_counters()
+        tags = list(self.cache_tags)
+        if action == 'retrieve':
+            tags.append(product_tag(kwargs['slug']))
+        category_slug = request.GET.get({'list': 'category', 'by_category': 'slug'}.get(action, ''))
+        if category_slug:
+            tags.append(category_likes_tag(category_slug))
+        if request.GET.get('ordering') in ('trending', 'popular') or action == 'featured':
+            tags.append(RANKING_TAG)
+        return tags
+    
+    def get_serializer_class(self):
+        if self.action == 'retrieve':
+            return CatalogProductSerializer
+        return ProductListSerializer
     
     def get_queryset(self):
-        queryset = super().get_queryset()
-        
+        queryset = self.only_serialized_fields(super().get_queryset().for_listing())
+        return self.order_products(self.filter_products(queryset))
+    
+    def only_serialized_fields(self, queryset, joins=True):
+        """
+        Load only the columns the (possibly ?fields= trimmed) serializer
+        reads. Without joins, related objects are left for the caller to set.
+        """
+        paths = self.get_serializer().get_only_fields()
+        if not joins:
+            paths = [path.split('__')[0] for path in paths]
+        # Joins that no selected field reads can't stay in select_related
+        related = {path.split('__')[0] for path in paths if '__' in path}
+        queryset = queryset.select_related(None)
+        if related:
+            queryset = queryset.select_related(*related)
+        # created_at is needed for keyset cursors
+        return queryset.only('id', 'created_at', *paths)
+    
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        search = request.query_params.get('search')
+        if not search or response.data['results']:
+            return response
+        
+        # Nothing found: offer "did you mean" corrections, see shop.spelling
+        suggestions = corrections(search)
+        if not suggestions:
+            return response
+        if getattr(settings, 'SHOP_SPELLING_CORRECT_RESULTS', True):
+            self.corrected_search = suggestions[0]
+            response = super().list(request, *args, **kwargs)
+            response.data['corrected_search'] = self.corrected_search
+            # Further pages search for the correction directly
+            for link in ('next', 'previous'):
+                if response.data.get(link):
+                    response.data[link] = replace_query_param(response.data[link], 'search', self.corrected_search)
+        response.data['suggestions'] = suggestions
+        return response
+    
+    def retrieve(self, request, *args, **kwargs):
+        state = self.queryset.filter(slug=kwargs['slug']).values_list(
+            'updated_at', 'category__updated_at'
+        ).first()
+        if state is None:
+            return super().retrieve(request, *args, **kwargs)
+        
+        validators = Validators(request, max(state))
+        return validators.not_modified() or validators.apply(
+            super().retrieve(request, *args, **kwargs)
+        )
+    
+    def filter_products(self, queryset, with_category=True, rank=True):
+        """Apply the ?category=, ?featured= and ?search= filters"""
         category_slug = self.request.query_params.get('category', None)
-        if category_slug:
+        if category_slug and with_category:
             queryset = queryset.filter(category__slug=category_slug)
         
         is_featured = self.request.query_params.get('featured', None)
         if is_featured:
             queryset = queryset.filter(is_featured=True)
         
-        search = self.request.query_params.get('search', None)
+        search = getattr(self, 'corrected_search', None) or self.request.query_params.get('search', None)
         if search:
-            queryset = queryset.filter(name__icontains=search)
+            queryset = queryset.search(search, rank=rank)
         
         return queryset
     
+    def order_products(self, queryset):
+        """Apply ?ordering=; keyset pagination only serves the default order"""
+        ordering = self.orderings.get(self.request.query_params.get('ordering'))
+        if ordering:
+            queryset = queryset.order_by(*ordering)
+        return queryset
+    
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        """Category, price range and stock counts for the current filters"""
+        params = request.query_params
+        key = '|'.join([
+            params.get('category', ''),
+            '1' if params.get('featured') else '',
+            ' '.join(params.get('search', '').lower().split()),
+        ])
+        cache_key = versioned_key('shop:facets', key, self.cache_tags)
+        cache = get_cache()
+        
+        data = cache.get(cache_key)
+        if data is None:
+            data = self.compute_facets()
+            cache.set(cache_key, data, getattr(settings, 'SHOP_FACETS_CACHE_TIMEOUT', 300))
+        return Response(data)
+    
+    def compute_facets(self):
+        products = self.filter_products(self.queryset.order_by(), rank=False)
+        
+        bounds = [0] + self.price_buckets + [None]
+        aggregates = {'count': Count('pk'), 'in_stock': Count('pk', filter=Q(stock__gt=0))}
+        for i, (low, high) in enumerate(zip(bounds, bounds[1:])):
+            price_filter = Q(price__gte=low)
+            if high is not None:
+                price_filter &= Q(price__lt=high)
+            aggregates[f'price_{i}'] = Count('pk', filter=price_filter)
+        totals = products.aggregate(**aggregates)
+        
+        # Category counts ignore ?category= so the other categories stay
+        # selectable with their counts.
+        categories = (
+            self.filter_products(self.queryset.order_by(), with_category=False, rank=False)
+            .values('category__id', 'category__slug', 'category__name')
+            .annotate(count=Count('pk'))
+            .order_by('category__name')
+        )
+        
+        return {
+            'count': totals['count'],
+            'in_stock': totals['in_stock'],
+            'categories': [
+                {
+                    'id': row['category__id'],
+                    'slug': row['category__slug'],
+                    'name': row['category__name'],
+                    'count': row['count'],
+                }
+                for row in categories
+            ],
+            'price_ranges': [
+                {'min': low, 'max': high, 'count': totals[f'price_{i}']}
+                for i, (low, high) in enumerate(zip(bounds, bounds[1:]))
+            ],
+        }
+    
     @action(detail=False, methods=['get'])
     def featured(self, request):
-        featured_products = self.queryset.filter(is_featured=True)[:10]
-        serializer = self.get_serializer(featured_products, many=True)
-        return Response(serializer.data)
+        """Up to 10 featured products; ?fallback=trending fills the rest with trending ones"""
+        if fast_serializers_enabled():
+            serialize = self.get_fast_serializer().data
+        else:
+            serialize = lambda products: self.get_serializer(products, many=True).data
+        
+        products = self.only_serialized_fields(self.queryset.for_listing())
+        data = list(serialize(products.filter(is_featured=True)[:10]))
+        if request.query_params.get('fallback') == 'trending' and len(data) < 10:
+            trending = products.filter(is_featured=False).order_by(*self.orderings['trending'])
+            data += serialize(trending[:10 - len(data)])
+        return Response(data)
+    
+    @action(detail=True, methods=['get'])
+    def recommendations(self, request, slug=None):
+        """Also liked / bought together / similar books, see shop.recommendations and shop.similarity"""
+        # One query: the slug index leads to the (product, kind, rank) index
+        products = (
+            self.only_serialized_fields(self.queryset.for_listing())
+            .filter(recommended_by__product__slug=slug)
+            .annotate(recommendation_kind=F('recommended_by__kind'))
+            .order_by('recommended_by__kind', 'recommended_by__rank')
+        )
+        groups = {kind: [] for kind, _ in ProductRecommendation.KIND_CHOICES}
+        if fast_serializers_enabled():
+            fast = self.get_fast_serializer()
+            rows = list(fast.values(products, 'recommendation_kind'))
+            for row in rows:
+                groups[row['recommendation_kind']].append(row)
+            data = {kind: fast.serialize(group) for kind, group in groups.items()}
+        else:
+            for product in products:
+                groups[product.recommendation_kind].append(product)
+            data = {kind: self.get_serializer(page, many=True).data for kind, page in groups.items()}
+        
+        if not any(groups.values()):
+            get_object_or_404(self.queryset, slug=slug)
+        return Response(data)
+    
+    @action(detail=False, methods=['get'])
+    def suggest(self, request):
+        """Products and categories for the search box as ?q= is typed, see shop.suggest"""
+        suggestions = get_suggestions()
+        query = request.query_params.get('q', '')
+        product_ids = suggestions.products.search(query)
+        category_ids = suggestions.categories.search(query)
+        
+        # The index trails other processes by a few seconds: the rows decide
+        products = Product.objects.filter(pk__in=product_ids, is_active=True).values('id', 'name', 'slug')
+        products = {product['id']: product for product in products}
+        categories = Category.objects.filter(pk__in=category_ids).values('id', 'name', 'slug')
+        categories = {category['id']: category for category in categories}
+        return Response({
+            'products': [products[pk] for pk in product_ids if pk in products],
+            'categories': [categories[pk] for pk in category_ids if pk in categories],
+        })
     
     @action(detail=False, methods=['get'])
     def by_category(self, request):
@@ -67,22 +405,55 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
                 'error': 'Category not found'
             }, status=status.HTTP_404_NOT_FOUND)
         
-        products = self.queryset.filter(category=category)
-        serializer = self.get_serializer(products, many=True)
-        
+        products = self.order_products(
+            self.only_serialized_fields(self.queryset.for_listing(), joins=False).filter(category=category)
+        )
+        if fast_serializers_enabled():
+            fast = self.get_fast_serializer()
+            data = fast.serialize(self.paginate_queryset(fast.values(products, 'created_at')))
+        else:
+            page = self.paginate_queryset(products)
+            # They all belong to the category loaded above
+            for product in page:
+                product.category = category
+            data = self.get_serializer(page, many=True).data
+        
+        # count/next/previous (or next alone with ?cursor=), products for results
+        paginated = self.get_paginated_response(data).data
         return Response({
             'category': CategorySerializer(category).data,
-            'products': serializer.data
+            **{('products' if key == 'results' else key): value for key, value in paginated.items()},
         })
 
 
 class CartViewSet(viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
     
+    def get_cart_data(self, request, cart):
+        """Serialize the cart with its items and products loaded in fixed queries"""
+        if fast_serializers_enabled():
+            fast = FastSerializer(CartSerializer, context={'user': request.user})
+            return fast.data(Cart.objects.filter(pk=cart.pk))[0]
+        
+        prefetch_related_objects(
+            [cart],
+            'items',
+            Prefetch('items__product', queryset=Product.objects.for_listing(request.user)),
+        )
+        return CartSerializer(cart).data
+    
     def list(self, request):
         cart, created = Cart.objects.get_or_create(user=request.user)
-        serializer = CartSerializer(cart)
-        return Response(serializer.data)
+        
+        # Item changes touch the cart; product edits (price, stock, likes)
+        # touch the products.
+        state = CartItem.objects.filter(cart=cart).aggregate(Max('product__updated_at'))
+        last_modified = max(filter(None, [cart.updated_at, state['product__updated_at__max']]))
+        # Every user's cart has the same URL
+        validators = Validators(request, last_modified, request.user.pk)
+        return validators.not_modified() or validators.apply(
+            Response(self.get_cart_data(request, cart))
+        )
     
     @action(detail=False, methods=['post'])
     def add_item(self, request):
@@ -108,9 +479,10 @@ class CartViewSet(viewsets.ViewSet):
         if not created:
             cart_item.quantity += quantity
             cart_item.save()
+        record_cart_change(product, cart_item.added_at, cart_item.quantity - quantity, cart_item.quantity)
         
-        serializer = CartSerializer(cart)
-        return Response(serializer.data)
+        cart.save(update_fields=['updated_at'])
+        return Response(self.get_cart_data(request, cart))
     
     @action(detail=False, methods=['patch'])
     def update_item(self, request):
@@ -121,16 +493,18 @@ class CartViewSet(viewsets.ViewSet):
         if not item_id or quantity is None:
             return Response({'error': 'item_id and quantity are required'}, status=400)
         
-        cart_item = get_object_or_404(CartItem, id=item_id, cart=cart)
+        cart_item = get_object_or_404(CartItem.objects.select_related('product'), id=item_id, cart=cart)
+        previous = cart_item.quantity
         
         if int(quantity) <= 0:
             cart_item.delete()
         else:
-            cart_item.quantity = quantity
+            cart_item.quantity = int(quantity)
             cart_item.save()
+        record_cart_change(cart_item.product, cart_item.added_at, previous, max(int(quantity), 0))
         
-        serializer = CartSerializer(cart)
-        return Response(serializer.data)
+        cart.save(update_fields=['updated_at'])
+        return Response(self.get_cart_data(request, cart))
     
     @action(detail=False, methods=['delete'])
     def remove_item(self, request):
@@ -140,29 +514,50 @@ class CartViewSet(viewsets.ViewSet):
         if not item_id:
             return Response({'error': 'item_id is required'}, status=400)
         
-        cart_item = get_object_or_404(CartItem, id=item_id, cart=cart)
+        cart_item = get_object_or_404(CartItem.objects.select_related('product'), id=item_id, cart=cart)
         cart_item.delete()
+        record_cart_change(cart_item.product, cart_item.added_at, cart_item.quantity, 0)
         
-        serializer = CartSerializer(cart)
-        return Response(serializer.data)
+        cart.save(update_fields=['updated_at'])
+        return Response(self.get_cart_data(request, cart))
     
     @action(detail=False, methods=['delete'])
     def clear(self, request):
         cart = get_object_or_404(Cart, user=request.user)
+        for cart_item in cart.items.select_related('product'):
+            record_cart_change(cart_item.product, cart_item.added_at, cart_item.quantity, 0)
         cart.items.all().delete()
         
-        serializer = CartSerializer(cart)
-        return Response(serializer.data)
+        cart.save(update_fields=['updated_at'])
+        return Response(self.get_cart_data(request, cart))
 
 
-class LikeViewSet(viewsets.ViewSet):
+class LikeViewSet(StreamingResponseMixin, viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
     
     def list(self, request):
-        likes = Like.objects.filter(user=request.user).select_related('product')
+        likes = Like.objects.filter(user=request.user).prefetch_related(
+            Prefetch('product', queryset=Product.objects.for_listing(request.user))
+        )
+        
+        # Unpaginated unless the client asks for keyset pages with ?cursor=
+        paginator = KeysetPagination()
+        if paginator.is_keyset_request(request):
+            page = paginator.paginate_queryset(likes, request, view=self)
+            serializer = LikeSerializer(page, many=True, context={'request': request})
+            return paginator.get_paginated_response(serializer.data)
+        
         serializer = LikeSerializer(likes, many=True, context={'request': request})
         return Response(serializer.data)
     
+    @action(detail=False, methods=['get'])
+    def ids(self, request):
+        """IDs of the products the user likes, to overlay on cached catalog pages"""
+        product_ids = Like.objects.filter(user=request.user).values_list('product_id', flat=True)
+        response = Response({'product_ids': list(product_ids)})
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+    
     @action(detail=False, methods=['post'])
     def toggle(self, request):
         product_id = request.data.get('product_id')
@@ -171,20 +566,37 @@ class LikeViewSet(viewsets.ViewSet):
             return Response({'error': 'product_id is required'}, status=400)
         
         try:
-            product = Product.objects.get(id=product_id, is_active=True)
+            product = Product.objects.select_related('category').get(id=product_id, is_active=True)
         except Product.DoesNotExist:
             return Response({'error': 'Product not found'}, status=404)
         
-        like, created = Like.objects.get_or_create(user=request.user, product=product)
-        
-        if not created:
-            like.delete()
-            return Response({'liked': False, 'message': 'Product unliked'})
+        # The counter moves in the same transaction as the Like row
+        with transaction.atomic():
+            like, created = Like.objects.get_or_create(user=request.user, product=product)
+            # update() sends no post_save
+            invalidate_counters(product)
+            
+            if not created:
+                deleted, _ = Like.objects.filter(pk=like.pk).delete()
+                if deleted:
+                    Product.objects.filter(pk=product.pk).update(
+                        # Never below zero, even if the counter drifted
+                        likes_count=Greatest(F('likes_count') - 1, 0),
+                        trending_score=Greatest(F('trending_score') - increment('like', when=like.created_at), 0.0),
+                        updated_at=timezone.now(),
+                    )
+                return Response({'liked': False, 'message': 'Product unliked'})
+            
+            Product.objects.filter(pk=product.pk).update(
+                likes_count=F('likes_count') + 1,
+                trending_score=F('trending_score') + increment('like', when=like.created_at),
+                updated_at=timezone.now(),
+            )
         
         return Response({'liked': True, 'message': 'Product liked'})
 
 
-class OrderViewSet(viewsets.ViewSet):
+class OrderViewSet(StreamingResponseMixin, viewsets.ViewSet):
     """
     Order management - requires authentication
     """
@@ -193,14 +605,44 @@ class OrderViewSet(viewsets.ViewSet):
     def list(self, request):
         """Get user's orders"""
         orders = Order.objects.filter(user=request.user).prefetch_related('items')
-        serializer = OrderSerializer(orders, many=True)
-        return Response(serializer.data)
+        
+        state = orders.aggregate(Max('updated_at'), Count('pk'))
+        # No Last-Modified: deleting an order leaves the latest updated_at
+        # as it was, only the count in the ETag changes
+        validators = Validators(request, None, request.user.pk, state['updated_at__max'], state['pk__count'])
+        not_modified = validators.not_modified()
+        if not_modified:
+            return not_modified
+        
+        if fast_serializers_enabled():
+            fast = FastSerializer(OrderSerializer)
+            orders = fast.values(orders, 'created_at')
+            serialize = fast.serialize
+        else:
+            serialize = lambda rows: OrderSerializer(rows, many=True).data
+        
+        # Unpaginated unless the client asks for keyset pages with ?cursor=
+        paginator = KeysetPagination()
+        if paginator.is_keyset_request(request):
+            page = paginator.paginate_queryset(orders, request, view=self)
+            return validators.apply(paginator.get_paginated_response(serialize(page)))
+        
+        return validators.apply(Response(serialize(orders)))
     
     def retrieve(self, request, pk=None):
         """Get single order details"""
+        updated_at = Order.objects.filter(id=pk, user=request.user).values_list('updated_at', flat=True).first()
+        if updated_at is None:
+            raise Http404('No Order matches the given query.')
+        
+        validators = Validators(request, updated_at)
+        not_modified = validators.not_modified()
+        if not_modified:
+            return not_modified
+        
         order = get_object_or_404(Order, id=pk, user=request.user)
         serializer = OrderSerializer(order)
-        return Response(serializer.data)
+        return validators.apply(Response(serializer.data))
     
     @action(detail=False, methods=['post'])
     def create_order(self, request):
@@ -263,12 +705,19 @@ class OrderViewSet(viewsets.ViewSet):
                 price=cart_item.product.price
             )
             
-            # Update product stock
-            cart_item.product.stock -= cart_item.quantity
-            cart_item.product.save()
+            # Update product stock without save(), which would write back
+            # the counters loaded above over concurrent likes
+            Product.objects.filter(pk=cart_item.product_id).update(
+                stock=F('stock') - cart_item.quantity, updated_at=timezone.now(),
+            )
+            invalidate_tags('product', category_products_tag(cart_item.product.category_id))
+            record(cart_item.product, 'order', cart_item.quantity, order.created_at)
+            # The cart add gives way to the order, as in compute_scores()
+            record_cart_change(cart_item.product, cart_item.added_at, cart_item.quantity, 0)
         
         # Clear cart
         cart.items.all().delete()
+        cart.save(update_fields=['updated_at'])
         
         # Return order details
         order_serializer = OrderSerializer(order)
@@ -289,8 +738,11 @@ class OrderViewSet(viewsets.ViewSet):
         
         # Restore stock
         for item in order.items.all():
-            item.product.stock += item.quantity
-            item.product.save()
+            Product.objects.filter(pk=item.product_id).update(
+                stock=F('stock') + item.quantity, updated_at=timezone.now(),
+            )
+            invalidate_tags('product', category_products_tag(item.product.category_id))
+            forget(item.product, 'order', item.quantity, order.created_at)
         
         order.status = 'cancelled'
         order.save()
@@ -299,4 +751,66 @@ class OrderViewSet(viewsets.ViewSet):
         return Response({
             'message': 'Order cancelled successfully',
             'order': serializer.data
-        })
\ No newline at end of file
+        })
+
+
+class ExportViewSet(viewsets.ViewSet):
+    """
+    Staff-only dumps of products, orders and order items, streamed.
+    
+    exports/<name>/?output=csv|jsonl&updated_since=<ISO 8601>&gzip=1
+    """
+    permission_classes = [IsAdminUser]
+    
+    def list(self, request):
+        return Response({'exports': list(EXPORTS), 'formats': list(FORMATS)})
+    
+    def retrieve(self, request, pk=None):
+        if pk not in EXPORTS:
+            raise Http404('No such export.')
+        
+        # Not ?format=, which DRF reads to pick a renderer
+        format = request.query_params.get('output', 'csv')
+        if format not in FORMATS:
+            return Response({'error': f'output must be one of {", ".join(FORMATS)}'}, status=400)
+        
+        updated_since = request.query_params.get('updated_since')
+        if updated_since:
+            try:
+                updated_since = parse_updated_since(updated_since)
+            except ValueError as e:
+                return Response({'error': str(e)}, status=400)
+        else:
+            updated_since = None
+        
+        gzip = request.query_params.get('gzip') in ('1', 'true')
+        started_at = timezone.now()
+        response = StreamingHttpResponse(
+            iter_export(pk, format, updated_since, gzip),
+            content_type='application/gzip' if gzip else FORMATS[format],
+        )
+        filename = get_filename(pk, format, gzip, updated_since)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        # The updated_since of the next incremental export
+        response['X-Export-Started-At'] = to_primitive(started_at)
+        patch_cache_control(response, private=True, no_store=True)
+        return response
+
+
+def resize_image(request, width, height, path):
+    """A product image scaled to fit width x height, see shop.resize"""
+    try:
+        variant, content_type = get_variant(path, width, height)
+    except InvalidSize as e:
+        return HttpResponseBadRequest(str(e))
+    except ResizeError as e:
+        raise Http404(str(e))
+    
+    # The variant's name is the hash of its content and parameters
+    etag = f'"{variant.stem}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = FileResponse(open(variant, 'rb'), content_type=content_type)
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=31536000, immutable=True)
+    return response